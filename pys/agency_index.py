@@ -0,0 +1,235 @@
+import os
+import sys
+import csv
+import json
+import numpy as np
+import pandas as pd
+from embedding_store import load_ids, load_store, save_store, as_float32
+from contract_reader import iter_batches
+from temporal import month_index, month_label
+import metrics
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+LEVELS = ("department", "subtier", "office")
+COLUMNS = {"department": "Department", "subtier": "SubTier", "office": "Office"}
+BLOCK_ROWS = 65_536  # Store rows summed per block for centroids
+PERIOD_MONTHS = 12  # Time bin width for count tables
+
+# ---------------------------
+# AGENCY INDEX
+# Built once from contracttodep.py output and saved next to the store it
+# is aligned with:
+#
+#   50d_embeddings.agency.npz
+#     department, subtier, office   int32 code per store row (-1 unknown)
+#     month                         int32 PostedDate month (-1 unknown)
+#     <level>_names                 label per code
+#     <level>_parent                code of the level above, per code
+#
+# Sub-tiers and offices are coded by their full path, so the same office
+# name under two departments stays two offices. Every aggregation below is
+# a mask plus np.bincount / np.unique over these arrays; the CSVs are never
+# read again.
+# ---------------------------
+def index_path(store_path):
+    return os.path.splitext(store_path)[0] + ".agency.npz"
+
+def _read_hierarchy(hierarchy_csv, wanted):
+    header = pd.read_csv(hierarchy_csv, nrows=0, encoding='utf-8').columns
+    columns = ["NoticeId"] + [COLUMNS[lvl] for lvl in LEVELS]
+    if "PostedDate" in header:
+        columns.append("PostedDate")
+    else:
+        print(f"{hierarchy_csv} has no PostedDate column (rerun contracttodep.py); "
+              "time aggregation will be empty")
+    parts = [batch[batch["NoticeId"].isin(wanted)]
+             for batch in iter_batches(hierarchy_csv, columns=columns)]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True).drop_duplicates("NoticeId")
+
+def build(store_path, hierarchy_csv):
+    ids = load_ids(store_path)
+    with metrics.stage("read_hierarchy"):
+        table = _read_hierarchy(hierarchy_csv, set(ids))
+    rows = pd.Index(table["NoticeId"]).get_indexer(ids)  # -1: CAP rows, unknown ids
+    found = rows >= 0
+    print(f"{int(found.sum())} of {len(ids)} store rows have an agency")
+
+    arrays = {}
+    path = None
+    parent = None
+    for lvl in LEVELS:
+        # Each level is coded by its path from the department down
+        names = table[COLUMNS[lvl]].replace("", "(none)")
+        path = names if path is None else path + " / " + names
+        codes, uniques = pd.factorize(path, sort=True)
+        codes = codes.astype(np.int32)
+        arrays[f"{lvl}_names"] = np.asarray(uniques, dtype=str)
+        if parent is not None:
+            first = np.unique(codes, return_index=True)[1]
+            arrays[f"{lvl}_parent"] = parent[first]
+        else:
+            arrays[f"{lvl}_parent"] = np.full(len(uniques), -1, dtype=np.int32)
+        arrays[lvl] = np.where(found, codes[rows], -1).astype(np.int32)
+        parent = codes
+
+    if "PostedDate" in table:
+        months = month_index(table["PostedDate"]).astype(np.int32)
+        arrays["month"] = np.where(found, months[rows], -1).astype(np.int32)
+    else:
+        arrays["month"] = np.full(len(ids), -1, dtype=np.int32)
+
+    out = index_path(store_path)
+    tmp = out + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, out)
+    print(f"Agency index saved to {out}: "
+          + ", ".join(f"{len(arrays[f'{lvl}_names'])} {lvl}" for lvl in LEVELS))
+    return AgencyIndex(out)
+
+def load(store_path):
+    path = index_path(store_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(store_path):
+        raise FileNotFoundError(f"{path} missing or older than the store; run "
+                                f"`python agency_index.py build {store_path} hierarchy.csv`")
+    return AgencyIndex(path)
+
+class AgencyIndex:
+    def __init__(self, path):
+        with np.load(path) as z:
+            self.codes = {lvl: z[lvl] for lvl in LEVELS}
+            self.names = {lvl: z[f"{lvl}_names"] for lvl in LEVELS}
+            self.parent = {lvl: z[f"{lvl}_parent"] for lvl in LEVELS}
+            self.month = z["month"]
+
+    def __len__(self):
+        return len(self.month)
+
+    def code_of(self, level, name):
+        # Exact path ("DEPT / SUB / OFFICE") or a unique case-insensitive substring
+        names = self.names[level]
+        hits = np.nonzero(names == name)[0]
+        if not len(hits):
+            hits = np.nonzero(np.char.find(np.char.lower(names), name.lower()) >= 0)[0]
+        if len(hits) != 1:
+            raise KeyError(f"{name!r} matches {len(hits)} {level} entries")
+        return int(hits[0])
+
+    def mask(self, level="department", since=None, until=None, within=None):
+        # Rows with a known agency, optionally in [since, until) (month indexes)
+        # and under one agency of any level: within=("department", code)
+        keep = self.codes[level] >= 0
+        if since is not None:
+            keep &= self.month >= since
+        if until is not None:
+            keep &= (self.month >= 0) & (self.month < until)
+        if within is not None:
+            keep &= self.codes[within[0]] == within[1]
+        return keep
+
+    def counts(self, labels, level="department", period=PERIOD_MONTHS, since=None, until=None):
+        # Sparse cluster × agency × time table as parallel arrays:
+        #   (cluster, agency code, period start month, count)
+        labels = np.asarray(labels)
+        keep = self.mask(level, since, until) & (self.month >= 0)
+        codes = self.codes[level][keep].astype(np.int64)
+        months = self.month[keep].astype(np.int64)
+        clusters, cluster_idx = np.unique(labels[keep], return_inverse=True)
+        n_agency = len(self.names[level])
+        start = (months.min() // period) * period if len(months) else 0
+        bins = (months - start) // period
+        n_bins = int(bins.max()) + 1 if len(bins) else 0
+        flat = (cluster_idx * n_agency + codes) * n_bins + bins
+        cells, n = np.unique(flat, return_counts=True)
+        ci, rest = np.divmod(cells, n_agency * n_bins)
+        agency, b = np.divmod(rest, n_bins)
+        return clusters[ci], agency, start + b * period, n
+
+    def top(self, labels, cluster, level="office", since=None, n=10):
+        # Agencies contributing most members to one cluster
+        labels = np.asarray(labels)
+        keep = self.mask(level, since) & (labels == cluster)
+        totals = np.bincount(self.codes[level][keep], minlength=len(self.names[level]))
+        order = np.argsort(-totals, kind="stable")[:n]
+        size = max(int(keep.sum()), 1)
+        return [(str(self.names[level][c]), int(totals[c]), float(totals[c] / size))
+                for c in order if totals[c]]
+
+    def centroids(self, mat, level="department", keep=None, block_rows=BLOCK_ROWS):
+        # Mean embedding per agency; mat may be a memory-mapped store
+        from scipy import sparse
+        codes = self.codes[level]
+        n_agency = len(self.names[level])
+        valid = codes >= 0 if keep is None else keep & (codes >= 0)
+        sums = np.zeros((n_agency, mat.shape[1]), dtype=np.float64)
+        for lo in range(0, len(codes), block_rows):
+            hi = min(lo + block_rows, len(codes))
+            sel = np.nonzero(valid[lo:hi])[0]
+            if not len(sel):
+                continue
+            onehot = sparse.csr_matrix((np.ones(len(sel)), (codes[lo:hi][sel], sel)),
+                                       shape=(n_agency, hi - lo))
+            sums += onehot @ as_float32(mat[lo:hi])
+        sizes = np.bincount(codes[valid], minlength=n_agency)
+        present = sizes > 0
+        return (np.nonzero(present)[0], (sums[present] / sizes[present, None]).astype(np.float32),
+                sizes[present])
+
+def load_labels(cluster_json, ids):
+    with open(cluster_json, 'r', encoding='utf-8') as f:
+        cluster_data = json.load(f)
+    return np.array([cluster_data.get(id_, -1) for id_ in ids], dtype=np.int64)
+
+def since_month(year):
+    return None if year is None else int(year) * 12
+
+def save_counts(index, labels, level, period, output_csv):
+    clusters, agency, start, n = index.counts(labels, level, period)
+    names = index.names[level]
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Cluster", "Agency", "PeriodStart", "Contracts"])
+        writer.writerows(zip(clusters.tolist(), names[agency].tolist(),
+                             [month_label(int(m)) for m in start], n.tolist()))
+    print(f"{len(n)} cluster × {level} × period cells saved to {output_csv}")
+
+if __name__ == "__main__":
+    usage = [
+        "Usage: python agency_index.py build store.npy hierarchy.csv",
+        "       python agency_index.py top store.npy cluster.json cluster [office|subtier|department] [since_year] [n]",
+        "       python agency_index.py table store.npy cluster.json output.csv [level] [period_months]",
+        "       python agency_index.py centroids store.npy output.npy [level]",
+    ]
+    action = sys.argv[1] if len(sys.argv) > 1 else None
+    args = sys.argv[2:]
+    if action == "build" and len(args) == 2:
+        build(*args)
+    elif action == "top" and 3 <= len(args) <= 6:
+        store_path, cluster_json, cluster = args[:3]
+        level = args[3] if len(args) > 3 else "office"
+        since = since_month(args[4]) if len(args) > 4 else None
+        n = int(args[5]) if len(args) > 5 else 10
+        index = load(store_path)
+        labels = load_labels(cluster_json, load_ids(store_path))
+        print(f"{'contracts':>10}{'share':>8}  {level}")
+        for name, count, share in index.top(labels, int(cluster), level, since, n):
+            print(f"{count:>10}{share:>8.1%}  {name}")
+    elif action == "table" and 3 <= len(args) <= 5:
+        store_path, cluster_json, output_csv = args[:3]
+        level = args[3] if len(args) > 3 else "department"
+        period = int(args[4]) if len(args) > 4 else PERIOD_MONTHS
+        index = load(store_path)
+        save_counts(index, load_labels(cluster_json, load_ids(store_path)), level, period, output_csv)
+    elif action == "centroids" and len(args) in (2, 3):
+        store_path, output_npy = args[:2]
+        level = args[2] if len(args) == 3 else "department"
+        index = load(store_path)
+        _, mat = load_store(store_path)
+        codes, cents, sizes = index.centroids(mat, level)
+        save_store(output_npy, index.names[level][codes].tolist(), cents)
+    else:
+        print("\n".join(usage))
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import numpy as np
+import joblib
+from embedding_store import load_store
+
+# ---------------------------
+# SEARCH INDEXES
+# Both live next to the embedding store and are rebuilt when the store is
+# newer than them:
+#
+#   cache.unit.npy   row-normalised float32 matrix (exact search)
+#   cache.ann.pkl    pynndescent graph over the unit rows (approximate)
+#
+# With unit rows, cosine similarity against every contract is a single
+# matrix-vector product; top-k then only needs argpartition.
+# ---------------------------
+N_NEIGHBORS = 30
+BLOCK_ROWS = 16_384  # contract rows scored per matrix product
+QUERY_BLOCK = 256  # queries scored together
+
+def _derived(store_path, suffix):
+    return os.path.splitext(store_path)[0] + suffix
+
+def _stale(derived, store_path):
+    return not os.path.exists(derived) or os.path.getmtime(derived) < os.path.getmtime(store_path)
+
+def normalize(mat):
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return mat / norms
+
+def load_unit_matrix(store_path):
+    path = _derived(store_path, ".unit.npy")
+    ids, mat = load_store(store_path)
+    if _stale(path, store_path):
+        print(f"Normalising {len(ids)} vectors → {path}")
+        # Temp file + swap, as save_store: _stale only checks mtimes, so a
+        # truncated file left by a crash would otherwise pass as current
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, normalize(mat))
+        os.replace(path + ".tmp", path)
+    return ids, np.load(path, mmap_mode='r')
+
+# ---------------------------
+# EXACT SEARCH
+# ---------------------------
+def top_k_indices(sims, k):
+    # Indices of the k largest sims, best first; only the k winners get sorted
+    k = min(k, len(sims))
+    idx = np.argpartition(-sims, k - 1)[:k]
+    return idx[np.argsort(-sims[idx])]
+
+def exact_search(unit_mat, q_unit, threshold=None, top_k=None):
+    sims = unit_mat @ q_unit
+    if top_k:
+        idx = top_k_indices(sims, top_k)
+    else:
+        idx = np.arange(len(sims))
+    if threshold is not None:
+        idx = idx[sims[idx] >= threshold]
+    if not top_k:
+        idx = idx[np.argsort(-sims[idx])]
+    return idx, sims[idx]
+
+# ---------------------------
+# BATCH SEARCH
+# Many queries against the matrix without ever materialising the full
+# (queries x contracts) similarity matrix: queries go in blocks of
+# QUERY_BLOCK, contracts in blocks of BLOCK_ROWS. With top_k a running
+# top-k per query is merged block by block with argpartition; with only a
+# threshold, just the matches above it are kept.
+#
+#   for qi, idx, sims in batch_search(unit, Q, threshold=0.8, top_k=10):
+#       ...  # matches of query qi, best first
+# ---------------------------
+def _topk_block(unit_mat, qb, top_k, block_rows):
+    n = len(qb)
+    best_sim = np.full((n, 0), -np.inf, dtype=np.float32)
+    best_idx = np.empty((n, 0), dtype=np.int64)
+    for lo in range(0, len(unit_mat), block_rows):
+        sims = qb @ np.asarray(unit_mat[lo:lo + block_rows], dtype=np.float32).T
+        cand_sim = np.concatenate([best_sim, sims], axis=1)
+        cand_idx = np.concatenate(
+            [best_idx, np.broadcast_to(np.arange(lo, lo + sims.shape[1]), sims.shape)], axis=1)
+        if cand_sim.shape[1] > top_k:
+            part = np.argpartition(-cand_sim, top_k - 1, axis=1)[:, :top_k]
+            cand_sim = np.take_along_axis(cand_sim, part, axis=1)
+            cand_idx = np.take_along_axis(cand_idx, part, axis=1)
+        best_sim, best_idx = cand_sim, cand_idx
+    order = np.argsort(-best_sim, axis=1, kind='stable')
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_sim, order, axis=1)
+
+def _threshold_block(unit_mat, qb, threshold, block_rows):
+    rows, cols, vals = [], [], []
+    for lo in range(0, len(unit_mat), block_rows):
+        sims = qb @ np.asarray(unit_mat[lo:lo + block_rows], dtype=np.float32).T
+        r, c = np.nonzero(sims >= threshold)
+        rows.append(r)
+        cols.append(c + lo)
+        vals.append(sims[r, c])
+    rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    order = np.lexsort((-vals, rows))  # by query, best first
+    return rows[order], cols[order], vals[order]
+
+def batch_search(unit_mat, queries, threshold=None, top_k=None,
+                 block_rows=BLOCK_ROWS, query_block=QUERY_BLOCK):
+    # Checked here, not in the generator, so a bad call fails immediately
+    if threshold is None and not top_k:
+        raise ValueError("need threshold or top_k")
+    return _batch_search(unit_mat, np.asarray(queries, dtype=np.float32), threshold, top_k,
+                         block_rows, query_block)
+
+def _batch_search(unit_mat, queries, threshold, top_k, block_rows, query_block):
+    for q0 in range(0, len(queries), query_block):
+        qb = queries[q0:q0 + query_block]
+        if top_k:
+            idx, sims = _topk_block(unit_mat, qb, top_k, block_rows)
+            keep = np.ones(sims.shape, dtype=bool) if threshold is None else sims >= threshold
+            for i in range(len(qb)):
+                yield q0 + i, idx[i][keep[i]], sims[i][keep[i]]
+        else:
+            rows, cols, vals = _threshold_block(unit_mat, qb, threshold, block_rows)
+            bounds = np.searchsorted(rows, np.arange(len(qb) + 1))
+            for i in range(len(qb)):
+                yield q0 + i, cols[bounds[i]:bounds[i + 1]], vals[bounds[i]:bounds[i + 1]]
+
+# ---------------------------
+# APPROXIMATE SEARCH
+# ---------------------------
+def build_ann(unit_mat, n_neighbors=N_NEIGHBORS):
+    from pynndescent import NNDescent
+    index = NNDescent(np.asarray(unit_mat), metric="dot", n_neighbors=n_neighbors,
+                      low_memory=True, verbose=True)
+    index.prepare()
+    return index
+
+def load_ann(store_path, unit_mat):
+    path = _derived(store_path, ".ann.pkl")
+    if _stale(path, store_path):
+        print("Building ANN index…")
+        index = build_ann(unit_mat)
+        joblib.dump(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        print(f"ANN index saved → {path}")
+        return index
+    return joblib.load(path)
+
+def ann_search(index, q_unit, top_k, threshold=None, epsilon=0.1):
+    idx, dist = index.query(q_unit[None, :], k=top_k, epsilon=epsilon)
+    # pynndescent's "dot" distance is 1 - dot
+    idx, sims = idx[0], 1 - dist[0]
+    if threshold is not None:
+        keep = sims >= threshold
+        idx, sims = idx[keep], sims[keep]
+    return idx, sims
+
+def ann_batch_search(index, queries, top_k, threshold=None, epsilon=0.1):
+    idx, dist = index.query(np.asarray(queries, dtype=np.float32), k=top_k, epsilon=epsilon)
+    for i, (row, d) in enumerate(zip(idx, dist)):
+        sims = 1 - d
+        keep = sims >= threshold if threshold is not None else np.ones(len(sims), dtype=bool)
+        yield i, row[keep], sims[keep]
+
+def recall_at_k(index, unit_mat, k=10, n_queries=200, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(unit_mat), size=min(n_queries, len(unit_mat)), replace=False)
+    hits, exact_time, ann_time = 0, 0.0, 0.0
+    for r in rows:
+        q = np.asarray(unit_mat[r])
+        start = time.perf_counter()
+        exact, _ = exact_search(unit_mat, q, top_k=k)
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        approx, _ = ann_search(index, q, k)
+        ann_time += time.perf_counter() - start
+        hits += len(np.intersect1d(exact, approx))
+    recall = hits / (len(rows) * k)
+    print(f"recall@{k}: {recall:.4f} over {len(rows)} queries")
+    print(f"exact: {1000 * exact_time / len(rows):.2f} ms/query, "
+          f"ann: {1000 * ann_time / len(rows):.2f} ms/query")
+    return recall
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("build", "recall"):
+        print("Usage: python ann_index.py build cache.npy")
+        print("       python ann_index.py recall cache.npy [k] [n_queries]")
+        sys.exit(1)
+    store_path = sys.argv[2]
+    _, unit = load_unit_matrix(store_path)
+    index = load_ann(store_path, unit)
+    if sys.argv[1] == "recall":
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        n = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+        recall_at_k(index, unit, k, n)
@@ -0,0 +1,266 @@
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import numpy as np
+from metrics import PeakRSS
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+BENCH_DIR = "bench"
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+RELEVANT_NAICS = {"541715", "541511", "541512"}
+NAICS_MIX = {  # share of rows per code; the first three are "relevant"
+    "541715": 0.10, "541511": 0.12, "541512": 0.08, "541330": 0.20,
+    "336411": 0.10, "334511": 0.10, "236220": 0.15, "561210": 0.15,
+}
+DUPLICATE_TITLES = 0.15  # share of rows reusing an earlier title
+EMPTY_DESCRIPTIONS = 0.05
+BOILERPLATE_RATE = 1.5  # mean boilerplate phrases per description
+DESC_WORDS = (4.8, 0.9)  # lognormal (mean, sigma) of description words, ~120 median
+TITLE_WORDS = (4, 14)
+SEARCH_QUERIES = 100
+REDUCED_DIM = 50
+REGRESSION = 1.10  # compare flags stages >10% slower than the baseline
+
+DOMAIN_WORDS = (
+    "autonomous drone swarm radar sensor satellite software cyber network cloud "
+    "machine learning artificial intelligence hypersonic propulsion antenna "
+    "laboratory research development prototype testing evaluation maintenance "
+    "repair aircraft vehicle engine battery power signal processing imaging "
+    "optical laser communications encryption data analytics platform training "
+    "simulation modeling facility construction renovation janitorial services "
+    "security guard support engineering logistics supply equipment hardware "
+    "firmware integration sustainment modernization acquisition materials "
+    "composite structures navigation guidance control electronic warfare"
+).split()
+
+BOILERPLATE = [
+    "this is a combined synopsis solicitation for commercial items",
+    "prepared in accordance with the format in subpart 12.6",
+    "this announcement constitutes the only solicitation",
+    "proposals are being requested and a written solicitation will not be issued",
+    "the government intends to award a firm fixed price contract",
+    "offerors must be registered in the system for award management",
+    "all responsible sources may submit a capability statement",
+    "this notice is not a request for proposals",
+    "the government will not pay for any information received",
+    "questions must be submitted in writing to the contracting officer",
+    "see attached statement of work for details",
+    "small business set aside",
+    "request for information",
+    "sources sought notice",
+]
+
+# ---------------------------
+# SYNTHETIC SAM.GOV CORPUS
+# Same columns and quoting as the real export, with a Zipf-like word mix,
+# lognormal description lengths, a NAICS mix, repeated titles and
+# boilerplate sentences dropped into descriptions.
+# ---------------------------
+def _vocab(rng, n=8000):
+    syllables = ["ar", "ben", "cor", "dal", "en", "fi", "gor", "hal", "in", "jor",
+                 "ka", "lo", "mer", "na", "or", "pra", "qui", "ro", "sa", "tor", "ul", "ve"]
+    made = {"".join(rng.choice(syllables, size=rng.integers(2, 4))) for _ in range(n)}
+    words = list(rng.permutation(DOMAIN_WORDS + sorted(made)))
+    weights = 1.0 / np.arange(1, len(words) + 1) ** 1.05
+    return np.array(words, dtype=object), weights / weights.sum()
+
+def generate(path, n_rows, seed=0, chunk=10_000):
+    rng = np.random.default_rng(seed)
+    words, probs = _vocab(rng)
+    codes, shares = zip(*NAICS_MIX.items())
+    shares = np.array(shares) / sum(shares)
+    titles = []
+    start = np.datetime64("2015-01-01")
+    days = (np.datetime64("2025-12-31") - start).astype(int)
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["NoticeId", "Title", "Description", "PostedDate", "NaicsCode",
+                         "Department/Ind.Agency", "Sub-Tier", "Office"])
+        for lo in range(0, n_rows, chunk):
+            n = min(chunk, n_rows - lo)
+            naics = rng.choice(codes, size=n, p=shares)
+            posted = start + rng.integers(0, days, size=n)
+            desc_len = np.minimum(rng.lognormal(*DESC_WORDS, size=n).astype(int), 3000)
+            n_boiler = rng.poisson(BOILERPLATE_RATE, size=n)
+            rows = []
+            for i in range(n):
+                if titles and rng.random() < DUPLICATE_TITLES:
+                    title = titles[rng.integers(len(titles))]
+                else:
+                    title = " ".join(rng.choice(words, size=rng.integers(*TITLE_WORDS), p=probs)).title()
+                    titles.append(title)
+                if rng.random() < EMPTY_DESCRIPTIONS:
+                    desc = ""
+                else:
+                    body = list(rng.choice(words, size=max(desc_len[i], 1), p=probs))
+                    for _ in range(n_boiler[i]):
+                        phrase = BOILERPLATE[rng.integers(len(BOILERPLATE))]
+                        body.insert(rng.integers(len(body) + 1), phrase.capitalize() + ".")
+                    desc = " ".join(body)
+                rows.append([f"{rng.integers(1 << 62):016x}{lo + i:016x}", title, desc,
+                             f"{posted[i]} 09:00:00.000-05", naics[i],
+                             "DEPT OF DEFENSE", "DEPT OF THE AIR FORCE", "FA8650"])
+            writer.writerows(rows)
+            print(f"Generated {lo + n} rows", end="\r")
+    print(f"\nWrote {n_rows} synthetic contracts → {path}")
+
+    phrases_csv = os.path.join(os.path.dirname(path) or ".", "boilerplate_phrases.csv")
+    with open(phrases_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Boilerplate Phrase"])
+        writer.writerows([p] for p in BOILERPLATE)
+    return path, phrases_csv
+
+# ---------------------------
+# TINY OFFLINE MODEL
+# A 2-layer, 64-wide BERT with random (seeded) weights and a word-level
+# vocabulary built from the generator. Embeddings are meaningless, but the
+# tokenizer, padding and forward-pass costs have the real model's shape.
+# ---------------------------
+def tiny_model(model_dir, seed=0):
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    if not os.path.exists(os.path.join(model_dir, "config.json")):
+        os.makedirs(model_dir, exist_ok=True)
+        words, _ = _vocab(np.random.default_rng(seed))
+        specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+        with open(os.path.join(model_dir, "vocab.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(specials + sorted({w.lower() for w in words})) + "\n")
+        tokenizer = BertTokenizerFast(os.path.join(model_dir, "vocab.txt"))
+        torch.manual_seed(seed)
+        config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=64, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=128)
+        BertModel(config).save_pretrained(model_dir)
+        tokenizer.save_pretrained(model_dir)
+    return BertTokenizerFast.from_pretrained(model_dir), BertModel.from_pretrained(model_dir)
+
+# ---------------------------
+# STAGES
+# Each stage is timed and its peak RSS sampled; later stages consume the
+# previous stage's output, like the real pipeline.
+# ---------------------------
+def _measure(results, name, fn, items):
+    print(f"[{name}]")
+    start = time.perf_counter()
+    with PeakRSS() as rss:
+        out = fn()
+    seconds = time.perf_counter() - start
+    n = items(out) if callable(items) else items
+    results[name] = {
+        "seconds": round(seconds, 4),
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "items": n,
+        "items_per_sec": round(n / seconds, 1) if seconds else None,
+    }
+    print(f"  {seconds:.2f}s, {rss.peak / 2**20:.0f} MB peak, {n} items")
+    return out
+
+def run(size, out_json, workdir=BENCH_DIR):
+    from contract_reader import unique_title_rows
+    from text_cleaner import load_phrases, clean_rows
+    from embed_engine import EmbeddingEngine
+    from ann_index import normalize, exact_search
+    import reducer_registry
+    import cluster
+    import plotting
+
+    os.makedirs(workdir, exist_ok=True)
+    if size in SIZES or size.isdigit():
+        n_rows = SIZES.get(size) or int(size)
+        csv_path = os.path.join(workdir, f"synthetic_{size}.csv")
+        if not os.path.exists(csv_path):
+            generate(csv_path, n_rows)
+    else:
+        csv_path = size  # an existing CSV
+    phrases = load_phrases(os.path.join(os.path.dirname(csv_path) or ".", "boilerplate_phrases.csv"))
+    tokenizer, model = tiny_model(os.path.join(workdir, "tiny_model"))
+    engine = EmbeddingEngine(tokenizer, model, num_threads=os.cpu_count())
+
+    stages = {}
+    opps = _measure(stages, "filter", lambda: unique_title_rows(
+        csv_path, ['NoticeId', 'Title', 'Description', 'PostedDate'], naics=RELEVANT_NAICS), len)
+    pairs = [(r['Title'], r['Description']) for r in opps]
+    cleaned = _measure(stages, "clean", lambda: clean_rows(pairs, phrases, tokenizer.sep_token), len)
+    texts = [c for c, n in cleaned if n >= 10]
+    ids = [r['NoticeId'] for r, (c, n) in zip(opps, cleaned) if n >= 10]
+    embs = _measure(stages, "embed", lambda: engine.embed(texts, quiet=True), len)
+    stages["embed"]["padding"] = round(
+        1 - engine.last_stats["tokens"] / max(engine.last_stats["padded_tokens"], 1), 4)
+
+    model_path = os.path.join(workdir, "umap_bench.pkl")
+    reduced = _measure(stages, "umap", lambda: reducer_registry.fit(
+        model_path, ids, embs, min(REDUCED_DIM, embs.shape[1] - 1), metric="cosine"), len)
+    labels = _measure(stages, "hdbscan", lambda: cluster.cluster_embeddings(reduced).labels_, len)
+
+    unit = normalize(embs)
+    queries = normalize(engine.embed(texts[:SEARCH_QUERIES], quiet=True))
+    _measure(stages, "search", lambda: [exact_search(unit, q, top_k=10) for q in queries], len)
+
+    # Plot cost depends on point count, not on the projection, so the first
+    # two reduced components stand in for the 2-D UMAP
+    html = os.path.join(workdir, f"plot_{size}.html")
+    _measure(stages, "plot", lambda: plotting.render(
+        np.ascontiguousarray(reduced[:, :2]), labels.tolist(), ids, csv_path, html), len(ids))
+
+    result = {
+        "corpus": csv_path,
+        "rows_after_filter": len(opps),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "env": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+        },
+        "stages": stages,
+    }
+    with open(out_json, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {out_json}")
+    return result
+
+# ---------------------------
+# BASELINE COMPARISON
+# ---------------------------
+def compare(baseline_json, result_json):
+    with open(baseline_json, 'r', encoding='utf-8') as f:
+        base = json.load(f)["stages"]
+    with open(result_json, 'r', encoding='utf-8') as f:
+        new = json.load(f)["stages"]
+    slower = 0
+    print(f"{'stage':<10}{'base s':>10}{'new s':>10}{'ratio':>8}{'base MB':>10}{'new MB':>10}")
+    for name in new:
+        if name not in base:
+            continue
+        b, n = base[name], new[name]
+        ratio = n["seconds"] / max(b["seconds"], 1e-9)
+        flag = "  slower" if ratio > REGRESSION else ""
+        slower += bool(flag)
+        print(f"{name:<10}{b['seconds']:>10.2f}{n['seconds']:>10.2f}{ratio:>8.2f}"
+              f"{b['peak_rss_mb']:>10.0f}{n['peak_rss_mb']:>10.0f}{flag}")
+    return slower
+
+if __name__ == "__main__":
+    usage = ("Usage: python bench.py generate output.csv rows [seed]\n"
+             "       python bench.py run 10k|100k|1m|rows|corpus.csv results.json\n"
+             "       python bench.py compare baseline.json results.json")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+    cmd, args = sys.argv[1], sys.argv[2:]
+    if cmd == "generate" and len(args) in (2, 3):
+        generate(args[0], int(args[1]), int(args[2]) if len(args) == 3 else 0)
+    elif cmd == "run" and len(args) == 2:
+        run(args[0], args[1])
+    elif cmd == "compare" and len(args) == 2:
+        sys.exit(1 if compare(args[0], args[1]) else 0)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -1,16 +1,33 @@
 import csv
 import re
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+import sys
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from contract_reader import iter_batches
 
 # ---------------------------
 # CONFIG
 # ---------------------------
 INPUT_CSV = "All_Contract_Opportunities_1998_2030.csv"  # Your SAM.gov data file
 OUTPUT_CSV = "boilerplate_phrases.csv"
+FREQ_CSV = "boilerplate_phrase_freqs.csv"  # Every candidate with its doc frequency
 TEXT_COLUMN = "Description"
 MIN_DOC_FREQ = 0.01  # Phrase must appear in >1% of documents
+REPORT_DOC_FREQ = 0.0025  # Frequencies down to here are reported for tuning
 NGRAM_RANGE = (2, 5)  # Look for 2- to 5-word phrases
+CHUNK_DOCS = 20_000
+WORKERS = 4
+
+# Count-min sketch: DEPTH rows of 2**WIDTH_BITS int32 counters (~32 MB)
+DEPTH = 4
+WIDTH_BITS = 21
+
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")  # TfidfVectorizer's default tokens
+MULT = np.uint64(0x9E3779B97F4A7C15)
+SEEDS = np.array([0x243F6A8885A308D3, 0x13198A2E03707344,
+                  0xA4093822299F31D0, 0x082EFA98EC4E6C89], dtype=np.uint64)[:DEPTH]
 
 # ---------------------------
 # CLEANING FUNCTION
@@ -27,54 +44,170 @@ def clean_text(text):
     return text.strip()
 
 # ---------------------------
-# LOAD AND CLEAN DATA
+# N-GRAM HASHING
+# Tokens get a stable 64-bit hash (the same in every worker process), and
+# n-gram hashes are rolled from them in NumPy. Each (document, n-gram) pair
+# is counted once, which is exactly document frequency.
 # ---------------------------
-try:
-    # Try UTF-8 first, fallback to Latin-1 if decoding fails
-    try:
-        df = pd.read_csv(
-            INPUT_CSV,
-            encoding="utf-8",
-            engine="python",         # more forgiving parser
-            on_bad_lines="skip"      # skip malformed rows
-        )
-    except UnicodeDecodeError:
-        print("⚠️ UTF-8 decoding failed, retrying with 'latin1' encoding...")
-        df = pd.read_csv(
-            INPUT_CSV,
-            encoding="latin1",
-            engine="python",
-            on_bad_lines="skip"
-        )
-
-    if TEXT_COLUMN not in df.columns:
-        raise ValueError(f"Column '{TEXT_COLUMN}' not found in CSV headers.")
-
-    texts = df[TEXT_COLUMN].dropna().astype(str).apply(clean_text).tolist()
-    print(f"✅ Loaded and cleaned {len(texts)} descriptions.")
-
-except FileNotFoundError:
-    print(f"❌ Could not find file: {INPUT_CSV}")
-    exit(1)
-except Exception as e:
-    print(f"❌ Error reading CSV: {e}")
-    exit(1)
+def _token_hashes(tokens):
+    uniq, inverse = np.unique(np.array(tokens, dtype=object), return_inverse=True)
+    table = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=8).digest(), 'little')
+         for t in uniq),
+        dtype=np.uint64, count=len(uniq),
+    )
+    return table[inverse]
+
+def _chunk_ngrams(texts):
+    # Returns (hashes, doc, start, n) for every distinct n-gram per document,
+    # plus the chunk's flat token list so phrases can be rebuilt from starts.
+    tokens, doc = [], []
+    for i, text in enumerate(texts):
+        toks = TOKEN_RE.findall(clean_text(text))
+        tokens.extend(toks)
+        doc.extend([i] * len(toks))
+    if not tokens:
+        empty = np.empty(0, dtype=np.int64)
+        return np.empty(0, dtype=np.uint64), empty, empty, empty, tokens
+    tok = _token_hashes(tokens)
+    doc = np.array(doc, dtype=np.int64)
+
+    lo, hi = NGRAM_RANGE
+    hashes, docs, starts, ns = [], [], [], []
+    h = tok.copy()
+    for n in range(1, hi + 1):
+        if n > 1:
+            h = h[:-1] * MULT + tok[n - 1:]
+        if n < lo:
+            continue
+        valid = doc[:len(h)] == doc[n - 1:]  # n-gram stays inside one document
+        idx = np.nonzero(valid)[0]
+        hashes.append(h[idx] ^ np.uint64(n))
+        docs.append(doc[idx])
+        starts.append(idx)
+        ns.append(np.full(len(idx), n, dtype=np.int64))
+
+    hashes, docs = np.concatenate(hashes), np.concatenate(docs)
+    starts, ns = np.concatenate(starts), np.concatenate(ns)
+    order = np.lexsort((hashes, docs))
+    hashes, docs, starts, ns = hashes[order], docs[order], starts[order], ns[order]
+    first = np.ones(len(hashes), dtype=bool)
+    first[1:] = (hashes[1:] != hashes[:-1]) | (docs[1:] != docs[:-1])
+    return hashes[first], docs[first], starts[first], ns[first], tokens
+
+def _sketch_rows(hashes):
+    # Counter index of every hash in each sketch row
+    shift = np.uint64(64 - WIDTH_BITS)
+    return [((hashes ^ seed) * MULT) >> shift for seed in SEEDS]
 
 # ---------------------------
-# TF-IDF PHRASE EXTRACTION
+# WORKERS
 # ---------------------------
-vectorizer = TfidfVectorizer(ngram_range=NGRAM_RANGE, min_df=MIN_DOC_FREQ)
-X = vectorizer.fit_transform(texts)
-phrases = vectorizer.get_feature_names_out()
-print(f"✨ Discovered {len(phrases)} boilerplate candidates.")
+def _sketch_chunk(texts):
+    hashes = _chunk_ngrams(texts)[0]
+    width = 1 << WIDTH_BITS
+    cms = np.zeros((DEPTH, width), dtype=np.int32)
+    for d, idx in enumerate(_sketch_rows(hashes)):
+        cms[d] = np.bincount(idx.astype(np.int64), minlength=width)
+    return len(texts), cms
+
+_sketch = {}
+
+def _init_counter(cms, min_count):
+    _sketch['cms'] = cms
+    _sketch['min_count'] = min_count
+
+def _count_chunk(texts):
+    cms, min_count = _sketch['cms'], _sketch['min_count']
+    hashes, _, starts, ns, tokens = _chunk_ngrams(texts)
+    estimate = np.min([cms[d][idx.astype(np.int64)] for d, idx in enumerate(_sketch_rows(hashes))], axis=0)
+    keep = estimate >= min_count
+    hashes, starts, ns = hashes[keep], starts[keep], ns[keep]
+    uniq, first, counts = np.unique(hashes, return_index=True, return_counts=True)
+    return {
+        int(h): (int(c), " ".join(tokens[starts[i]:starts[i] + ns[i]]))
+        for h, i, c in zip(uniq, first, counts)
+    }
+
+def _text_chunks():
+    for batch in iter_batches(INPUT_CSV, columns=[TEXT_COLUMN], chunk_rows=CHUNK_DOCS):
+        descs = batch[TEXT_COLUMN]
+        yield descs[descs != ""].tolist()
+
+def _bounded_map(executor, fn, items, limit):
+    # executor.map would read the whole CSV up front; keep `limit` in flight
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 # ---------------------------
-# SAVE TO CSV
+# STREAMING DOCUMENT-FREQUENCY MINING
+# Pass 1 streams every description into a count-min sketch. The sketch only
+# over-counts, so pass 2 can count exactly just the n-grams whose estimate
+# clears REPORT_DOC_FREQ without ever missing a real boilerplate phrase.
 # ---------------------------
-with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(["Boilerplate Phrase"])
-    for phrase in phrases:
-        writer.writerow([phrase])
+def mine_phrases():
+    n_docs = 0
+    cms = np.zeros((DEPTH, 1 << WIDTH_BITS), dtype=np.int32)
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for n, part in _bounded_map(executor, _sketch_chunk, _text_chunks(), 2 * WORKERS):
+            n_docs += n
+            cms += part
+            print(f"Pass 1: sketched {n_docs} descriptions", end="\r")
+    print()
+    if n_docs == 0:
+        return 0, {}
+
+    # The sketch goes to each worker once, not with every chunk
+    min_count = int(np.ceil(REPORT_DOC_FREQ * n_docs))
+    counts = {}
+    seen = 0
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_counter,
+                             initargs=(cms, min_count)) as executor:
+        for part in _bounded_map(executor, _count_chunk, _text_chunks(), 2 * WORKERS):
+            for h, (c, phrase) in part.items():
+                prev = counts.get(h)
+                counts[h] = (c + prev[0], prev[1]) if prev else (c, phrase)
+            seen += 1
+            print(f"Pass 2: counted chunk {seen}, {len(counts)} candidates", end="\r")
+    print()
+    return n_docs, {phrase: c for c, phrase in counts.values()}
+
+def save_phrases(n_docs, doc_freqs):
+    # Same threshold and (alphabetical) order TfidfVectorizer used
+    min_count = MIN_DOC_FREQ * n_docs
+    phrases = sorted(p for p, c in doc_freqs.items() if c >= min_count)
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Boilerplate Phrase"])
+        for phrase in phrases:
+            writer.writerow([phrase])
+    print(f"💾 Saved {len(phrases)} boilerplate phrases to {OUTPUT_CSV}")
+
+    with open(FREQ_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Phrase", "DocCount", "DocFraction"])
+        for phrase, c in sorted(doc_freqs.items(), key=lambda x: -x[1]):
+            if c >= REPORT_DOC_FREQ * n_docs:
+                writer.writerow([phrase, c, c / n_docs])
+    print(f"💾 Saved phrase frequencies to {FREQ_CSV}")
+
+def main():
+    try:
+        n_docs, doc_freqs = mine_phrases()
+    except FileNotFoundError:
+        print(f"❌ Could not find file: {INPUT_CSV}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error reading CSV: {e}")
+        sys.exit(1)
+    print(f"✅ Mined {n_docs} descriptions.")
+    print(f"✨ Discovered {sum(c >= MIN_DOC_FREQ * n_docs for c in doc_freqs.values())} boilerplate candidates.")
+    save_phrases(n_docs, doc_freqs)
 
-print(f"💾 Saved boilerplate phrases to {OUTPUT_CSV}")
+if __name__ == "__main__":
+    main()
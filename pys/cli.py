@@ -0,0 +1,191 @@
+import os
+import sys
+import runpy
+import argparse
+
+# ---------------------------
+# UNIFIED CLI
+#   python pys/cli.py <command> [args...]
+#
+# Arguments are validated here, before any pipeline module is imported, so
+# --help and usage errors return immediately. The chosen module then runs
+# exactly as `python pys/<module>.py args...` would, and only it pays for
+# its imports (pandas for CSV commands, torch only for embedding commands).
+# ---------------------------
+COMMANDS = {}
+
+def command(name, module, help, args=(), build=None):
+    # args: (name, kwargs) pairs for argparse, or a list of such pairs for
+    # options that exclude each other; build turns the parsed namespace into
+    # the module's argv (default: positionals in order)
+    COMMANDS[name] = (module, help, args, build)
+
+def _opt(ns, key):
+    value = getattr(ns, key)
+    return [] if value is None else [str(value)]
+
+command("pipeline", "pipeline", "run every stage, skipping up-to-date ones", [
+    ("csv", {}),
+    ("plot_mode", {"nargs": "?", "choices": ["full", "scalable"]}),
+    ("--force", {"help": "comma-separated stages to rerun"}),
+], lambda ns: [ns.csv] + _opt(ns, "plot_mode") + ([f"force={ns.force}"] if ns.force else []))
+
+command("embed", "sbert_filter_embed", "filter, clean and embed opportunities", [
+    ("csv", {}), ("cache_dir", {}), ("output_npy", {}), ("capabilities", {}),
+])
+
+command("shard-embed", "shard_embed", "sharded embedding job: plan, work (one per worker), status, merge", [
+    ("action", {"choices": ["plan", "work", "status", "merge"]}), ("args", {"nargs": "+"}),
+], lambda ns: [ns.action] + ns.args)
+
+command("near-dup", "near_dup", "report near-duplicate families (MinHash/LSH) without embedding", [
+    ("csv", {}), ("output_csv", {}), ("threshold", {"nargs": "?", "type": float}),
+])
+
+command("reduce", "umap_reduce", "UMAP-reduce an embedding store", [
+    ("input_npy", {}), ("dim_in", {"type": int}), ("output_npy", {}),
+    ("dim_out", {"type": int}), ("model", {}), ("--refit", {"action": "store_true"}),
+], lambda ns: [ns.input_npy, str(ns.dim_in), ns.output_npy, str(ns.dim_out), ns.model]
+              + (["refit"] if ns.refit else []))
+
+command("cluster", "cluster", "HDBSCAN fit / assign / refit / subsampled fit", [
+    ("mode", {"choices": ["fit", "assign", "refit", "sample"]}), ("input_npy", {}),
+    ("dim", {"type": int}), ("output_json", {}), ("model", {}),
+    ("--rows", {"type": int, "help": "sample mode: points to fit on"}),
+], lambda ns: [ns.mode, ns.input_npy, str(ns.dim), ns.output_json, ns.model] + _opt(ns, "rows"))
+
+command("cluster-sweep", "cluster", "HDBSCAN min_cluster_size / min_samples sweep on one tree", [
+    ("input_npy", {}), ("dim", {"type": int}), ("output_csv", {}),
+    ("--sizes", {"help": "comma-separated min_cluster_size values"}),
+    ("--min-samples", {"help": "comma-separated min_samples values (one tree each)"}),
+], lambda ns: ["sweep", ns.input_npy, str(ns.dim), ns.output_csv]
+              + ([ns.sizes or ""] if ns.sizes or ns.min_samples else [])
+              + _opt(ns, "min_samples"))
+
+command("plot", "plotting", "render the cluster plot", [
+    ("input_npy", {}), ("cluster_json", {}), ("csv", {}), ("output_html", {}),
+    ("reducer", {"nargs": "?"}), ("--mode", {"choices": ["full", "scalable"]}),
+    ("--caps", {"help": "capability matches CSV from search-batch to overlay"}),
+    ("--keywords", {"help": "cluster keywords CSV for legend and hover text"}),
+], lambda ns: [ns.input_npy, ns.cluster_json, ns.csv, ns.output_html] + _opt(ns, "reducer")
+              + [arg for flag in ("mode", "caps", "keywords") if getattr(ns, flag)
+                 for arg in (f"--{flag}", getattr(ns, flag))])
+
+command("keywords", "cluster_keywords", "per-cluster keywords (c-TF-IDF) and representative notices", [
+    ("store_npy", {}), ("cluster_json", {}), ("csv", {}), ("output_csv", {}), ("state_dir", {}),
+    ("--full", {"action": "store_true", "help": "ignore saved state and rebuild"}),
+], lambda ns: [ns.store_npy, ns.cluster_json, ns.csv, ns.output_csv, ns.state_dir]
+              + (["full"] if ns.full else []))
+
+command("temporal", "temporal", "cluster rolling PostedDate windows and track them", [
+    ("reduced_npy", {}), ("csv", {}), ("output_csv", {}),
+])
+
+command("agency", "agency_index", "agency index: build, top agencies per cluster, count table, centroids", [
+    ("action", {"choices": ["build", "top", "table", "centroids"]}), ("args", {"nargs": "+"}),
+], lambda ns: [ns.action] + ns.args)
+
+command("search", "semantic_search", "one-off semantic search", [
+    ("sentence", {}), ("cache_npy", {}), ("titles_csv", {}),
+    ("threshold", {"type": float}), ("output_csv", {}),
+])
+
+command("search-batch", "semantic_search", "search many sentences (one per line) in one pass", [
+    ("queries_txt", {}), ("cache_npy", {}), ("titles_csv", {}),
+    ("threshold", {"type": float}), ("output_csv", {}), ("--top-k", {"type": int}),
+], lambda ns: ["batch", ns.queries_txt, ns.cache_npy, ns.titles_csv, str(ns.threshold),
+               ns.output_csv] + _opt(ns, "top_k"))
+
+command("serve", "search_server", "resident search server", [
+    ("cache_npy", {}), ("titles_csv", {}), ("port", {"nargs": "?", "type": int}),
+    [("--ann", {"action": "store_true"}),
+     ("--tier", {"choices": ["f16", "pq"], "help": "compressed in-RAM tier with re-ranking"})],
+], lambda ns: [ns.cache_npy, ns.titles_csv] + (
+    [str(ns.port or 8765), "ann" if ns.ann else ns.tier] if ns.ann or ns.tier else _opt(ns, "port")))
+
+command("query", "search_client", "query a running search server", [
+    ("threshold", {"type": float}), ("output_csv", {}), ("sentences", {"nargs": "+"}),
+    ("--top-k", {"type": int, "help": "best N matches per sentence"}),
+], lambda ns: [str(ns.threshold), ns.output_csv] + (
+    [f"top_k={ns.top_k}"] if ns.top_k else []) + ns.sentences)
+
+command("boilerplate", "boiler", "mine boilerplate phrases (paths set in boiler.py)")
+
+command("verify-cleaner", "text_cleaner", "check the stripper against the reference cleaner", [
+    ("csv", {}), ("phrases_csv", {}), ("n", {"nargs": "?", "type": int}),
+], lambda ns: ["verify", ns.csv, ns.phrases_csv] + _opt(ns, "n"))
+
+command("to-parquet", "contract_reader", "convert the CSV export to a Parquet dataset", [
+    ("csv", {}), ("out_dir", {}),
+], lambda ns: ["to_parquet", ns.csv, ns.out_dir])
+
+command("convert-store", "embedding_store", "convert a legacy id → vector json", [
+    ("input_json", {}), ("output_npy", {}), ("dtype", {"nargs": "?", "choices": ["float32", "float16"]}),
+])
+
+command("cache", "embedding_cache", "compact or import into the embedding cache", [
+    ("action", {"choices": ["compact", "import"]}), ("cache_dir", {}),
+    ("legacy_npy", {"nargs": "?"}),
+])
+
+command("ann", "ann_index", "build or measure the ANN index", [
+    ("action", {"choices": ["build", "recall"]}), ("store_npy", {}),
+    ("k", {"nargs": "?", "type": int}), ("n", {"nargs": "?", "type": int}),
+])
+
+command("tier", "compressed_index", "build the f16/PQ search tiers or report memory, latency and recall", [
+    ("action", {"choices": ["build", "report"]}), ("store_npy", {}), ("args", {"nargs": "*"}),
+], lambda ns: [ns.action, ns.store_npy] + ns.args)
+
+command("compare-engine", "embed_engine", "time the embedding paths against each other", [
+    ("csv", {}), ("limit", {"nargs": "?", "type": int}),
+], lambda ns: ["compare", ns.csv] + _opt(ns, "limit"))
+
+command("compare-chunked", "embed_engine", "truncated vs chunked long-document embedding", [
+    ("csv", {}), ("limit", {"nargs": "?", "type": int}),
+], lambda ns: ["chunked", ns.csv] + _opt(ns, "limit"))
+
+command("onnx-export", "onnx_backend", "export the embedding model to ONNX", [
+    ("--int8", {"action": "store_true", "help": "also write a quantized int8 model"}),
+], lambda ns: ["export"] + (["int8"] if ns.int8 else []))
+
+command("onnx-check", "onnx_backend", "ONNX parity (cosine) and throughput vs eager torch", [
+    ("csv", {}), ("limit", {"nargs": "?", "type": int}),
+], lambda ns: ["check", ns.csv] + _opt(ns, "limit"))
+
+command("bench", "bench", "synthetic benchmarks", [
+    ("action", {"choices": ["generate", "run", "compare"]}), ("args", {"nargs": "+"}),
+], lambda ns: [ns.action] + ns.args)
+
+def parser():
+    p = argparse.ArgumentParser(prog="cli.py", description="SAM.gov contract clustering pipeline")
+    p.add_argument("--backend", choices=["torch", "onnx", "onnx-int8"],
+                   help="embedding backend (sets EMBED_BACKEND)")
+    sub = p.add_subparsers(dest="command", required=True, metavar="command")
+    for name, (module, help, args, _) in COMMANDS.items():
+        sp = sub.add_parser(name, help=help, description=help)
+        for spec in args:
+            group = sp.add_mutually_exclusive_group() if isinstance(spec, list) else sp
+            for arg, kwargs in spec if isinstance(spec, list) else [spec]:
+                group.add_argument(arg, **kwargs)
+    return p
+
+def positionals(ns, args):
+    argv = []
+    for arg, _ in args:
+        value = getattr(ns, arg)
+        if value is None:
+            continue
+        argv.extend(str(v) for v in value) if isinstance(value, list) else argv.append(str(value))
+    return argv
+
+def main(argv=None):
+    ns = parser().parse_args(argv)
+    module, _, args, build = COMMANDS[ns.command]
+    if ns.backend:
+        os.environ["EMBED_BACKEND"] = ns.backend
+    sys.argv = [f"{module}.py"] + (build(ns) if build else positionals(ns, args))
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+if __name__ == "__main__":
+    main()
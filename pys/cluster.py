@@ -1,47 +1,327 @@
+import os
 import sys
 import json
 import numpy as np
-import umap
-import hdbscan
+import joblib
+from embedding_store import load_store, save_store, as_float32
+import time
+import metrics
+from metrics import PeakRSS
 
-def load_embeddings(input_file):
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    ids = list(data.keys())
-    embeddings = np.array([data[id_] for id_ in ids])
-    return ids, embeddings
+MODES = ("fit", "assign", "refit", "sample")
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+MIN_CLUSTER_SIZE = 5
+MIN_SAMPLES = 2
+ALGORITHM = "best"  # boruvka_kdtree for our ≤60-d euclidean inputs
+CORE_DIST_N_JOBS = -1  # core distances on every core (library default is 4)
+# Mutual-reachability tree cache (joblib.Memory), keyed on the data and
+# min_samples, so a refit after a sweep reuses the sweep's tree. Only sweep
+# and refit use it, and only when HDBSCAN_CACHE is set (env.sh); it is
+# never pruned
+TREE_CACHE = os.environ.get("HDBSCAN_CACHE") or None
+SAMPLE_ROWS = 200_000  # Points fitted in sample mode; the rest are predicted
+STRATA = 64  # k-means strata the sample is drawn across
+MIN_PER_STRATUM = 200  # Small regions keep at least this many points
+PREDICT_BLOCK = 100_000
+SWEEP_SIZES = (5, 10, 15, 25, 50, 100)
+SILHOUETTE_ROWS = 10_000  # Clustered points scored per sweep configuration
 
-def reduce_embeddings(embeddings, n_components=2):
-    reducer = umap.UMAP(n_components=n_components)
-    return reducer.fit_transform(embeddings)
+def load_embeddings(input_file):
+    ids, embeddings = load_store(input_file)
+    return ids, as_float32(embeddings)
 
-def cluster_embeddings(embeddings):
+def _hdbscan(min_cluster_size=MIN_CLUSTER_SIZE, min_samples=MIN_SAMPLES, memory=None,
+             core_dist_n_jobs=CORE_DIST_N_JOBS, **kwargs):
+    import hdbscan
+    if memory:
+        # hdbscan's own default is an uncached joblib.Memory; None is rejected
+        kwargs["memory"] = memory
     return hdbscan.HDBSCAN(
-      min_cluster_size=5, 
-      min_samples=2, 
-      prediction_data=True
-    ).fit(embeddings)
+      min_cluster_size=min_cluster_size,
+      min_samples=min_samples,
+      algorithm=ALGORITHM,
+      core_dist_n_jobs=core_dist_n_jobs,
+      **kwargs
+    )
+
+def cluster_embeddings(embeddings, min_cluster_size=MIN_CLUSTER_SIZE, min_samples=MIN_SAMPLES,
+                       memory=None, core_dist_n_jobs=CORE_DIST_N_JOBS):
+    # Callers that already run in a process pool pass core_dist_n_jobs=1
+    return _hdbscan(min_cluster_size, min_samples, memory, core_dist_n_jobs,
+                    prediction_data=True).fit(embeddings)
 
 def save_clusters(ids, labels, output_json):
     with open(output_json, 'w', encoding='utf-8') as f:
         json.dump({id_: int(lbl) for id_, lbl in zip(ids, labels)}, f, indent=2)
     print(f"Clusters saved to {output_json}")
 
+# ---------------------------
+# PERSISTED CLUSTERER
+# The model file keeps the fitted HDBSCAN (with its prediction data), the
+# training ids and their labels. Labels are "stable" ids: label_map
+# translates the clusterer's own numbering to them, so a refit can keep
+# old cluster ids and never reuses a retired one (next_label).
+# ---------------------------
+def save_model(path, clusterer, ids, label_map, next_label):
+    labels = remap(clusterer.labels_, label_map)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    joblib.dump({
+        "clusterer": clusterer,
+        "train_ids": list(ids),
+        "labels": labels,
+        "label_map": label_map,
+        "next_label": next_label,
+    }, path)
+    print(f"Clusterer saved to {path}")
+    return labels
+
+def remap(raw_labels, label_map):
+    lookup = np.vectorize(lambda l: label_map.get(int(l), -1), otypes=[np.int64])
+    return lookup(raw_labels) if len(raw_labels) else np.empty(0, dtype=np.int64)
+
+def identity_map(labels):
+    found = sorted(int(l) for l in set(labels) if l >= 0)
+    return {l: l for l in found}, (found[-1] + 1 if found else 0)
+
+def match_labels(old_labels, new_labels, next_label):
+    # Contingency of (new cluster, old cluster) member overlap over the shared
+    # points; the assignment maximising total overlap keeps old ids.
+    from scipy.optimize import linear_sum_assignment
+    new_ids = sorted(int(l) for l in set(new_labels) if l >= 0)
+    old_ids = sorted(int(l) for l in set(old_labels) if l >= 0)
+    label_map = {}
+    if new_ids and old_ids:
+        both = (new_labels >= 0) & (old_labels >= 0)
+        new_pos = {l: i for i, l in enumerate(new_ids)}
+        old_pos = {l: i for i, l in enumerate(old_ids)}
+        overlap = np.zeros((len(new_ids), len(old_ids)), dtype=np.int64)
+        np.add.at(overlap,
+                  ([new_pos[int(l)] for l in new_labels[both]],
+                   [old_pos[int(l)] for l in old_labels[both]]), 1)
+        rows, cols = linear_sum_assignment(-overlap)
+        for r, c in zip(rows, cols):
+            if overlap[r, c] > 0:
+                label_map[new_ids[r]] = old_ids[c]
+    for l in new_ids:
+        if l not in label_map:
+            label_map[l] = next_label
+            next_label += 1
+    kept = sum(1 for l in new_ids if label_map[l] in old_ids)
+    print(f"Refit: {len(new_ids)} clusters, {kept} matched to previous ids, "
+          f"{len(new_ids) - kept} new")
+    return label_map, next_label
+
+# ---------------------------
+# MODES
+# ---------------------------
+def fit(ids, embs, model_path):
+    cl = cluster_embeddings(embs)
+    label_map, next_label = identity_map(cl.labels_)
+    return save_model(model_path, cl, ids, label_map, next_label)
+
+# ---------------------------
+# SUBSAMPLED FIT
+# Fits on a stratified sample (k-means strata over the input, allocated in
+# proportion to their size with a floor so sparse regions are not lost) and
+# labels every other point with approximate_predict. The model's training
+# ids are the sample, so a later `assign` predicts the rest the same way.
+# ---------------------------
+def stratified_sample(embs, n_rows, strata=STRATA, seed=0):
+    from sklearn.cluster import MiniBatchKMeans
+    if n_rows >= len(embs):
+        return np.arange(len(embs))
+    rng = np.random.default_rng(seed)
+    train = rng.choice(len(embs), min(len(embs), 50 * strata * 10), replace=False)
+    km = MiniBatchKMeans(n_clusters=strata, random_state=seed, n_init=3,
+                         batch_size=4096).fit(embs[np.sort(train)])
+    groups = np.concatenate([km.predict(embs[lo:lo + PREDICT_BLOCK])
+                             for lo in range(0, len(embs), PREDICT_BLOCK)])
+    sizes = np.bincount(groups, minlength=strata)
+    floor = min(MIN_PER_STRATUM, n_rows // strata)
+    quota = np.maximum(np.round(sizes * n_rows / len(embs)),
+                       np.minimum(sizes, floor)).astype(np.int64)
+    # Shuffle within each stratum, keep the first quota of each
+    order = np.lexsort((rng.random(len(embs)), groups))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(embs)) - starts[groups[order]]
+    return np.sort(order[rank < quota[groups[order]]])
+
+def fit_sampled(ids, embs, model_path, n_rows=SAMPLE_ROWS):
+    import hdbscan
+    with metrics.stage("sample"):
+        rows = stratified_sample(embs, n_rows)
+    print(f"Fitting on a stratified sample of {len(rows)} of {len(ids)} points")
+    with metrics.stage("fit_sample"):
+        cl = cluster_embeddings(embs[rows])
+    label_map, next_label = identity_map(cl.labels_)
+    sample_labels = save_model(model_path, cl, [ids[i] for i in rows], label_map, next_label)
+
+    labels = np.full(len(ids), -1, dtype=np.int64)
+    labels[rows] = sample_labels
+    rest = np.setdiff1d(np.arange(len(ids)), rows)
+    print(f"Predicting {len(rest)} remaining points")
+    with metrics.stage("approximate_predict"):
+        for lo in range(0, len(rest), PREDICT_BLOCK):
+            block = rest[lo:lo + PREDICT_BLOCK]
+            raw, _ = hdbscan.approximate_predict(cl, embs[block])
+            labels[block] = remap(raw, label_map)
+    metrics.count("sampled_points", len(rows))
+    return labels
+
+def refit(ids, embs, model_path):
+    old = joblib.load(model_path)
+    old_index = {id_: i for i, id_ in enumerate(old["train_ids"])}
+    cl = cluster_embeddings(embs, memory=TREE_CACHE)
+    old_labels = np.array([old["labels"][old_index[id_]] if id_ in old_index else -1
+                           for id_ in ids], dtype=np.int64)
+    label_map, next_label = match_labels(old_labels, cl.labels_, old["next_label"])
+    return save_model(model_path, cl, ids, label_map, next_label)
+
+def assign(ids, embs, model_path, output_json):
+    # Training points keep their labels; only unseen points are predicted
+    import hdbscan
+    model = joblib.load(model_path)
+    clusterer, label_map = model["clusterer"], model["label_map"]
+    train_index = {id_: i for i, id_ in enumerate(model["train_ids"])}
+    new = np.array([id_ not in train_index for id_ in ids], dtype=bool)
+
+    labels = np.array([model["labels"][train_index[id_]] if not is_new else -1
+                       for id_, is_new in zip(ids, new)], dtype=np.int64)
+    print(f"Assigning {int(new.sum())} new points ({int((~new).sum())} already clustered)")
+    if new.any():
+        raw, strengths = hdbscan.approximate_predict(clusterer, embs[new])
+        labels[new] = remap(raw, label_map)
+
+        # Column j of the membership matrix is stable cluster id j
+        member = hdbscan.membership_vector(clusterer, embs[new])
+        member = member.reshape(int(new.sum()), -1)
+        width = max(label_map.values(), default=-1) + 1
+        stable = np.zeros((len(member), width), dtype=np.float32)
+        for raw_label, stable_label in label_map.items():
+            if raw_label < member.shape[1]:
+                stable[:, stable_label] = member[:, raw_label]
+        new_ids = [id_ for id_, is_new in zip(ids, new) if is_new]
+        prefix = os.path.splitext(output_json)[0]
+        save_store(prefix + ".membership.npy", new_ids, stable)
+        save_store(prefix + ".strength.npy", new_ids, strengths.reshape(-1, 1))
+    return labels
+
+# ---------------------------
+# PARAMETER SWEEP
+# The expensive part of HDBSCAN (core distances, mutual-reachability MST,
+# single-linkage tree) depends only on min_samples. It is built once per
+# min_samples value and every min_cluster_size is re-extracted from it by
+# condensing the tree again, which takes seconds. Per configuration:
+#
+#   Clusters, NoiseShare, MeanProbability (clustered points)
+#   Persistence   summed stability of the selected clusters
+#   Silhouette    on up to SILHOUETTE_ROWS clustered points
+#   Seconds, PeakMB  (the shared tree build is its own TREE row)
+# ---------------------------
+SWEEP_COLUMNS = ["MinSamples", "MinClusterSize", "Clusters", "NoiseShare", "MeanProbability",
+                 "Persistence", "Silhouette", "Seconds", "PeakMB"]
+
+def cluster_quality(embs, labels, probabilities, stabilities, seed=0):
+    from sklearn.metrics import silhouette_score
+    clustered = labels >= 0
+    n_clusters = len(set(labels[clustered].tolist()))
+    silhouette = float("nan")
+    if n_clusters >= 2:
+        rows = np.nonzero(clustered)[0]
+        if len(rows) > SILHOUETTE_ROWS:
+            rows = np.sort(np.random.default_rng(seed).choice(rows, SILHOUETTE_ROWS, replace=False))
+        if len(set(labels[rows].tolist())) >= 2:
+            silhouette = float(silhouette_score(embs[rows], labels[rows]))
+    return [
+        n_clusters,
+        round(1 - clustered.mean(), 4) if len(labels) else 0.0,
+        round(float(probabilities[clustered].mean()), 4) if clustered.any() else 0.0,
+        round(float(np.sum(stabilities)), 2),
+        round(silhouette, 4),
+    ]
+
+def sweep(embs, sizes=SWEEP_SIZES, samples=(MIN_SAMPLES,)):
+    # hdbscan has no public entry point for re-extracting from a tree;
+    # _tree_to_labels is what HDBSCAN.fit itself calls
+    from hdbscan.hdbscan_ import _tree_to_labels
+    rows = []
+    for min_samples in samples:
+        start = time.perf_counter()
+        with metrics.stage(f"sweep_tree_ms{min_samples}"), PeakRSS() as rss:
+            tree = _hdbscan(min(sizes), min_samples, TREE_CACHE).fit(embs)._single_linkage_tree
+        rows.append([min_samples, "TREE", "", "", "", "", "",
+                     round(time.perf_counter() - start, 2), round(rss.peak / 2**20, 1)])
+        print(f"min_samples={min_samples}: tree built in {rows[-1][7]}s")
+        for size in sizes:
+            start = time.perf_counter()
+            with PeakRSS() as rss:
+                labels, probabilities, stabilities, _, _ = _tree_to_labels(embs, tree, size)
+            seconds = time.perf_counter() - start
+            metrics.add_time("sweep_extract", seconds)
+            row = [min_samples, size] + cluster_quality(embs, labels, probabilities, stabilities)
+            rows.append(row + [round(seconds, 2), round(rss.peak / 2**20, 1)])
+            print("  " + "  ".join(f"{c}={v}" for c, v in zip(SWEEP_COLUMNS[1:], rows[-1][1:])))
+    return rows
+
+def save_sweep(rows, output_csv):
+    import csv
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(SWEEP_COLUMNS)
+        writer.writerows(rows)
+    print(f"Sweep saved to {output_csv}")
+
+def _int_list(arg):
+    return tuple(int(v) for v in arg.split(","))
+
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: python clustering.py <input_json> <dim> <output_json>")
+    if len(sys.argv) == 4:
+        mode, model_path = "fit", None
+        input_file, dim, output_json = sys.argv[1:]
+    elif len(sys.argv) in (5, 6, 7) and sys.argv[1] == "sweep":
+        # sweep <input_npy> <dim> <output_csv> [sizes] [min_samples]
+        mode, input_file, dim, output_csv = sys.argv[1:5]
+        sizes = _int_list(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5] else SWEEP_SIZES
+        samples = _int_list(sys.argv[6]) if len(sys.argv) > 6 else (MIN_SAMPLES,)
+    elif len(sys.argv) in (6, 7) and sys.argv[1] in MODES:
+        mode, input_file, dim, output_json, model_path = sys.argv[1:6]
+        sample_rows = int(sys.argv[6]) if len(sys.argv) == 7 else SAMPLE_ROWS
+    else:
+        print("Usage: python clustering.py <input_npy> <dim> <output_json>")
+        print("       python clustering.py fit|assign|refit <input_npy> <dim> <output_json> <model_pkl>")
+        print("       python clustering.py sample <input_npy> <dim> <output_json> <model_pkl> [rows]")
+        print("       python clustering.py sweep <input_npy> <dim> <output_csv> [5,10,25] [1,2,5]")
         sys.exit(1)
 
-    input_file, dim, output_json = sys.argv[1:]
-    ids, embs = load_embeddings(input_file)
+    with metrics.stage("load"):
+        ids, embs = load_embeddings(input_file)
 
     if embs.shape[1] != int(dim):
         print(f"Expected {dim} dimensions, got {embs.shape[1]}")
         sys.exit(1)
 
-    cl = cluster_embeddings(embs)
-    save_clusters(ids, cl.labels_, output_json)
+    if mode == "sweep":
+        save_sweep(sweep(embs, sizes, samples), output_csv)
+        return
+
+    with metrics.stage(f"hdbscan_{mode}"):
+        if model_path is None:
+            labels = cluster_embeddings(embs).labels_
+        elif mode == "sample":
+            labels = fit_sampled(ids, embs, model_path, sample_rows)
+        elif mode == "fit" or not os.path.exists(model_path):
+            labels = fit(ids, embs, model_path)
+        elif mode == "refit":
+            labels = refit(ids, embs, model_path)
+        else:
+            labels = assign(ids, embs, model_path, output_json)
+    metrics.count("points", len(ids))
+    metrics.count("noise_points", int(np.sum(np.asarray(labels) == -1)))
+    with metrics.stage("write_json"):
+        save_clusters(ids, labels, output_json)
 
 if __name__ == "__main__":
     main()
-
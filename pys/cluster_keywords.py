@@ -0,0 +1,311 @@
+import os
+import sys
+import csv
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from embedding_store import load_store, as_float32
+from contract_reader import iter_batches
+import metrics
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+TOP_N = 10  # Keywords per cluster
+REPRESENTATIVES = 3  # NoticeIds closest to each cluster centroid
+NGRAMS = 2  # Unigrams and bigrams
+FEATURE_BITS = 22  # Hashed term columns (collisions are rare at 4M)
+MIN_DF = 5  # Terms in fewer documents never become keywords
+MAX_DF = 0.5  # ... nor terms in more than this share of documents
+WORKERS = 4
+CHUNK = 2_000  # Documents per worker task
+BOILERPLATE_PATH = "boilerplate_phrases.csv"
+
+# ---------------------------
+# CLUSTER KEYWORDS (class-based TF-IDF)
+# One sparse document × term matrix X over the cleaned corpus (terms are
+# hashed to columns in a worker pool; a side table maps columns back to
+# words), then per-cluster term counts with one sparse product
+#
+#   C = onehot(labels) @ X                      (clusters × terms)
+#   score(t, c) = tf(t, c) · log(1 + A / f(t))
+#
+# with tf the L1-normalised row of C, A the mean words per cluster and f(t)
+# the term's count over all clusters. The state directory keeps X (keyed by
+# NoticeId and cleaned-text hash), C and the previous labels, so a rerun
+# only tokenizes new or edited notices and adjusts C by the rows whose label
+# changed. Keywords are rescored for every cluster from C (the IDF term is
+# global, so one changed cluster shifts every score; scoring C is cheap);
+# representatives are recomputed only for clusters whose members changed.
+#
+#   state_dir/terms.npz, terms.keys   X and its "NoticeId<TAB>hash" rows
+#   state_dir/vocab.tsv               column → term
+#   state_dir/classes.npz, state.json C, labels and the last table
+# ---------------------------
+N_FEATURES = 1 << FEATURE_BITS
+
+def _stop_words():
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return ENGLISH_STOP_WORDS
+
+def _terms_chunk(texts):
+    # (rows, cols, counts, {col: term}) for a chunk of cleaned texts
+    from sklearn.utils import murmurhash3_32
+    stop = _stop_words()
+    rows, cols, vocab = [], [], {}
+    for i, text in enumerate(texts):
+        words = [w for w in text.split() if len(w) > 1 and not w.isdigit() and w not in stop]
+        grams = list(words)
+        for n in range(2, NGRAMS + 1):
+            grams.extend(" ".join(words[j:j + n]) for j in range(len(words) - n + 1))
+        for g in grams:
+            col = murmurhash3_32(g, positive=True) % N_FEATURES
+            vocab.setdefault(col, g)
+            rows.append(i)
+            cols.append(col)
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, vocab
+    keys, counts = np.unique(np.array(rows, dtype=np.int64) * N_FEATURES + np.array(cols, dtype=np.int64),
+                             return_counts=True)
+    r, c = np.divmod(keys, N_FEATURES)
+    return r, c, counts, vocab
+
+def term_matrix(texts, vocab, workers=WORKERS, chunk=CHUNK):
+    from scipy import sparse
+    chunks = [texts[i:i + chunk] for i in range(0, len(texts), chunk)]
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (r, c, n, words), part in zip(executor.map(_terms_chunk, chunks), chunks):
+            for col, term in words.items():
+                vocab.setdefault(col, term)
+            parts.append(sparse.csr_matrix((n.astype(np.float32), (r, c)), shape=(len(part), N_FEATURES)))
+    if not parts:
+        return sparse.csr_matrix((0, N_FEATURES), dtype=np.float32)
+    return sparse.vstack(parts, format="csr")
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+def load_texts(contract_csv, ids, boilerplate_path=BOILERPLATE_PATH):
+    # Cleaned text per id: the embeddings' boilerplate stripping, but title and
+    # description joined by a space, not the model's [SEP] token (which would
+    # become a term)
+    from text_cleaner import load_phrases, clean_rows
+    wanted = set(ids)
+    rows = {}
+    for batch in iter_batches(contract_csv, columns=['NoticeId', 'Title', 'Description']):
+        batch = batch[batch['NoticeId'].isin(wanted)]
+        rows.update(zip(batch['NoticeId'], zip(batch['Title'], batch['Description'])))
+    phrases = load_phrases(boilerplate_path) if os.path.exists(boilerplate_path) else []
+    cleaned = clean_rows((rows.get(id_, ("", "")) for id_ in ids), phrases, " ", workers=WORKERS)
+    return [c for c, _ in cleaned]
+
+# ---------------------------
+# STATE
+# ---------------------------
+def _empty_state():
+    from scipy import sparse
+    return {
+        "X": sparse.csr_matrix((0, N_FEATURES), dtype=np.float32), "keys": [], "vocab": {},
+        "C": sparse.csr_matrix((0, N_FEATURES), dtype=np.float32), "classes": [],
+        "doc_labels": {}, "table": {},
+    }
+
+def load_state(state_dir):
+    from scipy import sparse
+    state = _empty_state()
+    if not os.path.exists(os.path.join(state_dir, "state.json")):
+        return state
+    state["X"] = sparse.load_npz(os.path.join(state_dir, "terms.npz")).tocsr()
+    with open(os.path.join(state_dir, "terms.keys"), 'r', encoding='utf-8') as f:
+        state["keys"] = [tuple(line.rstrip('\n').split('\t')) for line in f]
+    with open(os.path.join(state_dir, "vocab.tsv"), 'r', encoding='utf-8') as f:
+        state["vocab"] = {int(col): term for col, term in (line.rstrip('\n').split('\t', 1) for line in f)}
+    state["C"] = sparse.load_npz(os.path.join(state_dir, "classes.npz")).tocsr()
+    with open(os.path.join(state_dir, "state.json"), 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    state["classes"] = saved["classes"]
+    state["doc_labels"] = saved["doc_labels"]
+    state["table"] = {int(k): v for k, v in saved["table"].items()}
+    return state
+
+def save_state(state_dir, state):
+    from scipy import sparse
+    os.makedirs(state_dir, exist_ok=True)
+    sparse.save_npz(os.path.join(state_dir, "terms.npz"), state["X"])
+    with open(os.path.join(state_dir, "terms.keys"), 'w', encoding='utf-8') as f:
+        f.writelines(f"{nid}\t{h}\n" for nid, h in state["keys"])
+    with open(os.path.join(state_dir, "vocab.tsv"), 'w', encoding='utf-8') as f:
+        f.writelines(f"{col}\t{term}\n" for col, term in state["vocab"].items())
+    sparse.save_npz(os.path.join(state_dir, "classes.npz"), state["C"])
+    # state.json last: its presence marks a complete state
+    with open(os.path.join(state_dir, "state.json"), 'w', encoding='utf-8') as f:
+        json.dump({"classes": state["classes"], "doc_labels": state["doc_labels"],
+                   "table": state["table"]}, f)
+
+# ---------------------------
+# SCORING
+# ---------------------------
+def _onehot(class_rows, n_classes):
+    from scipy import sparse
+    return sparse.csr_matrix((np.ones(len(class_rows), dtype=np.float32),
+                              (class_rows, np.arange(len(class_rows)))),
+                             shape=(n_classes, len(class_rows)))
+
+def ctfidf_keywords(C, X, rows, vocab, top_n=TOP_N):
+    # Top terms for the given class rows of C
+    doc_freq = np.bincount(X.indices, minlength=N_FEATURES)
+    usable = (doc_freq >= MIN_DF) & (doc_freq <= MAX_DF * max(X.shape[0], 1))
+    totals = np.asarray(C.sum(axis=0)).ravel()
+    words_per_class = np.asarray(C.sum(axis=1)).ravel()
+    avg_words = words_per_class.mean() if len(words_per_class) else 0.0
+    idf = np.zeros(N_FEATURES, dtype=np.float64)
+    nz = totals > 0
+    idf[nz] = np.log1p(avg_words / totals[nz])
+    idf[~usable] = 0
+    out = {}
+    for r in rows:
+        row = C.getrow(r)
+        if not row.nnz:
+            out[r] = []
+            continue
+        scores = row.data / max(row.data.sum(), 1) * idf[row.indices]
+        k = min(top_n, int(np.sum(scores > 0)))
+        if not k:
+            out[r] = []
+            continue
+        # Ties by column, so incremental and full runs list the same terms
+        best = np.lexsort((row.indices, -scores))[:k]
+        out[r] = [vocab.get(int(row.indices[b]), "?") for b in best]
+    return out
+
+def representatives(unit, members, n=REPRESENTATIVES):
+    centroid = unit[members].mean(axis=0)
+    centroid /= max(np.linalg.norm(centroid), 1e-12)
+    sims = unit[members] @ centroid
+    k = min(n, len(members))
+    best = np.argpartition(-sims, k - 1)[:k]
+    return members[best[np.argsort(-sims[best])]]
+
+# ---------------------------
+# UPDATE
+# ---------------------------
+def update(ids, vectors, labels, contract_csv, state_dir, full=False, boilerplate_path=BOILERPLATE_PATH):
+    from scipy import sparse
+    from ann_index import normalize
+
+    state = _empty_state() if full else load_state(state_dir)
+    labels = np.asarray(labels, dtype=np.int64)
+    with metrics.stage("load_texts"):
+        texts = load_texts(contract_csv, ids, boilerplate_path)
+    hashes = [text_hash(t) for t in texts]
+
+    # X: reuse rows whose cleaned text is unchanged, tokenize the rest
+    old_row = {key: i for i, key in enumerate(state["keys"])}
+    keys = list(zip(ids, hashes))
+    reuse = np.array([old_row.get(k, -1) for k in keys], dtype=np.int64)
+    fresh = np.nonzero(reuse < 0)[0]
+    print(f"Tokenizing {len(fresh)} documents ({len(ids) - len(fresh)} reused)")
+    with metrics.stage("tokenize"):
+        X_new = term_matrix([texts[i] for i in fresh], state["vocab"])
+    metrics.count("documents_tokenized", len(fresh))
+    pos = np.full(len(ids), -1, dtype=np.int64)
+    pos[fresh] = np.arange(len(fresh)) + state["X"].shape[0]
+    pos[reuse >= 0] = reuse[reuse >= 0]
+    X_all = sparse.vstack([state["X"], X_new], format="csr")
+    X = X_all[pos]
+
+    # C: subtract changed documents under their old label/row, add them back
+    # under the new one. Documents gone from the store are only subtracted.
+    classes = list(state["classes"])
+    class_row = {c: i for i, c in enumerate(classes)}
+    for c in sorted(set(labels.tolist()) - set(class_row)):
+        class_row[c] = len(classes)
+        classes.append(c)
+    C = state["C"]
+    if C.shape[0] < len(classes):
+        C = sparse.vstack([C, sparse.csr_matrix((len(classes) - C.shape[0], N_FEATURES),
+                                                dtype=np.float32)], format="csr")
+
+    prev = state["doc_labels"]  # NoticeId → [label, X row]
+    now = {id_: i for i, id_ in enumerate(ids)}
+    changed = [i for i, id_ in enumerate(ids)
+               if id_ not in prev or prev[id_][0] != labels[i] or reuse[i] != prev[id_][1]]
+    gone = [id_ for id_ in prev if id_ not in now]
+    removed = gone + [ids[i] for i in changed if ids[i] in prev]
+    touched = set(labels[changed].tolist()) | {prev[id_][0] for id_ in removed}
+    with metrics.stage("aggregate"):
+        if removed:
+            old_rows = np.array([prev[id_][1] for id_ in removed], dtype=np.int64)
+            old_cls = [class_row[prev[id_][0]] for id_ in removed]
+            C = C - _onehot(old_cls, len(classes)) @ state["X"][old_rows]
+        if changed:
+            C = C + _onehot([class_row[int(labels[i])] for i in changed], len(classes)) @ X[changed]
+        C.eliminate_zeros()
+    present = sorted(set(labels.tolist()))
+    old_table = {} if full else state["table"]
+    recompute = set(present) if full else (touched | (set(present) - set(old_table)))
+    print(f"{len(changed)} documents changed label or text, {len(gone)} removed; "
+          f"{len(recompute)} clusters changed members")
+
+    table = {}
+    with metrics.stage("score"):
+        keywords = ctfidf_keywords(C, X, [class_row[c] for c in present], state["vocab"])
+        unit = normalize(as_float32(vectors)) if recompute else None
+        for c in present:
+            members = np.nonzero(labels == c)[0]
+            if c in recompute:
+                reps = [ids[i] for i in representatives(unit, members)] if c != -1 else []
+            else:
+                reps = old_table[c]["representatives"]
+            table[c] = {"size": int(len(members)), "keywords": keywords[class_row[c]],
+                        "representatives": reps}
+    metrics.count("clusters_rescored", len(present))
+    metrics.count("representatives_recomputed", len(recompute))
+
+    # Compact: keep only the rows the current ids use
+    state.update({
+        "X": X, "keys": keys, "C": C, "classes": classes, "table": table,
+        "doc_labels": {id_: [int(labels[i]), i] for i, id_ in enumerate(ids)},
+    })
+    save_state(state_dir, state)
+    return table
+
+def save_table(table, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Cluster", "Size", "Keywords", "Representatives"])
+        for c in sorted(table):
+            row = table[c]
+            writer.writerow([c, row["size"], "; ".join(row["keywords"]), " ".join(row["representatives"])])
+    print(f"Keywords for {len(table)} clusters saved to {output_csv}")
+
+def load_table(keywords_csv):
+    # Cluster → (keywords, representative NoticeIds), for plotting
+    with open(keywords_csv, 'r', encoding='utf-8', newline='') as f:
+        return {int(row["Cluster"]): ([k for k in row["Keywords"].split("; ") if k],
+                                      row["Representatives"].split())
+                for row in csv.DictReader(f)}
+
+def main():
+    if len(sys.argv) not in (6, 7):
+        print("Usage: python cluster_keywords.py store.npy cluster.json opportunities.csv "
+              "output.csv state_dir [full]")
+        sys.exit(1)
+    store_path, cluster_json, contract_csv, output_csv, state_dir = sys.argv[1:6]
+    full = len(sys.argv) == 7 and sys.argv[6] == "full"
+
+    ids, vectors = load_store(store_path)
+    with open(cluster_json, 'r', encoding='utf-8') as f:
+        cluster_data = json.load(f)
+    # Capability rows (CAP:) are not documents
+    keep = [i for i, id_ in enumerate(ids) if not id_.startswith('CAP:')]
+    ids = [ids[i] for i in keep]
+    labels = [cluster_data.get(id_, -1) for id_ in ids]
+    table = update(ids, vectors[keep], labels, contract_csv, state_dir, full)
+    save_table(table, output_csv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+import numpy as np
+from ann_index import load_unit_matrix, top_k_indices, exact_search, _derived, _stale
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+TIERS = ("f16", "pq")
+PQ_SUBSPACES = 96  # Most subspaces M; the largest divisor of the dim up to this is used (768 → 96)
+PQ_CENTROIDS = 256  # per subspace, so every code is one uint8
+PQ_TRAIN_ROWS = 100_000
+PQ_ITERS = 20
+RERANK = 200  # Candidates re-scored against the full-precision rows
+MARGIN = {"f16": 0.002, "pq": 0.05}  # Threshold slack for candidates before re-rank
+BLOCK_ROWS = 16_384
+
+# ---------------------------
+# COMPRESSED SEARCH TIER
+# Small enough to keep the whole corpus in RAM, next to the store:
+#
+#   cache.f16.npy   unit rows as float16                 (2 bytes / dim)
+#   cache.pq.npz    product quantization: M codebooks of (PQ_CENTROIDS,
+#                   dim/M) centroids and one uint8 code per subspace per
+#                   row                                  (M bytes / row)
+#
+# A query scores every row against the compressed copy (PQ: asymmetric
+# distance; the query stays exact and one M × 256 lookup table replaces
+# the dot product), keeps the best RERANK (or everything within MARGIN of
+# the threshold) and re-scores those against cache.unit.npy, which stays
+# memory-mapped on disk; only the candidate rows are read.
+# ---------------------------
+class F16Index:
+    kind = "f16"
+
+    def __init__(self, path):
+        self.mat = np.load(path)
+
+    @property
+    def nbytes(self):
+        return self.mat.nbytes
+
+    def __len__(self):
+        return len(self.mat)
+
+    def scores(self, q_unit):
+        q = np.asarray(q_unit, dtype=np.float32)
+        # float16 has no BLAS path; upcast a block at a time
+        return np.concatenate([self.mat[lo:lo + BLOCK_ROWS].astype(np.float32) @ q
+                               for lo in range(0, len(self.mat), BLOCK_ROWS)])
+
+class PQIndex:
+    kind = "pq"
+
+    def __init__(self, path):
+        with np.load(path) as z:
+            self.codebooks = z["codebooks"]  # (M, K, d)
+            self.codes = z["codes"]  # (n, M) uint8
+        m, k, _ = self.codebooks.shape
+        self.offsets = (np.arange(m) * k).astype(np.int64)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def scores(self, q_unit):
+        m, k, d = self.codebooks.shape
+        q = np.asarray(q_unit, dtype=np.float32).reshape(m, d)
+        table = np.einsum('mkd,md->mk', self.codebooks, q).ravel()
+        return np.concatenate([table[self.codes[lo:lo + BLOCK_ROWS] + self.offsets].sum(axis=1)
+                               for lo in range(0, len(self.codes), BLOCK_ROWS)])
+
+# ---------------------------
+# BUILD
+# ---------------------------
+def build_f16(unit, path):
+    out = np.lib.format.open_memmap(path + ".tmp", mode='w+', dtype=np.float16, shape=unit.shape)
+    for lo in range(0, len(unit), BLOCK_ROWS):
+        out[lo:lo + BLOCK_ROWS] = unit[lo:lo + BLOCK_ROWS]
+    out.flush()
+    del out
+    os.replace(path + ".tmp", path)
+
+def _kmeans(x, k, iters, rng):
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].copy()
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=x[:, j], minlength=k)
+                         for j in range(x.shape[1])], axis=1)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty centroids from random points
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+def _nearest(x, centroids):
+    # argmin ||x - c||² = argmin (||c||² - 2 x·c)
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * x @ centroids.T, axis=1)
+
+def subspaces_for(dim, max_m=PQ_SUBSPACES):
+    # Largest M <= max_m that splits dim evenly: 384 → 96, 256 → 64, 100 → 50
+    return max(m for m in range(1, min(max_m, dim) + 1) if dim % m == 0)
+
+def train_pq(unit, m=None, k=PQ_CENTROIDS, train_rows=PQ_TRAIN_ROWS, iters=PQ_ITERS, seed=0):
+    n, dim = unit.shape
+    m = m or subspaces_for(dim)
+    if dim % m:
+        raise ValueError(f"PQ needs the vector dim to split evenly: {dim} is not a multiple of M={m}")
+    if k > 256:
+        raise ValueError(f"PQ codes are uint8; PQ_CENTROIDS={k} must be at most 256")
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, min(n, train_rows), replace=False))
+    sample = np.asarray(unit[rows], dtype=np.float32)
+    d = dim // m
+    print(f"Training {m} PQ codebooks ({d} dims each) of {k} centroids on {len(rows)} rows")
+    return np.stack([_kmeans(sample[:, s * d:(s + 1) * d], k, iters, rng) for s in range(m)])
+
+def encode_pq(unit, codebooks):
+    m, _, d = codebooks.shape
+    codes = np.empty((len(unit), m), dtype=np.uint8)
+    for lo in range(0, len(unit), BLOCK_ROWS):
+        block = np.asarray(unit[lo:lo + BLOCK_ROWS], dtype=np.float32)
+        for s in range(m):
+            codes[lo:lo + len(block), s] = _nearest(block[:, s * d:(s + 1) * d], codebooks[s])
+    return codes
+
+def build_pq(unit, path):
+    codebooks = train_pq(unit)
+    codes = encode_pq(unit, codebooks)
+    with open(path + ".tmp", 'wb') as f:
+        np.savez(f, codebooks=codebooks, codes=codes)
+    os.replace(path + ".tmp", path)
+
+def load_tier(store_path, kind, unit=None):
+    if kind not in TIERS:
+        raise ValueError(f"Unknown search tier {kind!r}; expected one of {TIERS}")
+    path = _derived(store_path, ".f16.npy" if kind == "f16" else ".pq.npz")
+    if _stale(path, store_path):
+        if unit is None:
+            _, unit = load_unit_matrix(store_path)
+        print(f"Building {kind} tier → {path}")
+        (build_f16 if kind == "f16" else build_pq)(unit, path)
+    index = F16Index(path) if kind == "f16" else PQIndex(path)
+    print(f"{kind} tier: {len(index)} rows, {index.nbytes / 2**20:.1f} MB in RAM")
+    return index
+
+# ---------------------------
+# SEARCH
+# ---------------------------
+def tier_search(index, unit_mat, q_unit, threshold=None, top_k=None, rerank=RERANK):
+    # unit_mat=None skips the re-rank and returns compressed scores
+    approx = index.scores(q_unit)
+    if top_k:
+        cand = top_k_indices(approx, max(rerank, top_k))
+    elif threshold is not None:
+        cand = np.nonzero(approx >= threshold - MARGIN[index.kind])[0]
+    else:
+        cand = np.arange(len(approx))
+    if unit_mat is None:
+        sims = approx[cand]
+    else:
+        cand = np.sort(cand)  # sequential reads from the memory map
+        sims = np.asarray(unit_mat[cand], dtype=np.float32) @ np.asarray(q_unit, dtype=np.float32)
+    order = np.argsort(-sims, kind='stable')
+    if top_k:
+        order = order[:top_k]
+    if threshold is not None:
+        order = order[sims[order] >= threshold]
+    return cand[order], sims[order]
+
+# ---------------------------
+# REPORT
+# Memory is what each tier keeps resident; the re-ranked tiers also read
+# RERANK rows per query from cache.unit.npy. Recall@k is against exact
+# float32 search over the unit rows.
+# ---------------------------
+def report(store_path, k=10, n_queries=200, seed=0):
+    ids, unit = load_unit_matrix(store_path)
+    n, dim = unit.shape
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(unit[np.sort(rng.choice(n, min(n_queries, n), replace=False))], dtype=np.float32)
+    truth = [exact_search(unit, q, top_k=k)[0] for q in queries]
+
+    def run(fn):
+        start = time.perf_counter()
+        found = [fn(q) for q in queries]
+        ms = 1000 * (time.perf_counter() - start) / len(queries)
+        recall = sum(len(np.intersect1d(t, f)) for t, f in zip(truth, found)) / (len(queries) * k)
+        return ms, recall
+
+    rows = []
+    f64_bytes = n * dim * 8
+    if f64_bytes <= 2 * 2**30:
+        mat64 = np.asarray(unit, dtype=np.float64)
+        ms, recall = run(lambda q: top_k_indices(mat64 @ q.astype(np.float64), k))
+        rows.append(("exact float64", f64_bytes, ms, recall))
+        del mat64
+    else:
+        rows.append(("exact float64", f64_bytes, float("nan"), float("nan")))
+    resident = np.asarray(unit)
+    ms, recall = run(lambda q: exact_search(resident, q, top_k=k)[0])
+    rows.append(("exact float32", resident.nbytes, ms, recall))
+    for kind in TIERS:
+        index = load_tier(store_path, kind, unit)
+        ms, recall = run(lambda q: tier_search(index, None, q, top_k=k)[0])
+        rows.append((kind, index.nbytes, ms, recall))
+        ms, recall = run(lambda q: tier_search(index, unit, q, top_k=k)[0])
+        rows.append((f"{kind} + re-rank", index.nbytes, ms, recall))
+
+    print(f"{n} rows × {dim} dims, {len(queries)} queries, k={k}, re-rank {RERANK}")
+    print(f"{'tier':<18}{'MB':>10}{'ms/query':>10}{f'recall@{k}':>11}")
+    for name, nbytes, ms, recall in rows:
+        print(f"{name:<18}{nbytes / 2**20:>10.1f}{ms:>10.2f}{recall:>11.4f}")
+    return rows
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "build" and len(sys.argv) <= 4:
+        for kind in ([sys.argv[3]] if len(sys.argv) == 4 else TIERS):
+            load_tier(sys.argv[2], kind)
+    elif len(sys.argv) in (3, 4, 5) and sys.argv[1] == "report":
+        report(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+               int(sys.argv[4]) if len(sys.argv) > 4 else 200)
+    else:
+        print("Usage: python compressed_index.py build cache.npy [f16|pq]")
+        print("       python compressed_index.py report cache.npy [k] [n_queries]")
+        sys.exit(1)
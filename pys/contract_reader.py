@@ -0,0 +1,173 @@
+import os
+import sys
+import warnings
+import pandas as pd
+import metrics
+
+# ---------------------------
+# STREAMING CONTRACT READER
+# One place that knows how to read the SAM.gov opportunities file. Reads
+# either the raw CSV (in chunks) or the Parquet dataset written by
+# to_parquet (partitioned by PostedDate year), and only materialises the
+# columns a stage asks for. NAICS and year filters are applied per chunk,
+# or pushed down to the Parquet scan.
+#
+# Requested columns are checked against the header first, so an export
+# without one fails with its name. Malformed CSV lines are skipped but
+# counted: each chunk reports its skipped line numbers and the total is
+# printed at the end (and kept as the csv_bad_lines metric). With usecols
+# the C parser keeps over-long lines (extra trailing fields are ignored),
+# so only full-width reads such as to_parquet lose lines.
+#
+#   for batch in iter_batches(path, columns=["NoticeId", "Title"], naics={"541715"}):
+#       ...  # batch is a DataFrame of str columns
+# ---------------------------
+CHUNK_ROWS = 100_000
+ENCODING = "utf-8"
+YEAR_COLUMN = "year"
+
+# Columns whose values are identifiers/labels and get whitespace-stripped
+STRIPPED = {"NoticeId", "Title", "NaicsCode", "Department/Ind.Agency", "Sub-Tier", "Office"}
+
+def posted_year(posted_date):
+    # PostedDate always starts with the 4-digit year ("2024-03-01 09:53:25...")
+    return pd.to_numeric(posted_date.str[:4], errors='coerce').astype('Int16')
+
+def _read_columns(columns, naics, years):
+    needed = list(columns) if columns else None
+    if needed is not None:
+        if naics and "NaicsCode" not in needed:
+            needed.append("NaicsCode")
+        if years and "PostedDate" not in needed:
+            needed.append("PostedDate")
+    return needed
+
+def _finish(chunk, columns, naics, years):
+    for col in STRIPPED.intersection(chunk.columns):
+        chunk[col] = chunk[col].str.strip()
+    if naics:
+        chunk = chunk[chunk["NaicsCode"].isin(naics)]
+    if years:
+        year = chunk[YEAR_COLUMN] if YEAR_COLUMN in chunk else posted_year(chunk["PostedDate"])
+        chunk = chunk[year.isin(years).fillna(False).to_numpy(dtype=bool)]
+    if columns:
+        chunk = chunk[list(columns)]
+    return chunk
+
+def _check_columns(path, needed, available):
+    missing = [c for c in needed or [] if c not in available]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(repr(c) for c in missing)} column "
+                         f"(columns: {', '.join(available)})")
+
+def _counting_bad_lines(reader, path):
+    # on_bad_lines="warn" raises one ParserWarning per chunk listing every
+    # skipped line; collect them instead of letting warnings print them once
+    total = 0
+    while True:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", pd.errors.ParserWarning)
+            chunk = next(reader, None)
+        skipped = []
+        for w in caught:
+            if issubclass(w.category, pd.errors.ParserWarning):
+                skipped += [line for line in str(w.message).splitlines() if line.startswith("Skipping line")]
+            else:
+                warnings.showwarning(w.message, w.category, w.filename, w.lineno)
+        if skipped:
+            total += len(skipped)
+            metrics.count("csv_bad_lines", len(skipped))
+            print(f"{path}: skipped {len(skipped)} malformed lines ({skipped[0]}"
+                  f"{', ...' if len(skipped) > 1 else ''})")
+        if chunk is None:
+            break
+        yield chunk
+    if total:
+        print(f"{path}: {total} malformed lines skipped in total")
+
+def _iter_csv(path, columns, naics, years, chunk_rows):
+    needed = _read_columns(columns, naics, years)
+    header = pd.read_csv(path, nrows=0, encoding=ENCODING, encoding_errors="ignore").columns
+    _check_columns(path, needed, list(header))
+    reader = pd.read_csv(
+        path,
+        usecols=needed,
+        dtype=str,
+        keep_default_na=False,
+        encoding=ENCODING,
+        encoding_errors="ignore",
+        on_bad_lines="warn",
+        chunksize=chunk_rows,
+    )
+    for chunk in metrics.timed_iter("csv_parse", _counting_bad_lines(reader, path)):
+        metrics.count("csv_rows_read", len(chunk))
+        chunk = _finish(chunk, columns, naics, years)
+        metrics.count("csv_rows_kept", len(chunk))
+        if len(chunk):
+            yield chunk
+
+def _iter_parquet(path, columns, naics, years, chunk_rows):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    _check_columns(path, _read_columns(columns, naics, years), dataset.schema.names)
+    filt = None
+    if naics:
+        filt = ds.field("NaicsCode").isin(sorted(naics))
+    if years:
+        by_year = ds.field(YEAR_COLUMN).isin(sorted(years))
+        filt = by_year if filt is None else filt & by_year
+    scanner = dataset.scanner(columns=list(columns) if columns else None,
+                              filter=filt, batch_size=chunk_rows)
+    for batch in metrics.timed_iter("parquet_scan", scanner.to_batches()):
+        metrics.count("csv_rows_kept", batch.num_rows)
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+def iter_batches(path, columns=None, naics=None, years=None, chunk_rows=CHUNK_ROWS):
+    if os.path.isdir(path):
+        yield from _iter_parquet(path, columns, naics, years, chunk_rows)
+    else:
+        yield from _iter_csv(path, columns, naics, years, chunk_rows)
+
+def iter_rows(path, columns=None, naics=None, years=None, chunk_rows=CHUNK_ROWS):
+    for batch in iter_batches(path, columns, naics, years, chunk_rows):
+        yield from batch.to_dict("records")
+
+def unique_title_rows(path, columns, naics=None, chunk_rows=CHUNK_ROWS):
+    # First row for every non-empty Title, as dicts
+    rows = []
+    seen_titles = set()
+    for batch in iter_batches(path, columns=columns, naics=naics, chunk_rows=chunk_rows):
+        titles = batch['Title']
+        keep = (titles != '') & ~titles.duplicated() & ~titles.isin(seen_titles)
+        batch = batch[keep]
+        seen_titles.update(batch['Title'])
+        rows.extend(batch.to_dict('records'))
+    return rows
+
+# ---------------------------
+# ONE-TIME PARQUET CONVERSION
+# ---------------------------
+def to_parquet(csv_path, out_dir, chunk_rows=CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    total = 0
+    for chunk in _iter_csv(csv_path, None, None, None, chunk_rows):
+        chunk[YEAR_COLUMN] = posted_year(chunk["PostedDate"]).fillna(0)
+        pq.write_to_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            root_path=out_dir,
+            partition_cols=[YEAR_COLUMN],
+            basename_template=f"part-{total:012d}-{{i}}.parquet",
+        )
+        total += len(chunk)
+        print(f"Converted {total} rows", end="\r")
+    print(f"\nWrote {total} rows → {out_dir}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "to_parquet":
+        print("Usage: python contract_reader.py to_parquet input.csv output_dir")
+        sys.exit(1)
+    to_parquet(sys.argv[2], sys.argv[3])
@@ -1,26 +1,21 @@
 import csv
 import sys
+from contract_reader import iter_batches
 
-def extract_hierarchy(input_csv, output_csv):
-    with open(input_csv, newline='', encoding='utf-8', errors='ignore') as infile, \
-         open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
+SOURCE_COLUMNS = ["NoticeId", "Department/Ind.Agency", "Sub-Tier", "Office", "Title", "PostedDate"]
 
-        reader = csv.DictReader(infile)
+def extract_hierarchy(input_csv, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
         writer = csv.writer(outfile)
 
         # Write header for the new CSV
-        writer.writerow(["NoticeId", "Department", "SubTier", "Office", "Title"])
-
-        for row in reader:
-            nid = (row.get("NoticeId") or "").strip()
-            level1 = (row.get("Department/Ind.Agency") or "").strip()
-            level2 = (row.get("Sub-Tier") or "").strip()
-            level3 = (row.get("Office") or "").strip()
-            title = (row.get("Title") or "").strip()
+        writer.writerow(["NoticeId", "Department", "SubTier", "Office", "Title", "PostedDate"])
 
-            if nid:  # only write rows with a NoticeId
-                writer.writerow([nid, level1, level2, level3, title])
+        for batch in iter_batches(input_csv, columns=SOURCE_COLUMNS):
+            batch = batch[batch["NoticeId"] != ""]  # only write rows with a NoticeId
+            writer.writerows(batch.itertuples(index=False, name=None))
 
+    # agency_index.py builds its per-store index from this file
     print(f"Extracted hierarchy to {output_csv}")
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+import os
+import sys
+import time
+import numpy as np
+import torch
+from tqdm import tqdm
+import metrics
+
+# ---------------------------
+# EMBEDDING ENGINE
+# One model in one process. Texts are tokenized once, sorted by length and
+# packed into batches that stay under a padded-token budget, so short
+# descriptions are never padded out to the longest one in the corpus.
+# ---------------------------
+MAX_TOKENS = 8192  # padded tokens per forward pass
+MAX_LENGTH = 512
+STRIDE = 64  # tokens shared by consecutive windows of a long document
+POOLING = "weighted"  # or "mean"
+
+class EmbeddingEngine:
+    def __init__(self, tokenizer, model, max_tokens=MAX_TOKENS, max_length=MAX_LENGTH,
+                 num_threads=None, quantize=False):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if quantize:
+            # Dynamic int8 only covers Linear layers and only runs on CPU
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        model.eval()
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_length = max_length
+        self.dim = model.config.hidden_size
+        self.last_stats = {}
+
+    @classmethod
+    def from_pretrained(cls, model_name, **kwargs):
+        from transformers import AutoTokenizer, AutoModel
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        return cls(tokenizer, model, **kwargs)
+
+    def _batches(self, lengths):
+        # Longest first, so the biggest batch (and any OOM) happens up front
+        order = np.argsort(lengths, kind='stable')[::-1]
+        batches, batch, longest = [], [], 0
+        for i in order:
+            longest = max(longest, lengths[i])
+            if batch and (len(batch) + 1) * longest > self.max_tokens:
+                batches.append(batch)
+                batch, longest = [], lengths[i]
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _collate(self, enc, batch):
+        # Right-pad one batch to its own longest member
+        longest = max(len(enc['input_ids'][i]) for i in batch)
+        feats = {}
+        for key, values in enc.items():
+            pad = self.tokenizer.pad_token_id if key == 'input_ids' else 0
+            arr = np.full((len(batch), longest), pad, dtype=np.int64)
+            for row, i in enumerate(batch):
+                arr[row, :len(values[i])] = values[i]
+            feats[key] = torch.from_numpy(arr)
+        return feats
+
+    def _forward(self, enc, lengths, desc, quiet):
+        # CLS vector of every encoded sequence, in token-budgeted batches
+        out = np.empty((len(lengths), self.dim), dtype=np.float32)
+        batches = self._batches(lengths)
+        padded = 0
+        with torch.inference_mode():
+            for batch in tqdm(batches, desc=desc, unit="batch", disable=quiet):
+                feats = self._collate(enc, batch)
+                padded += feats['input_ids'].numel()
+                with metrics.timer("forward"):
+                    outputs = self.model(**feats)
+                out[batch] = outputs.last_hidden_state[:, 0, :].float().numpy()
+        return out, len(batches), padded
+
+    def embed(self, texts, desc="Embedding", quiet=False):
+        texts = [(t if t is not None else '') for t in texts]
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        with metrics.timer("tokenize"):
+            enc = self.tokenizer(texts, truncation=True, max_length=self.max_length, padding=False)
+        lengths = np.array([len(ids) for ids in enc['input_ids']])
+        out, n_batches, padded = self._forward(enc, lengths, desc, quiet)
+
+        seconds = time.perf_counter() - start
+        metrics.count("texts_embedded", len(texts))
+        metrics.count("tokens", int(lengths.sum()))
+        metrics.count("padded_tokens", padded)
+        self.last_stats = {
+            "texts": len(texts),
+            "batches": n_batches,
+            "seconds": seconds,
+            "texts_per_sec": len(texts) / seconds,
+            "tokens": int(lengths.sum()),
+            "padded_tokens": padded,
+        }
+        if not quiet:
+            print(f"Embedded {len(texts)} texts in {seconds:.1f}s "
+                  f"({len(texts) / seconds:.1f} texts/sec, "
+                  f"{1 - lengths.sum() / padded:.1%} padding)")
+        return out
+
+    # ---------------------------
+    # LONG DOCUMENTS
+    # embed() keeps only the first max_length tokens. embed_chunked covers
+    # the whole text: each document is cut into overlapping windows of
+    # max_length tokens ([CLS] ... [SEP] each), windows from all documents
+    # are packed into the same length-sorted batches, and each document's
+    # window CLS vectors are pooled back into one vector ("mean", or
+    # "weighted" by the number of tokens each window adds).
+    # ---------------------------
+    def _windows(self, ids, stride):
+        body = self.max_length - 2
+        if len(ids) <= body:
+            return [(0, len(ids))]
+        step = body - stride
+        starts = list(range(0, len(ids) - body, step)) + [len(ids) - body]
+        return [(s, s + body) for s in starts]
+
+    def embed_chunked(self, texts, desc="Embedding", quiet=False, stride=STRIDE, pooling=POOLING):
+        texts = [(t if t is not None else '') for t in texts]
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        tok = self.tokenizer
+        with metrics.timer("tokenize"):
+            docs = tok(texts, add_special_tokens=False, truncation=False, padding=False,
+                       return_attention_mask=False, return_token_type_ids=False)['input_ids']
+
+        # Flatten every window into one encoding; owner[i] is its document
+        enc = {'input_ids': [], 'attention_mask': []}
+        with_types = 'token_type_ids' in tok.model_input_names
+        if with_types:
+            enc['token_type_ids'] = []
+        owner, weight = [], []
+        for d, ids in enumerate(docs):
+            prev_end = 0
+            for s, e in self._windows(ids, stride):
+                window = [tok.cls_token_id] + ids[s:e] + [tok.sep_token_id]
+                enc['input_ids'].append(window)
+                enc['attention_mask'].append([1] * len(window))
+                if with_types:
+                    enc['token_type_ids'].append([0] * len(window))
+                owner.append(d)
+                weight.append(max(e - max(s, prev_end), 1))  # new tokens only
+                prev_end = e
+        owner = np.array(owner, dtype=np.int64)
+        weight = np.array(weight, dtype=np.float32) if pooling == "weighted" else np.ones(len(owner), np.float32)
+        lengths = np.array([len(w) for w in enc['input_ids']])
+
+        vecs, n_batches, padded = self._forward(enc, lengths, desc, quiet)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(out, owner, vecs * weight[:, None])
+        out /= np.bincount(owner, weights=weight, minlength=len(texts))[:, None].astype(np.float32)
+
+        seconds = time.perf_counter() - start
+        doc_tokens = np.array([len(ids) for ids in docs])
+        metrics.count("texts_embedded", len(texts))
+        metrics.count("windows", len(owner))
+        metrics.count("tokens", int(lengths.sum()))
+        metrics.count("padded_tokens", padded)
+        self.last_stats = {
+            "texts": len(texts),
+            "windows": len(owner),
+            "long_texts": int((doc_tokens > self.max_length - 2).sum()),
+            "batches": n_batches,
+            "seconds": seconds,
+            "texts_per_sec": len(texts) / seconds,
+            "tokens": int(lengths.sum()),
+            "padded_tokens": padded,
+        }
+        if not quiet:
+            print(f"Embedded {len(texts)} texts as {len(owner)} windows in {seconds:.1f}s "
+                  f"({len(texts) / seconds:.1f} texts/sec, "
+                  f"{1 - lengths.sum() / padded:.1%} padding)")
+        return out
+
+# ---------------------------
+# COMPARISON AGAINST THE PROCESS-POOL PATH
+# ---------------------------
+def sample_texts(opps_csv, limit):
+    import sbert_filter_embed as sfe
+
+    phrases = sfe.load_boilerplate(sfe.BOILERPLATE_PATH)
+    texts = []
+    for row in sfe.load_filtered_opps(opps_csv):
+        cleaned, count = sfe.clean_contract_text(row['Title'], row['Description'], phrases)
+        if count >= 10:
+            texts.append(cleaned)
+        if len(texts) >= limit:
+            break
+    print(f"Comparing on {len(texts)} texts")
+    return texts
+
+def compare(opps_csv, limit=2000):
+    import sbert_filter_embed as sfe
+    import models
+
+    texts = sample_texts(opps_csv, limit)
+
+    start = time.perf_counter()
+    old = sfe.parallel_embed(texts, desc="ProcessPool")
+    old_rate = len(texts) / (time.perf_counter() - start)
+
+    results = [("process pool (4 x 16)", old_rate, 1.0)]
+    for quantize in (False, True):
+        engine = EmbeddingEngine(models.tokenizer(sfe.MODEL_NAME), models.model(sfe.MODEL_NAME),
+                                 num_threads=os.cpu_count(), quantize=quantize)
+        new = engine.embed(texts, desc="Engine")
+        cos = np.sum(old * new, axis=1) / (
+            np.linalg.norm(old, axis=1) * np.linalg.norm(new, axis=1)
+        )
+        name = "engine + int8" if quantize else "engine"
+        results.append((name, engine.last_stats["texts_per_sec"], float(cos.min())))
+
+    print(f"{'path':<24}{'texts/sec':>12}{'min cosine':>12}")
+    for name, rate, cos in results:
+        print(f"{name:<24}{rate:>12.1f}{cos:>12.4f}")
+
+# ---------------------------
+# CHUNKED VS TRUNCATED
+# ---------------------------
+def chunk_report(engine, texts, batch_size=16):
+    lengths = np.array([len(ids) for ids in engine.tokenizer(
+        texts, add_special_tokens=False, truncation=False)['input_ids']]) + 2
+    kept = np.minimum(lengths, engine.max_length)
+    # Legacy embed_chunk: groups of 16 in input order, padded to their longest
+    legacy_padded = sum(int(kept[i:i + batch_size].max()) * len(kept[i:i + batch_size])
+                        for i in range(0, len(kept), batch_size))
+    rows = [("embed_chunk (pad to 16)", None, 1 - kept.sum() / legacy_padded,
+             kept.sum() / lengths.sum())]
+
+    engine.embed(texts, desc="Truncated", quiet=True)
+    st = engine.last_stats
+    rows.append(("engine, truncated", st["texts_per_sec"],
+                 1 - st["tokens"] / st["padded_tokens"], kept.sum() / lengths.sum()))
+    engine.embed_chunked(texts, desc="Chunked", quiet=True)
+    st = engine.last_stats
+    rows.append(("engine, chunked", st["texts_per_sec"],
+                 1 - st["tokens"] / st["padded_tokens"], 1.0))
+
+    print(f"{int((lengths > engine.max_length).sum())} of {len(texts)} texts exceed "
+          f"{engine.max_length} tokens; chunked run used {st['windows']} windows")
+    print(f"{'path':<26}{'texts/sec':>12}{'padding':>10}{'tokens seen':>13}")
+    for name, rate, pad, seen in rows:
+        rate = f"{rate:.1f}" if rate else "-"
+        print(f"{name:<26}{rate:>12}{pad:>10.1%}{seen:>13.1%}")
+    return rows
+
+def compare_chunked(opps_csv, limit=2000):
+    import sbert_filter_embed as sfe
+    chunk_report(sfe.get_engine(), sample_texts(opps_csv, limit))
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ("compare", "chunked"):
+        print("Usage: python embed_engine.py compare opportunities.csv [limit]")
+        print("       python embed_engine.py chunked opportunities.csv [limit]")
+        sys.exit(1)
+    limit = int(sys.argv[3]) if len(sys.argv) == 4 else 2000
+    if sys.argv[1] == "compare":
+        compare(sys.argv[2], limit)
+    else:
+        compare_chunked(sys.argv[2], limit)
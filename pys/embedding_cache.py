@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+from embedding_store import load_store
+
+# ---------------------------
+# APPEND-ONLY EMBEDDING CACHE
+# A cache is a directory of segments. Each run appends to a fresh segment:
+#
+#   meta.json          {"dim": 768}
+#   seg-00001.vec      raw float32 rows
+#   seg-00001.keys     one "NoticeId<TAB>text_hash" line per row
+#
+# Rows are written before their keys and both are fsynced on every flush,
+# so after a crash a segment is valid up to min(#keys, #rows). Later
+# segments override earlier ones, which is how an edited Description
+# replaces its old vector.
+#
+# Rows are only written on flush(); callers flush once per embedded block,
+# which is their checkpoint.
+#
+# Rows imported from an old store carry LEGACY_HASH: their text is unknown.
+# The first run that sees the notice takes its current text as the one that
+# was embedded and re-keys the row to that hash (pin_legacy), so any later
+# edit is a miss like for every other row.
+# ---------------------------
+LEGACY_HASH = "-"
+
+def text_hash(text, model_name):
+    h = hashlib.sha1(f"{model_name}\0{text}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+class EmbeddingCache:
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        os.makedirs(path, exist_ok=True)
+
+        self.dim = None
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)["dim"]
+
+        # NoticeId -> (text_hash, segment number, row)
+        self.entries = {}
+        self.segments = {}
+        existing = self._segment_numbers()
+        for seg in existing:
+            self._load_segment(seg)
+
+        self.current = max(existing, default=0) + 1
+        self.pending_keys = []
+        self.pending_vecs = []
+
+    def _segment_numbers(self):
+        segs = []
+        for name in os.listdir(self.path):
+            if name.startswith("seg-") and name.endswith(".keys"):
+                segs.append(int(name[4:-5]))
+        return sorted(segs)
+
+    def _seg_path(self, seg, ext):
+        return os.path.join(self.path, f"seg-{seg:05d}.{ext}")
+
+    def _load_segment(self, seg):
+        with open(self._seg_path(seg, "keys"), 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.endswith('\n')]
+        vec_path = self._seg_path(seg, "vec")
+        size = os.path.getsize(vec_path) if os.path.exists(vec_path) else 0
+        n_rows = size // (4 * self.dim) if self.dim else 0
+        n = min(len(lines), n_rows)
+        if n != len(lines) or size != n * 4 * (self.dim or 0):
+            print(f"Segment {seg}: recovered {n} rows from interrupted write")
+        if n == 0:
+            return
+        self.segments[seg] = np.memmap(vec_path, dtype=np.float32, mode='r', shape=(n, self.dim))
+        for row, line in enumerate(lines[:n]):
+            nid, h = line.rstrip('\n').split('\t')
+            self.entries[nid] = (h, seg, row)
+
+    def text_hash(self, text):
+        return text_hash(text, self.model_name)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, nid):
+        return nid in self.entries
+
+    def has(self, nid, h):
+        entry = self.entries.get(nid)
+        return entry is not None and entry[0] == h
+
+    def is_legacy(self, nid):
+        entry = self.entries.get(nid)
+        return entry is not None and entry[0] == LEGACY_HASH
+
+    # ---------------------------
+    # WRITING
+    # ---------------------------
+    def add(self, nids, hashes, embs):
+        embs = np.asarray(embs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embs.shape[1]
+            with open(os.path.join(self.path, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump({"dim": self.dim}, f)
+        self.pending_keys.extend(zip(nids, hashes))
+        self.pending_vecs.append(embs)
+
+    def flush(self):
+        if not self.pending_keys:
+            return
+        vecs = np.vstack(self.pending_vecs)
+        vec_path = self._seg_path(self.current, "vec")
+        keys_path = self._seg_path(self.current, "keys")
+        start = os.path.getsize(vec_path) // (4 * self.dim) if os.path.exists(vec_path) else 0
+
+        with open(vec_path, 'ab') as f:
+            f.write(vecs.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(keys_path, 'a', encoding='utf-8') as f:
+            for nid, h in self.pending_keys:
+                f.write(f"{nid}\t{h}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        n = start + len(self.pending_keys)
+        self.segments[self.current] = np.memmap(vec_path, dtype=np.float32, mode='r', shape=(n, self.dim))
+        for row, (nid, h) in enumerate(self.pending_keys, start=start):
+            self.entries[nid] = (h, self.current, row)
+        print(f"Checkpointed {len(self.pending_keys)} embeddings → {keys_path}")
+        self.pending_keys, self.pending_vecs = [], []
+
+    # ---------------------------
+    # READING
+    # ---------------------------
+    def vectors(self, nids):
+        # Gather rows for nids (skipping unknown ones) into one float32 matrix
+        kept = [nid for nid in nids if nid in self.entries]
+        out = np.empty((len(kept), self.dim or 0), dtype=np.float32)
+        by_seg = {}
+        for i, nid in enumerate(kept):
+            _, seg, row = self.entries[nid]
+            by_seg.setdefault(seg, ([], []))
+            by_seg[seg][0].append(i)
+            by_seg[seg][1].append(row)
+        for seg, (dst, src) in by_seg.items():
+            out[dst] = self.segments[seg][src]
+        return kept, out
+
+    # ---------------------------
+    # MAINTENANCE
+    # ---------------------------
+    def compact(self):
+        # Rewrite all live entries into a single segment and drop the rest
+        self.flush()
+        old = self._segment_numbers()
+        if len(old) <= 1:
+            print("Nothing to compact.")
+            return
+        nids = list(self.entries)
+        hashes = [self.entries[nid][0] for nid in nids]
+        _, vecs = self.vectors(nids)
+        self.segments = {}
+        self.current = old[-1] + 1
+        self.pending_keys = list(zip(nids, hashes))
+        self.pending_vecs = [vecs]
+        self.flush()
+        for seg in old:
+            os.remove(self._seg_path(seg, "vec"))
+            os.remove(self._seg_path(seg, "keys"))
+        print(f"Compacted {len(old)} segments into seg-{self.current:05d}")
+
+    def import_store(self, store_path):
+        # One-time import of a plain .npy store; its text is unknown, so each
+        # row is trusted for the first text it is seen with (pin_legacy).
+        ids, mat = load_store(store_path)
+        fresh = [i for i, nid in enumerate(ids) if nid not in self.entries]
+        self.add([ids[i] for i in fresh], [LEGACY_HASH] * len(fresh), mat[fresh])
+        self.flush()
+
+    def pin_legacy(self, nids, hashes):
+        # Re-key legacy rows to the hash of their current text (the vector is
+        # copied into the current segment)
+        if not nids:
+            return
+        _, vecs = self.vectors(nids)
+        self.add(nids, hashes, vecs)
+        self.flush()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "compact":
+        EmbeddingCache(sys.argv[2], model_name=None).compact()
+    elif len(sys.argv) == 4 and sys.argv[1] == "import":
+        EmbeddingCache(sys.argv[2], model_name=None).import_store(sys.argv[3])
+    else:
+        print("Usage: python embedding_cache.py compact cache_dir")
+        print("       python embedding_cache.py import cache_dir legacy_cache.npy")
+        sys.exit(1)
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import numpy as np
+
+# ---------------------------
+# EMBEDDING STORE
+# A store is a dense .npy matrix (float32 by default, float16 optional)
+# plus a sibling .ids file holding one NoticeId per line in row order.
+#
+#   filtered_embeddings.npy   (n, dim) matrix
+#   filtered_embeddings.ids   n lines
+# ---------------------------
+DTYPES = {"float32": np.float32, "float16": np.float16}
+
+def ids_path(path):
+    return os.path.splitext(path)[0] + ".ids"
+
+def load_ids(path):
+    with open(ids_path(path), 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+def load_store(path, mmap=True):
+    # Memory-mapped by default so loading is zero-copy; rows are only paged
+    # in when they are touched.
+    ids = load_ids(path)
+    mat = np.load(path, mmap_mode='r' if mmap else None)
+    if mat.shape[0] != len(ids):
+        raise ValueError(f"{path}: {mat.shape[0]} rows but {len(ids)} ids")
+    return ids, mat
+
+def save_store(path, ids, vectors, dtype=np.float32):
+    vectors = np.asarray(vectors)
+    if vectors.ndim != 2 or vectors.shape[0] != len(ids):
+        raise ValueError(f"Expected ({len(ids)}, dim) matrix, got {vectors.shape}")
+    if vectors.dtype != dtype:
+        vectors = vectors.astype(dtype)
+
+    # Write to temp files and swap in so a crash never leaves a
+    # half-written store behind.
+    tmp_mat = path + ".tmp"
+    tmp_ids = ids_path(path) + ".tmp"
+    with open(tmp_mat, 'wb') as f:
+        np.save(f, vectors)
+    with open(tmp_ids, 'w', encoding='utf-8') as f:
+        for id_ in ids:
+            f.write(f"{id_}\n")
+    os.replace(tmp_mat, path)
+    os.replace(tmp_ids, ids_path(path))
+    print(f"Saved {len(ids)} x {vectors.shape[1]} {np.dtype(dtype).name} → {path}")
+
+def index_of(ids):
+    return {id_: i for i, id_ in enumerate(ids)}
+
+def take_rows(ids, mat, wanted):
+    # Rows for `wanted` ids (skipping unknown ones), in the order given
+    index = index_of(ids)
+    kept = [id_ for id_ in wanted if id_ in index]
+    rows = np.fromiter((index[id_] for id_ in kept), dtype=np.int64, count=len(kept))
+    return kept, mat[rows]
+
+def as_float32(mat):
+    # float16 stores are upcast once for maths; float32 stores pass through
+    return mat if mat.dtype == np.float32 else np.asarray(mat, dtype=np.float32)
+
+# ---------------------------
+# ONE-TIME JSON CONVERTER
+# ---------------------------
+def convert_json(json_path, store_path, dtype=np.float32):
+    print(f"Reading {json_path}...")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    ids = list(data.keys())
+    if not ids:
+        raise ValueError(f"{json_path} is empty")
+    dim = len(data[ids[0]])
+    mat = np.empty((len(ids), dim), dtype=dtype)
+    for i, id_ in enumerate(ids):
+        mat[i] = data[id_]
+    del data
+    save_store(store_path, ids, mat, dtype)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python embedding_store.py input.json output.npy [float32|float16]")
+        sys.exit(1)
+    dtype = DTYPES[sys.argv[3]] if len(sys.argv) == 4 else np.float32
+    convert_json(sys.argv[1], sys.argv[2], dtype)
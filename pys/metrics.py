@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from contextlib import contextmanager
+
+# ---------------------------
+# INSTRUMENTATION
+# Process-wide timers, counters and gauges for the pipeline scripts:
+#
+#   with metrics.stage("forward"):     # time (and optionally profile) a block
+#       ...
+#   metrics.count("cache_hits", n)     # monotonic counters
+#   metrics.gauge("rows_in_store", n)  # last value wins
+#
+# Nothing is written unless METRICS_DIR is set; at exit each script then
+# leaves <script>.json and <script>.prom (Prometheus text format, suitable
+# for node_exporter's textfile collector) there. With METRICS_PROFILE=1
+# every top-level stage also dumps a cProfile file <script>-<stage>.prof
+# (pstats format: snakeviz, gprof2dot, or `python -m pstats`).
+# ---------------------------
+METRICS_DIR = os.environ.get("METRICS_DIR")
+PROFILE = os.environ.get("METRICS_PROFILE") == "1"
+PREFIX = "samgov"
+
+_lock = threading.Lock()
+_timers = {}  # stage → [seconds, calls]
+_counters = {}
+_gauges = {}
+_profiling = []
+
+def _script():
+    return os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+class PeakRSS:
+    # Samples this process's resident set while a block runs; ru_maxrss can
+    # only ever grow, so it cannot give a per-block peak by itself.
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _rss(self):
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + int(n)
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def add_time(name, seconds, calls=1):
+    with _lock:
+        entry = _timers.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+@contextmanager
+def timer(name):
+    # Cheap enough for per-batch use: no profiling, no memory sampling
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+def timed_iter(name, iterable):
+    # Times each next() of a lazy iterable (CSV chunks, scanner batches)
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            add_time(name, time.perf_counter() - start)
+            return
+        add_time(name, time.perf_counter() - start)
+        yield item
+
+@contextmanager
+def stage(name):
+    # Coarse stages also record peak RSS, and are profiled when opted in.
+    # Nested stages are timed but only the outermost one is profiled.
+    profiler = None
+    if PROFILE and METRICS_DIR and not _profiling:
+        import cProfile
+        profiler = cProfile.Profile()
+        _profiling.append(name)
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        with PeakRSS() as rss:
+            yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+        gauge(f"{name}_peak_rss_bytes", rss.peak)
+        if profiler is not None:
+            profiler.disable()
+            _profiling.pop()
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{_script()}-{name}.prof")
+            profiler.dump_stats(path)
+            print(f"Profile saved to {path}")
+
+def snapshot():
+    with _lock:
+        return {
+            "script": _script(),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "timers": {k: {"seconds": round(v[0], 6), "calls": v[1]} for k, v in _timers.items()},
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+
+def prometheus(snap):
+    script = snap["script"]
+    lines = [
+        f"# TYPE {PREFIX}_stage_seconds_total counter",
+        *(f'{PREFIX}_stage_seconds_total{{script="{script}",stage="{k}"}} {v["seconds"]}'
+          for k, v in snap["timers"].items()),
+        f"# TYPE {PREFIX}_stage_calls_total counter",
+        *(f'{PREFIX}_stage_calls_total{{script="{script}",stage="{k}"}} {v["calls"]}'
+          for k, v in snap["timers"].items()),
+        f"# TYPE {PREFIX}_events_total counter",
+        *(f'{PREFIX}_events_total{{script="{script}",name="{k}"}} {v}'
+          for k, v in snap["counters"].items()),
+        f"# TYPE {PREFIX}_gauge gauge",
+        *(f'{PREFIX}_gauge{{script="{script}",name="{k}"}} {v}'
+          for k, v in snap["gauges"].items()),
+        f"# TYPE {PREFIX}_peak_rss_bytes gauge",
+        f'{PREFIX}_peak_rss_bytes{{script="{script}"}} {snap["peak_rss_bytes"]}',
+    ]
+    return "\n".join(lines) + "\n"
+
+def write(directory=None):
+    directory = directory or METRICS_DIR
+    if not directory:
+        return
+    snap = snapshot()
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, snap["script"])
+    # Temp file + rename so a scraper never reads half a file
+    for path, text in ((base + ".json", json.dumps(snap, indent=2)),
+                       (base + ".prom", prometheus(snap))):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+    print(f"Metrics saved to {base}.json / .prom")
+
+def report():
+    snap = snapshot()
+    if not snap["timers"]:
+        return
+    print(f"{'stage':<24}{'seconds':>10}{'calls':>8}")
+    for name, t in sorted(snap["timers"].items(), key=lambda kv: -kv[1]["seconds"]):
+        print(f"{name:<24}{t['seconds']:>10.2f}{t['calls']:>8}")
+    for name, value in snap["counters"].items():
+        print(f"{name:<24}{value:>10}")
+
+if METRICS_DIR:
+    atexit.register(write)
@@ -0,0 +1,54 @@
+import os
+
+# ---------------------------
+# PROCESS-CACHED MODEL HANDLES
+# Tokenizers, models and embedding engines are loaded on first use and then
+# shared by everything in the process. Importing a helper module never
+# loads torch, transformers or model weights, and pool workers that never
+# embed never pay for them.
+#
+#   tokenizer = models.tokenizer(MODEL_NAME)   # no weights loaded
+#   engine = models.engine(MODEL_NAME)         # tokenizer + model + engine
+#
+# EMBED_BACKEND picks what runs the forward pass: torch (eager), or the
+# exported ONNX model (onnx, onnx-int8; see onnx_backend.py).
+# ---------------------------
+BACKENDS = ("torch", "onnx", "onnx-int8")
+BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+
+_tokenizers = {}
+_models = {}
+_engines = {}
+
+def tokenizer(model_name):
+    if model_name not in _tokenizers:
+        from transformers import AutoTokenizer
+        _tokenizers[model_name] = AutoTokenizer.from_pretrained(model_name)
+    return _tokenizers[model_name]
+
+def model(model_name):
+    if model_name not in _models:
+        from transformers import AutoModel
+        print(f"Loading model {model_name}…")
+        m = AutoModel.from_pretrained(model_name)
+        m.eval()
+        _models[model_name] = m
+    return _models[model_name]
+
+def engine(model_name, backend=None, **kwargs):
+    # One engine per (model, backend, settings); quantize=True wraps its own copy
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected one of {BACKENDS}")
+    key = (model_name, backend, tuple(sorted(kwargs.items())))
+    if key not in _engines:
+        from embed_engine import EmbeddingEngine
+        if backend == "torch":
+            m = model(model_name)
+        else:
+            from onnx_backend import OnnxModel
+            print(f"Loading {backend} model…")
+            m = OnnxModel(int8=backend == "onnx-int8", num_threads=kwargs.get("num_threads"))
+            kwargs = {k: v for k, v in kwargs.items() if k != "quantize"}
+        _engines[key] = EmbeddingEngine(tokenizer(model_name), m, **kwargs)
+    return _engines[key]
@@ -0,0 +1,283 @@
+import sys
+import csv
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import metrics
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+THRESHOLD = 0.85  # Estimated Jaccard of word shingles to call two notices duplicates
+NUM_PERM = 128  # MinHash permutations (signature length)
+SHINGLE = 3  # Words per shingle
+WORKERS = 4
+CHUNK = 2_000  # Texts per worker task
+SEED = 1
+FP_WEIGHT = 0.1  # LSH tuning: false positives only cost a signature comparison, misses lose a family
+
+# ---------------------------
+# NEAR-DUPLICATE FAMILIES
+# SAM.gov reposts one opportunity as presolicitation, amendments and
+# re-issues with slightly different titles. Over the cleaned text:
+#
+#   1. MinHash signature of the word 3-gram set, per notice (worker pool,
+#      fed in chunks as the texts stream in)
+#   2. LSH: the first b * r signature positions are cut into b bands of r
+#      rows (bands_for: S-curve midpoint below THRESHOLD, misses weighted
+#      over false candidates); notices sharing any band are candidates
+#   3. candidates whose signatures agree on at least THRESHOLD of the
+#      positions are unioned into a family
+#   4. union-find chains candidates (A~B, B~C joins A and C), so each family
+#      is split again around its representative: every member must agree
+#      with its own representative on at least THRESHOLD of the positions
+#
+# Only one representative per family needs an embedding; the others take
+# its vector in the store but never enter the cache (see
+# sbert_filter_embed.find_missing and store_vectors).
+# ---------------------------
+_MERSENNE = np.uint64((1 << 61) - 1)
+_LOW29 = np.uint64((1 << 29) - 1)
+
+def _permutations(num_perm=NUM_PERM, seed=SEED):
+    # h(x) = (a*x + b) mod p with a, b uniform over the whole field. With a
+    # below 2^32 the product never reached p for small x, h grew with the
+    # crc and the smallest-crc shingle won a third of the permutations.
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+    return a, b
+
+def _area(f, lo, hi, steps=200):
+    # Midpoint rule over [lo, hi]
+    x = lo + (np.arange(steps) + 0.5) * (hi - lo) / steps
+    return float(f(x).mean() * (hi - lo))
+
+def bands_for(threshold, num_perm=NUM_PERM, fp_weight=FP_WEIGHT):
+    # (bands, rows), bands * rows <= num_perm, minimising the weighted areas
+    # under the candidate S-curve 1 - (1 - s^r)^b below the threshold (false
+    # positives) and above it (false negatives), as datasketch does. The
+    # midpoint (1/b)^(1/r) must sit below the threshold so pairs at exactly
+    # the threshold are likely candidates.
+    best, best_err = None, None
+    for b in range(1, num_perm + 1):
+        for r in range(1, num_perm // b + 1):
+            if (1 / b) ** (1 / r) >= threshold:
+                continue
+            fp = _area(lambda s: 1 - (1 - s ** r) ** b, 0.0, threshold)
+            fn = _area(lambda s: (1 - s ** r) ** b, threshold, 1.0)
+            err = fp_weight * fp + (1 - fp_weight) * fn
+            if best_err is None or err < best_err:
+                best, best_err = (b, r), err
+    return best
+
+def shingles(text, size=SHINGLE):
+    # crc32, not hash(): stable across the worker processes
+    words = text.split()
+    if len(words) < size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.fromiter({zlib.crc32(g.encode('utf-8')) for g in grams}, dtype=np.uint64)
+
+def _mulmod(x, a):
+    # outer(x, a) mod p for x < 2^32, a < 2^61 without wrapping uint64:
+    # a = hi*2^32 + lo, and t*2^32 = (t >> 29)*2^61 + (t & LOW29)*2^32,
+    # where 2^61 = 1 (mod p)
+    hi = np.outer(x, a >> np.uint64(32)) % _MERSENNE  # < 2^29 * 2^32
+    lo = np.outer(x, a & np.uint64(0xFFFFFFFF)) % _MERSENNE  # < 2^32 * 2^32
+    hi = (hi >> np.uint64(29)) + ((hi & _LOW29) << np.uint64(32))
+    return (hi + lo) % _MERSENNE
+
+def minhash(text, a, b):
+    x = shingles(text)
+    hashed = (_mulmod(x, a) + b) % _MERSENNE
+    # The low 32 bits of a uniform residue: only compared for equality
+    return (hashed.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+_perm = {}
+
+def _init_worker(num_perm, seed):
+    _perm['ab'] = _permutations(num_perm, seed)
+
+def _signature_chunk(texts):
+    a, b = _perm['ab']
+    return np.stack([minhash(t, a, b) for t in texts]) if texts else None
+
+def signatures(texts, workers=WORKERS, num_perm=NUM_PERM, chunk=CHUNK):
+    # texts: any iterable of cleaned strings; returns (n, num_perm) uint32
+    def chunks():
+        buf = []
+        for t in texts:
+            buf.append(t)
+            if len(buf) == chunk:
+                yield buf
+                buf = []
+        if buf:
+            yield buf
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(num_perm, SEED)) as executor:
+        parts = list(executor.map(_signature_chunk, chunks()))
+    return np.vstack(parts) if parts else np.empty((0, num_perm), dtype=np.uint32)
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def families(sigs, threshold=THRESHOLD):
+    # → family number per row (the row index of its root)
+    n, num_perm = sigs.shape
+    bands, rows = bands_for(threshold, num_perm)
+    parent = np.arange(n)
+    candidates = 0
+    for band in range(bands):
+        block = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        # Rows with identical band values share a bucket; pair each with the
+        # bucket's first row
+        _, first, bucket = np.unique(block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel(),
+                                     return_index=True, return_inverse=True)
+        head = first[bucket]
+        pairs = np.nonzero(head != np.arange(n))[0]
+        candidates += len(pairs)
+        if not len(pairs):
+            continue
+        agree = (sigs[pairs] == sigs[head[pairs]]).mean(axis=1)
+        for i, j in zip(pairs[agree >= threshold], head[pairs[agree >= threshold]]):
+            ri, rj = _find(parent, i), _find(parent, j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    metrics.count("near_dup_candidates", candidates)
+    return np.array([_find(parent, i) for i in range(n)])
+
+def representatives(sigs, family, order_key=None, threshold=THRESHOLD):
+    # Rep row for every row. Within a family the largest order_key (e.g.
+    # latest PostedDate, ties to the first row) becomes a representative and
+    # takes the members that agree with it on at least threshold; the rest
+    # repeat the same over what is left, so chained families split apart.
+    n = len(family)
+    keys = np.zeros(n) if order_key is None else np.asarray(order_key)
+    order = np.lexsort((np.arange(n), -keys, family))  # per family: best first
+    rep = np.arange(n)
+    starts = np.flatnonzero(np.r_[True, family[order][1:] != family[order][:-1]])
+    for left, right in zip(starts, np.r_[starts[1:], n]):
+        rest = order[left:right]
+        while len(rest) > 1:
+            agree = (sigs[rest] == sigs[rest[0]]).mean(axis=1) >= threshold
+            rep[rest[agree]] = rest[0]
+            rest = rest[~agree]
+    metrics.count("near_dup_split", int(np.sum(rep == np.arange(n)) - len(starts)))
+    return rep
+
+def find_duplicates(texts, dates=None, threshold=THRESHOLD, workers=WORKERS):
+    # → rep row index for every text (rep[i] == i for representatives)
+    with metrics.stage("minhash"):
+        sigs = signatures(texts, workers)
+    with metrics.stage("lsh"):
+        family = families(sigs, threshold)
+    order_key = None
+    if dates is not None:
+        # ISO date strings sort as text; rank them so lexsort sees numbers
+        order_key = np.unique(np.asarray(dates, dtype=str), return_inverse=True)[1]
+    return representatives(sigs, family, order_key, threshold)
+
+def summary(rep):
+    n = len(rep)
+    reps = int(np.sum(rep == np.arange(n)))
+    sizes = np.bincount(rep, minlength=n)
+    return {
+        "notices": n,
+        "families": int(np.sum(sizes > 1)),
+        "in_families": int(sizes[sizes > 1].sum()),
+        "embedded": reps,
+        "saved": n - reps,
+        "largest": int(sizes.max()) if n else 0,
+    }
+
+def print_summary(stats, threshold=THRESHOLD):
+    share = stats["saved"] / max(stats["notices"], 1)
+    print(f"Near-duplicates (Jaccard ≥ {threshold}): {stats['families']} families cover "
+          f"{stats['in_families']} notices (largest {stats['largest']}); "
+          f"{stats['embedded']} of {stats['notices']} need embedding, "
+          f"{stats['saved']} saved ({share:.1%})")
+
+# ---------------------------
+# CHECK
+# Planted pairs with a known word-shingle Jaccard; the signature agreement
+# must estimate it (error ~ sqrt(J(1-J)/NUM_PERM)) and pairs at or above
+# the threshold must land in one family:
+#   python near_dup.py check [pairs]
+# ---------------------------
+def _jaccard(x, y):
+    x, y = set(shingles(x).tolist()), set(shingles(y).tolist())
+    return len(x & y) / len(x | y)
+
+def check(pairs=300, threshold=THRESHOLD, words=120, seed=SEED):
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(50_000)]
+    texts, truth = [], []
+    for i in range(pairs):
+        base = list(rng.choice(vocab, size=words))
+        edited = list(base)
+        # Edits spread through the text so Jaccard varies from ~0.3 to 1
+        for k in rng.choice(words, size=int(rng.integers(0, words // 8)), replace=False):
+            edited[k] = vocab[int(rng.integers(len(vocab)))]
+        texts += [" ".join(base), " ".join(edited)]
+        truth.append(_jaccard(texts[-2], texts[-1]))
+    truth = np.array(truth)
+    sigs = signatures(texts)
+    agree = (sigs[0::2] == sigs[1::2]).mean(axis=1)
+    err = np.abs(agree - truth)
+    rep = representatives(sigs, families(sigs, threshold), threshold=threshold)
+    joined = rep[0::2] == rep[1::2]
+    # Allow one standard error of slack either side of the threshold
+    slack = 1 / np.sqrt(sigs.shape[1])
+    missed = int(np.sum(~joined & (truth >= threshold + slack)))
+    merged = int(np.sum(joined & (truth < threshold - slack)))
+    foreign = len(set(rep.tolist())) < pairs  # two planted pairs in one family
+    print(f"{pairs} planted pairs, Jaccard {truth.min():.2f}-{truth.max():.2f}: "
+          f"agreement error mean {err.mean():.3f}, max {err.max():.3f}; "
+          f"{missed} missed, {merged} merged below the threshold")
+    ok = err.mean() < 0.05 and missed == 0 and merged == 0 and not foreign
+    print("OK" if ok else "FAILED")
+    return ok
+
+# ---------------------------
+# STANDALONE REPORT
+# Tune THRESHOLD without embedding anything:
+#   python near_dup.py opportunities.csv families.csv [threshold]
+# ---------------------------
+def report(opps_csv, output_csv, threshold=THRESHOLD):
+    from sbert_filter_embed import (load_filtered_opps, load_boilerplate, sep_token,
+                                    BOILERPLATE_PATH, CLEAN_WORKERS)
+    from text_cleaner import clean_rows
+
+    opps = load_filtered_opps(opps_csv)
+    boilerplate = load_boilerplate(BOILERPLATE_PATH)
+    cleaned = clean_rows(((r.get('Title', ''), r.get('Description', '')) for r in opps),
+                         boilerplate.phrases, sep_token(), workers=CLEAN_WORKERS)
+    rep = find_duplicates([c for c, _ in cleaned], [r.get('PostedDate', '') for r in opps], threshold)
+    stats = summary(rep)
+    print_summary(stats, threshold)
+
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["NoticeId", "RepresentativeId", "PostedDate", "Title"])
+        sizes = np.bincount(rep, minlength=len(rep))
+        for i in np.argsort(rep, kind="stable"):
+            if sizes[rep[i]] > 1:
+                writer.writerow([opps[i]['NoticeId'], opps[rep[i]]['NoticeId'],
+                                 opps[i].get('PostedDate', ''), opps[i].get('Title', '')])
+    print(f"Families saved to {output_csv}")
+    return stats
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "check":
+        sys.exit(0 if check(int(sys.argv[2]) if len(sys.argv) == 3 else 300) else 1)
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python near_dup.py opportunities.csv families.csv [threshold]")
+        print("       python near_dup.py check [pairs]")
+        sys.exit(1)
+    report(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) == 4 else THRESHOLD)
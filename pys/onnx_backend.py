@@ -0,0 +1,147 @@
+import os
+import sys
+import inspect
+import numpy as np
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+MODEL_NAME = "allenai/specter2_base"
+ONNX_DIR = os.environ.get("ONNX_DIR", "intermediary/model/onnx")
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+PARITY = 0.999  # minimum cosine against the eager model
+OPSET = 17
+
+# ---------------------------
+# ONNX RUNTIME BACKEND
+# `export` writes the encoder as ONNX (plus the tokenizer and config) to
+# ONNX_DIR, and optionally a dynamically quantized int8 copy. OnnxModel
+# then stands in for the transformers model inside EmbeddingEngine, so
+# batching, padding and caching are unchanged; only the forward pass runs
+# in onnxruntime. Select it with EMBED_BACKEND=onnx or onnx-int8 (or
+# cli.py --backend).
+#
+#   python onnx_backend.py export [int8]
+#   python onnx_backend.py check opportunities.csv [limit]
+# ---------------------------
+class _Output:
+    def __init__(self, last_hidden_state):
+        self.last_hidden_state = last_hidden_state
+
+class OnnxModel:
+    def __init__(self, onnx_dir=ONNX_DIR, int8=False, num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoConfig
+
+        path = os.path.join(onnx_dir, INT8_FILE if int8 else FP32_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run `python onnx_backend.py export"
+                                    f"{' int8' if int8 else ''}` first")
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.session.get_inputs()}
+        self.config = AutoConfig.from_pretrained(onnx_dir)
+
+    def eval(self):
+        return self
+
+    def __call__(self, **feats):
+        import torch
+        feed = {k: v.numpy() for k, v in feats.items() if k in self.inputs}
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        return _Output(torch.from_numpy(hidden))
+
+def export(model_name=MODEL_NAME, out_dir=ONNX_DIR, int8=False):
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    model.config.return_dict = False
+
+    sample = tokenizer(["export sample text", "a second, longer export sample text"],
+                       padding=True, return_tensors="pt")
+    # Positional inputs must follow forward()'s parameter order
+    names = [n for n in inspect.signature(model.forward).parameters if n in sample]
+    path = os.path.join(out_dir, FP32_FILE)
+    print(f"Exporting {model_name} → {path}")
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in names),
+            path,
+            input_names=names,
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={**{n: {0: "batch", 1: "sequence"} for n in names},
+                          "last_hidden_state": {0: "batch", 1: "sequence"},
+                          "pooler_output": {0: "batch"}},
+            opset_version=OPSET,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(out_dir)
+    model.config.return_dict = True
+    model.config.save_pretrained(out_dir)
+
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(out_dir, INT8_FILE)
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Quantized → {int8_path}")
+    for name in (FP32_FILE, INT8_FILE):
+        p = os.path.join(out_dir, name)
+        if os.path.exists(p):
+            print(f"  {name}: {os.path.getsize(p) / 2**20:.0f} MB")
+
+# ---------------------------
+# PARITY AND THROUGHPUT
+# ---------------------------
+def parity_report(eager_engine, onnx_engines, texts):
+    ref = eager_engine.embed(texts, desc="Eager", quiet=True)
+    rows = [("eager torch", eager_engine.last_stats["texts_per_sec"], 1.0, 1.0)]
+    for name, engine in onnx_engines:
+        out = engine.embed(texts, desc=name, quiet=True)
+        cos = np.sum(ref * out, axis=1) / (
+            np.linalg.norm(ref, axis=1) * np.linalg.norm(out, axis=1)
+        )
+        rows.append((name, engine.last_stats["texts_per_sec"], float(cos.min()), float(cos.mean())))
+
+    print(f"{'backend':<16}{'texts/sec':>12}{'speedup':>9}{'min cos':>10}{'mean cos':>10}")
+    base = rows[0][1]
+    failed = 0
+    for name, rate, low, mean in rows:
+        flag = "" if low >= PARITY else f"  < {PARITY}"
+        failed += bool(flag)
+        print(f"{name:<16}{rate:>12.1f}{rate / base:>8.2f}x{low:>10.5f}{mean:>10.5f}{flag}")
+    return failed
+
+def check(opps_csv, limit=500, onnx_dir=ONNX_DIR):
+    import models
+    from embed_engine import EmbeddingEngine, sample_texts
+
+    texts = sample_texts(opps_csv, limit)
+    threads = os.cpu_count()
+    eager = EmbeddingEngine(models.tokenizer(MODEL_NAME), models.model(MODEL_NAME), num_threads=threads)
+    candidates = [("onnx", False), ("onnx-int8", True)]
+    engines = [
+        (name, EmbeddingEngine(eager.tokenizer, OnnxModel(onnx_dir, int8, threads)))
+        for name, int8 in candidates
+        if os.path.exists(os.path.join(onnx_dir, INT8_FILE if int8 else FP32_FILE))
+    ]
+    return parity_report(eager, engines, texts)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "export" and len(sys.argv) <= 3:
+        export(int8=len(sys.argv) == 3 and sys.argv[2] == "int8")
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "check":
+        bad = check(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 500)
+        sys.exit(1 if bad else 0)
+    else:
+        print("Usage: python onnx_backend.py export [int8]")
+        print("       python onnx_backend.py check opportunities.csv [limit]")
+        sys.exit(1)
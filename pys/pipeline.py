@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import resource
+import metrics
+from metrics import PeakRSS
+from embedding_store import load_store, save_store, as_float32
+import reducer_registry
+
+# ---------------------------
+# CONFIG
+# Paths are relative to CONTEXT_ROOT (set by scripts/env.sh), or the
+# project directory when run directly.
+# ---------------------------
+ROOT = os.environ.get("CONTEXT_ROOT", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PYS = os.path.dirname(os.path.abspath(__file__))
+INTR = os.path.join(ROOT, "intermediary")
+CACHE_DIR = os.path.join(ROOT, "cache")
+CAPABILITIES = os.path.join(ROOT, "capabilities.txt")
+BOILERPLATE = os.path.join(ROOT, "boilerplate_phrases.csv")
+OUTPUT_HTML = os.path.join(ROOT, "plot.html")
+
+EMBED_NPY = os.path.join(INTR, "filtered_embeddings.npy")
+REDUCED_NPY = os.path.join(INTR, "50d_embeddings.npy")
+PLOT_NPY = os.path.join(INTR, "2d_embeddings.npy")
+CLUSTER_JSON = os.path.join(INTR, "cluster_embeddings.json")
+UMAP_PATH = os.path.join(INTR, "model", "umap.pkl")
+UMAP_2D_PATH = os.path.join(INTR, "model", "umap_2d.pkl")
+HDBSCAN_PATH = os.path.join(INTR, "model", "hdbscan.pkl")
+CAPS_CSV = os.path.join(INTR, "capability_matches.csv")
+KEYWORDS_CSV = os.path.join(INTR, "cluster_keywords.csv")
+KEYWORDS_STATE = os.path.join(INTR, "keywords")
+MANIFEST = os.path.join(INTR, "pipeline.json")
+
+REDUCED_DIM = 50
+CAP_TOP_K = 5  # Matches per capabilities.txt line in capability_matches.csv
+# Once hdbscan.pkl exists the cluster stage keeps its cluster ids: "assign"
+# predicts only new points, "refit" refits and matches clusters to the old
+# ids (cluster.py). Either way cluster_keywords' state stays valid.
+CLUSTER_MODE = os.environ.get("PIPELINE_CLUSTER", "assign")
+
+# ---------------------------
+# PIPELINE RUNNER
+# Replaces the chain of processes in plot_from_scratch. Stages run in one
+# process (torch/umap are imported once, arrays are handed over in memory)
+# and are skipped when their key is unchanged:
+#
+#   key = sha1(stage, params, stage source, input file stats, upstream digests)
+#
+# Upstream digests are content hashes of the files a stage wrote, taken once
+# when it ran, so a stage that reruns but writes identical output does not
+# invalidate anything downstream. pipeline.json records keys, digests,
+# wall time and peak RSS for every stage.
+# ---------------------------
+def file_digest(path, block=1 << 24):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_stat(path):
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def load_manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+    tmp = MANIFEST + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, MANIFEST)
+
+class Stage:
+    def __init__(self, name, run, load, outputs, deps=(), inputs=(), params=None, sources=()):
+        self.name = name
+        self.run = run  # run(get) → value handed to downstream stages
+        self.load = load  # load() → the same value, read back from outputs
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.sources = [os.path.join(PYS, s) for s in sources]
+
+    def key(self, manifest):
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            "stage": self.name,
+            "params": self.params,
+            "inputs": {p: file_stat(p) for p in self.inputs},
+            "upstream": {d: manifest[d]["digests"] for d in self.deps},
+        }, sort_keys=True, default=str).encode('utf-8'))
+        for src in self.sources:
+            h.update(file_digest(src).encode('utf-8'))
+        return h.hexdigest()
+
+    def is_current(self, entry, key):
+        # Outputs must still be the files this run wrote
+        return (entry is not None and entry["key"] == key
+                and all(file_stat(p) == entry["stats"].get(p) for p in self.outputs))
+
+def run_pipeline(stages, force=()):
+    manifest = load_manifest()
+    values = {}
+    by_name = {s.name: s for s in stages}
+
+    def get(name):
+        if name not in values:
+            values[name] = by_name[name].load()
+        return values[name]
+
+    report = []
+    for stage in stages:
+        key = stage.key(manifest)
+        entry = manifest.get(stage.name)
+        if stage.name not in force and stage.is_current(entry, key):
+            print(f"[{stage.name}] up to date, skipping")
+            report.append((stage.name, "cached", 0.0, 0))
+            continue
+
+        print(f"[{stage.name}] running")
+        start = time.perf_counter()
+        with metrics.stage(f"pipeline_{stage.name}"), PeakRSS() as rss:
+            values[stage.name] = stage.run(get)
+        seconds = time.perf_counter() - start
+        manifest[stage.name] = {
+            "key": key,
+            "digests": {p: file_digest(p) for p in stage.outputs},
+            "stats": {p: file_stat(p) for p in stage.outputs},
+            "seconds": round(seconds, 3),
+            "peak_rss_mb": round(rss.peak / 2**20, 1),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        save_manifest(manifest)
+        report.append((stage.name, "ran", seconds, rss.peak))
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{'stage':<12}{'status':<8}{'seconds':>10}{'peak MB':>10}")
+    for name, status, seconds, peak in report:
+        print(f"{name:<12}{status:<8}{seconds:>10.2f}{peak / 2**20:>10.1f}")
+    print(f"Largest worker process peak: {children:.1f} MB")
+    return values
+
+# ---------------------------
+# STAGES
+# Heavy modules are imported inside the stage that needs them, so a run
+# where only the plot changed never loads torch.
+# ---------------------------
+def embed_params():
+    # Everything that changes the vectors or which notices get embedded
+    import models
+    import sbert_filter_embed as sfe
+    return {"model": sfe.cache_key(), "backend": models.BACKEND, "quantize": sfe.QUANTIZE,
+            "chunked": sfe.CHUNKED, "near_dup": sfe.NEAR_DUP, "naics": sorted(sfe.RELEVANT_NAICS)}
+
+def build_stages(opps_csv, plot_mode=None):
+    def embed(get):
+        import sbert_filter_embed
+        return sbert_filter_embed.main(opps_csv, CACHE_DIR, EMBED_NPY, CAPABILITIES)
+
+    def reduce(get):
+        ids, data = get("embed")
+        reduced = reducer_registry.reduce(UMAP_PATH, ids, as_float32(data), REDUCED_DIM, metric="cosine")
+        save_store(REDUCED_NPY, ids, reduced)
+        return ids, reduced
+
+    def cluster(get):
+        import cluster as hdb
+        ids, embs = get("reduce")
+        embs = as_float32(embs)
+        if not os.path.exists(HDBSCAN_PATH):
+            labels = hdb.fit(ids, embs, HDBSCAN_PATH)
+        elif CLUSTER_MODE == "refit":
+            labels = hdb.refit(ids, embs, HDBSCAN_PATH)
+        else:
+            labels = hdb.assign(ids, embs, HDBSCAN_PATH, CLUSTER_JSON)
+        hdb.save_clusters(ids, labels, CLUSTER_JSON)
+        return {id_: int(lbl) for id_, lbl in zip(ids, labels)}
+
+    def load_clusters():
+        with open(CLUSTER_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def reduce_2d(get):
+        ids, embs = get("reduce")
+        reduced = reducer_registry.reduce(UMAP_2D_PATH, ids, as_float32(embs), 2, metric="euclidean",
+                                          upstream=UMAP_PATH)
+        save_store(PLOT_NPY, ids, reduced)
+        return ids, reduced
+
+    def search_caps(get):
+        # Every capabilities.txt line in one batched search over the store
+        from semantic_search import SemanticSearch, load_queries
+        searcher = SemanticSearch(EMBED_NPY, opps_csv)
+        searcher.query_batch(load_queries(CAPABILITIES), CAPS_CSV, threshold=None, top_k=CAP_TOP_K)
+
+    def keywords(get):
+        # Incremental: only new texts are tokenized; every cluster is rescored from
+        # the saved class-term counts
+        import cluster_keywords
+        ids, reduced = get("reduce")
+        cluster_data = get("cluster")
+        keep = [i for i, id_ in enumerate(ids) if not id_.startswith('CAP:')]
+        table = cluster_keywords.update(
+            [ids[i] for i in keep], reduced[keep], [cluster_data.get(ids[i], -1) for i in keep],
+            opps_csv, KEYWORDS_STATE, boilerplate_path=BOILERPLATE)
+        cluster_keywords.save_table(table, KEYWORDS_CSV)
+
+    def plot(get):
+        import plotting
+        ids, reduced = get("reduce_2d")
+        cluster_data = get("cluster")
+        labels = [cluster_data[id_] for id_ in ids]
+        plotting.render(as_float32(reduced), labels, ids, opps_csv, OUTPUT_HTML, plot_mode,
+                        CAPS_CSV, KEYWORDS_CSV)
+
+    return [
+        Stage("embed", embed, lambda: load_store(EMBED_NPY), [EMBED_NPY],
+              inputs=[opps_csv, CAPABILITIES, BOILERPLATE], params=embed_params(),
+              sources=["sbert_filter_embed.py", "text_cleaner.py", "embed_engine.py", "contract_reader.py",
+                       "embedding_cache.py", "near_dup.py", "models.py", "onnx_backend.py"]),
+        Stage("reduce", reduce, lambda: load_store(REDUCED_NPY), [REDUCED_NPY, UMAP_PATH],
+              deps=["embed"], params={"n_components": REDUCED_DIM, "metric": "cosine"},
+              sources=["reducer_registry.py"]),
+        Stage("cluster", cluster, load_clusters, [CLUSTER_JSON, HDBSCAN_PATH],
+              deps=["reduce"], params={"mode": CLUSTER_MODE}, sources=["cluster.py"]),
+        Stage("reduce_2d", reduce_2d, lambda: load_store(PLOT_NPY), [PLOT_NPY, UMAP_2D_PATH],
+              deps=["reduce"], params={"n_components": 2, "metric": "euclidean"},
+              sources=["reducer_registry.py"]),
+        Stage("search_caps", search_caps, lambda: None, [CAPS_CSV],
+              deps=["embed"], inputs=[opps_csv, CAPABILITIES], params={"top_k": CAP_TOP_K},
+              sources=["semantic_search.py", "ann_index.py"]),
+        Stage("keywords", keywords, lambda: None, [KEYWORDS_CSV],
+              deps=["reduce", "cluster"], inputs=[opps_csv, BOILERPLATE],
+              sources=["cluster_keywords.py"]),
+        Stage("plot", plot, lambda: None, [OUTPUT_HTML],
+              deps=["reduce_2d", "cluster", "search_caps", "keywords"], inputs=[opps_csv],
+              params={"mode": plot_mode}, sources=["plotting.py"]),
+    ]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python pipeline.py opportunities.csv [full|scalable] [force=stage,stage]")
+        sys.exit(1)
+
+    opps_csv = sys.argv[1]
+    plot_mode, force = None, ()
+    for arg in sys.argv[2:]:
+        if arg.startswith("force="):
+            force = tuple(arg[len("force="):].split(","))
+        else:
+            plot_mode = arg
+    run_pipeline(build_stages(opps_csv, plot_mode), force)
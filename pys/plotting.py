@@ -1,29 +1,101 @@
+import os
 import sys
-import csv
 import json
-import pandas as pd
 import textwrap
-import plotly.graph_objects as go
 import numpy as np
-from plotly.colors import qualitative
+from embedding_store import load_store, as_float32
+import reducer_registry
+import metrics
+
+# Default 2-d reducer, under CONTEXT_ROOT (scripts/env.sh) like pipeline.py's paths
+ROOT = os.environ.get("CONTEXT_ROOT", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REDUCER_PATH = os.path.join(ROOT, "intermediary", "model", "umap_2d.pkl")
+
+# pandas and plotly are imported by the functions that draw, so argument
+# errors and --help return before paying for them
+
+# Above this many points plot.html switches to the scalable render
+SCALABLE_POINTS = 50_000
+GRID = 128  # Downsampling grid cells per axis
+PER_CELL = 2  # Points kept per (cluster, grid cell)
+HEAT_BINS = 400  # Density background bins per axis
+LEGEND_KEYWORDS = 3  # cluster_keywords.py terms shown in each legend entry
 
 def wrap_text(text, width=70):
     wrapped = textwrap.wrap(text, width=width)
     return '<br>'.join(wrapped)[:width * 3] + "..."
 
 def load_contract_info(contract_csv, ids):
-    id_to_name, id_to_desc = {}, {}
-    with open(contract_csv, newline='', encoding='latin1') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            id_to_name[row['NoticeId']] = row['Title']
-            id_to_desc[row['NoticeId']] = row.get('Description', '')
+    from contract_reader import iter_batches
+    # Only rows for the ids being plotted are kept
     cleaned = [id_.replace('CAP:', '') for id_ in ids]
+    wanted = set(cleaned)
+    id_to_name, id_to_desc = {}, {}
+    for batch in iter_batches(contract_csv, columns=['NoticeId', 'Title', 'Description']):
+        batch = batch[batch['NoticeId'].isin(wanted)]
+        id_to_name.update(zip(batch['NoticeId'], batch['Title']))
+        id_to_desc.update(zip(batch['NoticeId'], batch['Description']))
     names = [id_to_name.get(cid, "Unknown") for cid in cleaned]
     descs = [id_to_desc.get(cid, "") for cid in cleaned]
     return names, descs
 
-def plot_clusters_interactive(reduced_embeddings, labels, ids, names, descs, output_html):
+# ---------------------------
+# CAPABILITY MATCH OVERLAY
+# Reads the long CSV from `semantic_search.py batch` (Query, NoticeId,
+# CosineSimilarity, Title) and marks each query's best-scoring contract
+# that is on the plot; other matches are listed in its hover text.
+# ---------------------------
+def load_cap_matches(caps_csv):
+    import csv
+    best = {}
+    with open(caps_csv, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            sim = float(row['CosineSimilarity'])
+            best.setdefault(row['Query'], []).append((sim, row['NoticeId'], row['Title']))
+    return {q: sorted(m, reverse=True) for q, m in best.items()}
+
+def add_cap_overlay(fig, reduced, ids, caps_csv):
+    import plotly.graph_objects as go
+
+    row_of = {id_: i for i, id_ in enumerate(ids)}
+    xs, ys, hover = [], [], []
+    for query, matches in load_cap_matches(caps_csv).items():
+        # CAP: rows duplicate their contract's vector; mark the contract itself
+        on_plot = [m for m in matches if m[1] in row_of and not m[1].startswith('CAP:')]
+        if not on_plot:
+            continue
+        sim, nid, title = on_plot[0]
+        xs.append(reduced[row_of[nid], 0])
+        ys.append(reduced[row_of[nid], 1])
+        others = "<br>".join(f"{s:.3f}  {n}" for s, n, _ in on_plot[1:6])
+        hover.append(f"Query: {wrap_text(query)}<br><br>Best: {nid} ({sim:.3f})<br>{wrap_text(title)}"
+                     + (f"<br><br>Also:<br>{others}" if others else ""))
+    print(f"Overlaying {len(xs)} capability matches from {caps_csv}")
+    if xs:
+        fig.add_trace(go.Scattergl(
+            x=xs,
+            y=ys,
+            mode='markers',
+            marker=dict(symbol='diamond-open', size=18, color='crimson', line=dict(width=2)),
+            name="Capability matches",
+            text=hover,
+            hoverinfo='text',
+            showlegend=True
+        ))
+
+# Legend name for a cluster; keywords: cluster_keywords.load_table output
+def cluster_label(cluster, keywords=None):
+    if cluster == -1:
+        return "Noise"
+    terms = (keywords or {}).get(int(cluster), ([], []))[0]
+    return f"Cluster {cluster}: {', '.join(terms[:LEGEND_KEYWORDS])}" if terms else f"Cluster {cluster}"
+
+def plot_clusters_interactive(reduced_embeddings, labels, ids, names, descs, output_html,
+                              caps_csv=None, keywords=None):
+    import pandas as pd
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
     df = pd.DataFrame({
         'UMAP-1': reduced_embeddings[:, 0],
         'UMAP-2': reduced_embeddings[:, 1],
@@ -43,9 +115,11 @@ def plot_clusters_interactive(reduced_embeddings, labels, ids, names, descs, out
         if pts.empty:
             continue
         color = colors[i % len(colors)]
-        label = "Noise" if cluster == -1 else f"Cluster {cluster}"
+        label = cluster_label(cluster, keywords)
+        terms = (keywords or {}).get(int(cluster), ([], []))[0]
+        about = f"<br>Keywords: {wrap_text(', '.join(terms))}" if terms and cluster != -1 else ""
         hover_texts = [
-            f"ID: {id_}<br>Name: {name}<br><br>Description:<br>{wrap_text(desc)}<br><br>Cluster: {cluster}"
+            f"ID: {id_}<br>Name: {name}<br><br>Description:<br>{wrap_text(desc)}<br><br>Cluster: {cluster}{about}"
             for id_, name, desc in zip(pts['ID'], pts['Name'], pts['Description'])
         ]
         fig.add_trace(go.Scattergl(
@@ -59,6 +133,9 @@ def plot_clusters_interactive(reduced_embeddings, labels, ids, names, descs, out
             showlegend=True
         ))
 
+    if caps_csv:
+        add_cap_overlay(fig, reduced_embeddings, ids, caps_csv)
+
     cap_pts = df[df['IsCapability']]
     if not cap_pts.empty:
         hover_texts = [
@@ -90,32 +167,200 @@ def plot_clusters_interactive(reduced_embeddings, labels, ids, names, descs, out
     fig.write_html(output_html)
     print(f"Plot saved to {output_html}")
 
-def main():
-    if len(sys.argv) != 5:
-        print("Usage: python plotting.py <input_json> <cluster_json> <csv_file> <output_html>")
-        sys.exit(1)
+# ---------------------------
+# SCALABLE RENDER
+# One hover string per point made plot.html hundreds of MB. For large
+# inputs instead:
+#
+#   - a binned density heatmap shows every point at low zoom
+#   - the scatter keeps at most PER_CELL points per (cluster, grid cell), so
+#     dense regions are thinned and sparse clusters stay whole
+#   - hover details go to <plot>.hover.json, keyed by point index, and are
+#     fetched the first time a point is hovered (serve the directory over
+#     http, e.g. python -m http.server, for the browser to allow the fetch)
+# ---------------------------
+def downsample(reduced, labels, is_cap, grid=GRID, per_cell=PER_CELL, seed=0):
+    xy = reduced[:, :2]
+    lo, hi = xy.min(axis=0), xy.max(axis=0)
+    cells = ((xy - lo) / np.maximum(hi - lo, 1e-12) * (grid - 1)).astype(np.int64)
+    _, label_code = np.unique(labels, return_inverse=True)
+    key = (label_code.astype(np.int64) * grid + cells[:, 0]) * grid + cells[:, 1]
+
+    # Random order within each key, then keep the first per_cell of each
+    order = np.random.default_rng(seed).permutation(len(key))
+    order = order[np.argsort(key[order], kind='stable')]
+    sorted_key = key[order]
+    group_start = np.r_[0, np.nonzero(sorted_key[1:] != sorted_key[:-1])[0] + 1]
+    rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    keep = np.zeros(len(key), dtype=bool)
+    keep[order[rank < per_cell]] = True
+    keep |= is_cap  # Capabilities are always drawn
+    return np.nonzero(keep)[0]
+
+def write_hover_sidecar(path, index, ids, names, descs, labels):
+    points = {
+        str(int(i)): [id_, name, desc[:500], int(lbl)]
+        for i, id_, name, desc, lbl in zip(index, ids, names, descs, labels)
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"fields": ["id", "name", "description", "cluster"], "points": points},
+                  f, separators=(',', ':'))
+    print(f"Hover text saved to {path}")
+
+HOVER_JS = """
+var gd = document.getElementById('{plot_id}');
+var box = document.createElement('div');
+box.style.cssText = 'position:fixed;left:10px;bottom:10px;max-width:480px;padding:8px;' +
+    'background:white;border:1px solid #ccc;font:12px sans-serif;white-space:pre-wrap';
+document.body.appendChild(box);
+var hover = null;
+gd.on('plotly_hover', function (e) {
+    var idx = e.points[0].customdata;
+    if (idx === undefined || idx === null) return;
+    if (!hover) hover = fetch('SIDECAR').then(function (r) { return r.json(); });
+    hover.then(function (h) {
+        var p = h.points[idx];
+        if (p) box.textContent = 'ID: ' + p[0] + '\\nName: ' + p[1] + '\\nCluster: ' + p[3] + '\\n\\n' + p[2];
+    }).catch(function () { box.textContent = 'Hover text needs the plot served over http'; });
+});
+"""
+
+def plot_clusters_scalable(reduced, labels, ids, contract_csv, output_html, caps_csv=None, keywords=None):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    labels = np.asarray(labels)
+    ids = np.asarray(ids, dtype=object)
+    is_cap = np.array([id_.startswith('CAP:') for id_ in ids], dtype=bool)
+    keep = downsample(reduced, labels, is_cap)
+    print(f"Drawing {len(keep)} of {len(ids)} points; density layer covers all")
+
+    # Hover text only for the points actually drawn
+    with metrics.stage("csv_lookup"):
+        names, descs = load_contract_info(contract_csv, list(ids[keep]))
+    sidecar = os.path.splitext(output_html)[0] + ".hover.json"
+    write_hover_sidecar(sidecar, keep, ids[keep], names, descs, labels[keep])
+
+    fig = go.Figure()
+    counts, xedges, yedges = np.histogram2d(reduced[:, 0], reduced[:, 1], bins=HEAT_BINS)
+    fig.add_trace(go.Heatmap(
+        z=np.log1p(counts.T),
+        x=(xedges[:-1] + xedges[1:]) / 2,
+        y=(yedges[:-1] + yedges[1:]) / 2,
+        colorscale='Greys',
+        showscale=False,
+        hoverinfo='skip',
+        opacity=0.5,
+        name=f"Density ({len(ids)} points)",
+        showlegend=True
+    ))
+
+    colors = qualitative.Plotly
+    kept_labels = labels[keep]
+    kept_cap = is_cap[keep]
+    for i, cluster in enumerate(sorted(set(kept_labels.tolist()))):
+        sel = keep[(kept_labels == cluster) & ~kept_cap]
+        if not len(sel):
+            continue
+        label = cluster_label(cluster, keywords)
+        fig.add_trace(go.Scattergl(
+            x=reduced[sel, 0],
+            y=reduced[sel, 1],
+            mode='markers',
+            marker=dict(size=5 if cluster != -1 else 4, color=colors[i % len(colors)],
+                        opacity=0.6 if cluster != -1 else 0.3),
+            name=label,
+            customdata=sel,
+            hovertemplate=f"{label}<extra></extra>",
+            showlegend=True
+        ))
 
-    input_json, cluster_json, csv_file, output_html = sys.argv[1:]
+    if caps_csv:
+        add_cap_overlay(fig, reduced, ids, caps_csv)
+
+    cap = keep[kept_cap]
+    if len(cap):
+        cap_descs = dict(zip(ids[keep], descs))
+        hover_texts = [
+            f"Capability: {ids[i].replace('CAP:', '')}<br><br>Description:<br>{wrap_text(cap_descs[ids[i]])}<br><br>Cluster: {labels[i]}"
+            for i in cap
+        ]
+        fig.add_trace(go.Scattergl(
+            x=reduced[cap, 0],
+            y=reduced[cap, 1],
+            mode='markers',
+            marker=dict(symbol='diamond', size=16, color='black', line=dict(width=1, color='white')),
+            name="Capabilities (CAP)",
+            text=hover_texts,
+            hoverinfo='text',
+            showlegend=True
+        ))
+
+    fig.update_layout(
+        title='HDBSCAN Clusters (2D UMAP Projection)',
+        xaxis_title='UMAP-1',
+        yaxis_title='UMAP-2',
+        legend=dict(itemsizing='constant', orientation='v', yanchor='top', y=1, xanchor='left', x=1.05),
+        width=900,
+        height=600,
+        hovermode='closest',
+        hoverlabel=dict(bgcolor='white', align='left', namelength=-1)
+    )
+
+    with metrics.timer("write_html"):
+        fig.write_html(output_html,
+                       post_script=HOVER_JS.replace('SIDECAR', os.path.basename(sidecar)))
+    print(f"Plot saved to {output_html}")
+
+def render(reduced, labels, ids, csv_file, output_html, mode=None, caps_csv=None, keywords_csv=None):
+    keywords = None
+    if keywords_csv and os.path.exists(keywords_csv):
+        from cluster_keywords import load_table
+        keywords = load_table(keywords_csv)
+    if mode == "scalable" or (mode is None and len(ids) > SCALABLE_POINTS):
+        print("Formatting (scalable)")
+        plot_clusters_scalable(reduced, labels, ids, csv_file, output_html, caps_csv, keywords)
+        return
+
+    print("Formatting")
+    with metrics.stage("csv_lookup"):
+        names, descs = load_contract_info(csv_file, ids)
+    with metrics.stage("write_html"):
+        plot_clusters_interactive(reduced, labels, ids, names, descs, output_html, caps_csv, keywords)
+
+def parse_args(argv):
+    import argparse
+    p = argparse.ArgumentParser(prog="plotting.py")
+    p.add_argument("input_npy")
+    p.add_argument("cluster_json")
+    p.add_argument("csv_file")
+    p.add_argument("output_html")
+    p.add_argument("reducer_path", nargs="?", default=REDUCER_PATH, help="saved 2-d reducer (umap_2d.pkl)")
+    p.add_argument("--mode", choices=["full", "scalable"])
+    p.add_argument("--caps", help="capability matches CSV (semantic_search.py batch)")
+    p.add_argument("--keywords", help="cluster keywords CSV (cluster_keywords.py)")
+    return p.parse_args(argv)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    input_npy, cluster_json, csv_file, output_html = (args.input_npy, args.cluster_json,
+                                                       args.csv_file, args.output_html)
+    reducer_path, mode, caps_csv, keywords_csv = args.reducer_path, args.mode, args.caps, args.keywords
 
     print("Opening Data")
-    with open(input_json, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    ids = list(data.keys())
-    embeddings = np.array([data[id_] for id_ in ids])
+    with metrics.stage("load"):
+        ids, embeddings = load_store(input_npy)
+        embeddings = as_float32(embeddings)
     
-    with open(cluster_json, 'r', encoding='utf-8') as f:
-        cluster_data = json.load(f)
-    labels = [cluster_data[id_] for id_ in ids]
+        with open(cluster_json, 'r', encoding='utf-8') as f:
+            cluster_data = json.load(f)
+        labels = [cluster_data[id_] for id_ in ids]
 
     print("Reducing Dimensionality")
-    import umap
-    reducer = umap.UMAP(n_components=2)
-    reduced = reducer.fit_transform(embeddings)
-
-    print("Formatting")
-    names, descs = load_contract_info(csv_file, ids)
-    plot_clusters_interactive(reduced, labels, ids, names, descs, output_html)
+    with metrics.stage("umap_2d"):
+        reduced = reducer_registry.reduce(reducer_path, ids, embeddings, 2, metric="euclidean")
+    metrics.gauge("points", len(ids))
+    render(reduced, labels, ids, csv_file, output_html, mode, caps_csv, keywords_csv)
 
 if __name__ =="__main__":
     main()
- 
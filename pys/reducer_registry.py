@@ -0,0 +1,118 @@
+import os
+import hashlib
+import uuid
+import numpy as np
+import joblib
+
+# ---------------------------
+# REDUCER REGISTRY
+# Each saved reducer is a joblib file holding the fitted UMAP, the
+# fingerprint of the data it was fit on, the NoticeIds of its training
+# rows and a hash of each training vector. Reducing a dataset then costs:
+#
+#   same data as the fit       → reducer.embedding_ (no transform at all)
+#   training rows + new rows   → embedding_ rows + transform of the new ones
+#                                (a training id whose vector changed, e.g. an
+#                                edited and re-embedded description, counts as new)
+#   no saved reducer / refit   → one fit, saved for next time
+#
+# A reducer fed by another one (the 2-D plot model over the 50-d output)
+# records the upstream fit it was trained on; once the upstream reducer is
+# refit its whole input space moved, so the downstream one is refit too.
+# The fit id sits next to the model (<model>.fit) so checking it does not
+# load the upstream UMAP.
+# ---------------------------
+REFIT_CHANGED = 0.5  # Refit when more than this share of the training rows changed vector
+def fingerprint(ids, data):
+    h = hashlib.sha1()
+    h.update("\n".join(ids).encode('utf-8'))
+    h.update(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+def row_hashes(data):
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    return np.array([int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little")
+                     for row in data], dtype=np.uint64)
+
+def fit_id(path):
+    # Id of the last fit of the reducer at path (new on every fit, even over
+    # the same data: UMAP is not deterministic), None if unknown
+    if not os.path.exists(path + ".fit"):
+        return None
+    with open(path + ".fit", 'r', encoding='utf-8') as f:
+        return f.read().strip() or None
+
+def load_entry(path):
+    if not os.path.exists(path):
+        return None
+    entry = joblib.load(path)
+    if not isinstance(entry, dict):
+        # Bare reducer saved before the registry: neither its params nor its
+        # training rows are known, so it cannot be trusted for any request
+        print(f"Saved reducer at {path} predates the registry; refitting")
+        return None
+    return entry
+
+def fit(path, ids, data, n_components, metric="cosine", upstream=None, **umap_kwargs):
+    import umap
+    params = {"n_components": n_components, "metric": metric, **umap_kwargs}
+    print(f"Fitting UMAP {data.shape[1]} → {n_components} on {len(ids)} rows...")
+    reducer = umap.UMAP(**params)
+    reducer.fit(data)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    this_fit = uuid.uuid4().hex
+    joblib.dump({
+        "reducer": reducer,
+        "fingerprint": fingerprint(ids, data),
+        "train_ids": list(ids),
+        "row_hashes": row_hashes(data),
+        "params": params,
+        "fit_id": this_fit,
+        "upstream": fit_id(upstream) if upstream else None,
+    }, path)
+    with open(path + ".fit", 'w', encoding='utf-8') as f:
+        f.write(this_fit)
+    print(f"Model saved to {path}")
+    return reducer.embedding_
+
+def reduce(path, ids, data, n_components, metric="cosine", refit=False, upstream=None, **umap_kwargs):
+    # upstream: path of the reducer whose output data is, if any
+    entry = None if refit else load_entry(path)
+    params = {"n_components": n_components, "metric": metric, **umap_kwargs}
+    if entry is not None and entry.get("params") != params:
+        print(f"Saved reducer at {path} has params {entry.get('params')}; refitting")
+        entry = None
+    if entry is not None and upstream and entry.get("upstream") != fit_id(upstream):
+        print(f"Upstream reducer {upstream} was refit since {path} was fit; refitting")
+        entry = None
+    if entry is None:
+        return fit(path, ids, data, n_components, metric, upstream, **umap_kwargs)
+
+    reducer = entry["reducer"]
+    if entry["fingerprint"] == fingerprint(ids, data):
+        print("Input matches the training set; reusing embedding_")
+        return reducer.embedding_
+    if entry.get("row_hashes") is None:
+        print(f"Saved reducer at {path} has no per-row hashes; refitting")
+        return fit(path, ids, data, n_components, metric, upstream, **umap_kwargs)
+
+    # Rows the reducer was trained on keep their fitted coordinates as long
+    # as their vector is unchanged; new and changed rows go through transform.
+    train_index = {id_: i for i, id_ in enumerate(entry["train_ids"])}
+    rows = np.array([train_index.get(id_, -1) for id_ in ids])
+    seen = rows >= 0
+    known = seen.copy()
+    known[seen] = entry["row_hashes"][rows[seen]] == row_hashes(np.asarray(data)[seen])
+    changed = int(seen.sum() - known.sum())
+    if changed > REFIT_CHANGED * max(int(seen.sum()), 1):
+        print(f"{changed} of {int(seen.sum())} training rows changed vector; refitting")
+        return fit(path, ids, data, n_components, metric, upstream, **umap_kwargs)
+
+    out = np.empty((len(ids), n_components), dtype=np.float32)
+    if known.any():
+        out[known] = reducer.embedding_[rows[known]]
+    if (~known).any():
+        print(f"Transforming {int((~known).sum())} new or changed rows "
+              f"({changed} changed, {int(known.sum())} reused from the fit)...")
+        out[~known] = reducer.transform(np.asarray(data)[~known])
+    return out
@@ -1,13 +1,14 @@
+import os
 import sys
-import csv
-import json
-import re
 import numpy as np
-import torch
 from tqdm import tqdm
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import AutoTokenizer, AutoModel
 from concurrent.futures import ProcessPoolExecutor
+from embedding_store import save_store
+from embedding_cache import EmbeddingCache
+from contract_reader import unique_title_rows
+from text_cleaner import BoilerplateStripper, load_phrases, clean_text, clean_rows
+import metrics
+import models
 
 # ---------------------------
 # CONFIG
@@ -22,36 +23,40 @@ RELEVANT_NAICS = {
 
 MODEL_NAME = "allenai/specter2_base"
 BOILERPLATE_PATH = "boilerplate_phrases.csv"
+FLUSH_EVERY = 50  # batches between cache checkpoints
+EMBED_THREADS = os.cpu_count()
+QUANTIZE = False  # dynamic int8 on CPU
+CHUNKED = False  # embed whole descriptions as pooled 512-token windows
+CLEAN_WORKERS = 4
+NEAR_DUP = None  # MinHash Jaccard (e.g. 0.85) to embed one notice per near-duplicate family (near_dup.py)
 
-print("Loading tokenizer and model globally…")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModel.from_pretrained(MODEL_NAME)
-model.eval()
+# Loaded on first use and cached per process (see models.py)
+def get_engine():
+    return models.engine(MODEL_NAME, num_threads=EMBED_THREADS, quantize=QUANTIZE)
+
+# Chunked vectors differ from truncated ones, so they get their own cache keys
+def cache_key():
+    return f"{MODEL_NAME}:chunked" if CHUNKED else MODEL_NAME
+
+def sep_token():
+    return models.tokenizer(MODEL_NAME).sep_token
 
 # ---------------------------
 # CLEANING UTILITIES
 # ---------------------------
+# Phrases are stripped in file order; see text_cleaner for the matcher
 def load_boilerplate(path):
-    with open(path, newline='', encoding='utf-8') as f:
-        return set(row[0].strip().lower() for row in csv.reader(f) if row)
-
-def clean_contract_text(title, description, boilerplate_phrases):
-    text = f"{title} {tokenizer.sep_token} {description}".lower()
-    for phrase in boilerplate_phrases:
-        text = text.replace(phrase, '')
-    text = re.sub(r'<[^>]+>', '', text)  # Remove HTML
-    text = re.sub(r'http\S+|www\S+', '', text)  # Remove URLs
-    text = re.sub(r'\S+@\S+', '', text)  # Remove emails
-    text = re.sub(r'[^\w\s]', '', text)  # Remove punctuation
-    text = re.sub(r'\s+', ' ', text)  # Collapse whitespace
-    cleaned = text.strip()
-    count = len(cleaned)
-    return cleaned, count
+    return BoilerplateStripper(load_phrases(path))
+
+def clean_contract_text(title, description, boilerplate):
+    return clean_text(title, description, boilerplate, sep_token())
 
 # ---------------------------
 # EMBEDDING FUNCTION
 # ---------------------------
 def embed_chunk(texts):
+    import torch
+    tokenizer, model = models.tokenizer(MODEL_NAME), models.model(MODEL_NAME)
     texts = [(t if t is not None else '') for t in texts]
     with torch.no_grad():
         inputs = tokenizer(texts, padding=True, truncation=True,
@@ -62,31 +67,12 @@ def embed_chunk(texts):
 # ---------------------------
 # HELPERS
 # ---------------------------
-def load_cache(path):
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("No or invalid cache found—starting fresh.")
-        return {}
-
-def save_json(obj, path, desc="Saved"):
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(obj, f, indent=2)
-    print(f"{desc} → {path}")
+# Only the columns later stages read are materialised
+OPP_COLUMNS = ['NoticeId', 'Title', 'Description', 'PostedDate']
 
 def load_filtered_opps(csv_path):
-    filtered = []
-    seen_titles = set()
-    with open(csv_path, newline='', encoding='utf-8', errors='ignore') as cf:
-        reader = csv.DictReader(cf)
-        for row in reader:
-            naics = (row.get('NaicsCode') or '').strip()
-            title = (row.get('Title') or '').strip()
-            if naics in RELEVANT_NAICS and title and title not in seen_titles:
-                seen_titles.add(title)
-                clean_row = {k: (v if v is not None else '') for k, v in row.items()}
-                filtered.append(clean_row)
+    filtered = unique_title_rows(csv_path, OPP_COLUMNS, naics=RELEVANT_NAICS)
+    metrics.count("rows_kept", len(filtered))
     print(f"Kept {len(filtered)} unique-title opportunities")
     return filtered
 
@@ -94,6 +80,7 @@ def load_capabilities(path):
     with open(path, 'r', encoding='utf-8') as f:
         return [(line.strip() if line is not None else '') for line in f if line.strip()]
 
+# Legacy multi-process path, kept as the baseline for `embed_engine.py compare`
 def parallel_embed(texts, batch_size=16, workers=4, desc="Embedding"):
     batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
     all_embs = []
@@ -103,61 +90,127 @@ def parallel_embed(texts, batch_size=16, workers=4, desc="Embedding"):
             all_embs.append(emb)
     return np.vstack(all_embs)
 
-def embed_missing(opps, cache, boilerplate_phrases):                                             
+# Cleans every opportunity and splits the long-enough ones into what is
+# already cached and what is not. Entries are keyed by NoticeId and a hash
+# of the cleaned text, so edited descriptions count as missing.
+#
+# With NEAR_DUP set, uncached notices that belong to a near-duplicate family
+# (amendments, re-issues) are not embedded: only the family representative
+# (latest PostedDate) is. The others are never written to the cache; they
+# take the representative's vector when the store is built (store_vectors),
+# so turning NEAR_DUP off or raising it re-embeds them.
+# Returns kept (NoticeId, hash, text, PostedDate) rows, the kept indexes to
+# embed, and (NoticeId, representative NoticeId) copies.
+def find_missing(opps, cache, boilerplate):
+    kept = []
     missing = []
-    texts = []                                                                
-    for row in opps:                                                                                                                 
-        if row.get('NoticeId') not in cache:                             
-            cleaned, word_count = clean_contract_text(row.get('Title', ''), row.get('Description', ''), boilerplate_phrases)
-            if word_count >= 10:
-                missing.append(row)                                            
-                texts.append(cleaned)                                                                                                   
-    if not missing:                                                                                 
-        print("No new descriptions to embed.")                                                                       
-        return cache                                                                                
-    embs = parallel_embed(texts, desc="Opportunities")                                                        
-    for row, emb in zip(missing, embs):                                                                    
-        cache[row.get('NoticeId', '')] = emb.tolist()                    
-    return cache  
-  
+    legacy = []
+    short = 0
+    pairs = ((row.get('Title', ''), row.get('Description', '')) for row in opps)
+    with metrics.stage("clean"):
+        cleaned_rows = clean_rows(pairs, boilerplate.phrases, sep_token(), workers=CLEAN_WORKERS)
+    for row, (cleaned, word_count) in zip(opps, cleaned_rows):
+        if word_count < 10:
+            short += 1
+            continue
+        h = cache.text_hash(cleaned)
+        if cache.is_legacy(row.get('NoticeId')):
+            legacy.append((row.get('NoticeId'), h))
+        elif not cache.has(row.get('NoticeId'), h):
+            missing.append(len(kept))
+        kept.append((row.get('NoticeId', ''), h, cleaned, row.get('PostedDate', '')))
+    if legacy:
+        # Imported rows: take the text seen now as the embedded one, so the
+        # next edit is a miss (embedding_cache.pin_legacy)
+        print(f"Pinning {len(legacy)} imported vectors to their current text")
+        cache.pin_legacy([nid for nid, _ in legacy], [h for _, h in legacy])
+    metrics.count("legacy_pinned", len(legacy))
+    metrics.count("rows_too_short", short)
+    metrics.count("cache_misses", len(missing))
+    metrics.count("cache_hits", len(kept) - len(missing))
+    if not missing:
+        return kept, missing, []
+
+    # Families are found over every kept notice, so a new amendment can
+    # reuse the vector of an already-cached representative
+    copies = []
+    if NEAR_DUP is not None:
+        from near_dup import find_duplicates, summary, print_summary
+        rep = find_duplicates([k[2] for k in kept], [k[3] for k in kept], NEAR_DUP, CLEAN_WORKERS)
+        print_summary(summary(rep), NEAR_DUP)
+        copies = [(kept[i][0], kept[rep[i]][0]) for i in missing if rep[i] != i]
+        missing = [i for i in missing if rep[i] == i]
+        print(f"{len(copies)} of {len(copies) + len(missing)} uncached descriptions reuse "
+              f"a family representative's vector")
+        metrics.count("near_dup_copies", len(copies))
+    return kept, missing, copies
+
+# Store rows for nids: the cached vector, or for a near-duplicate copy its
+# representative's; notices with neither are skipped
+def store_vectors(cache, nids, copies=()):
+    rep_of = dict(copies)
+    kept = [nid for nid in nids if rep_of.get(nid, nid) in cache]
+    _, mat = cache.vectors([rep_of.get(nid, nid) for nid in kept])
+    return kept, mat
+
+# Embeds in checkpoints of batch_size * FLUSH_EVERY texts so an interrupted
+# run resumes from the last flushed segment. For runs spread over several
+# workers or machines see shard_embed.py. Returns the cache and the
+# near-duplicate copies for store_vectors.
+def embed_missing(opps, cache, boilerplate, batch_size=16):
+    kept, missing, copies = find_missing(opps, cache, boilerplate)
+    if not missing:
+        print("No new descriptions to embed.")
+        return cache, copies
+
+    print(f"{len(missing)} descriptions to embed ({len(cache)} cached)")
+    step = batch_size * FLUSH_EVERY
+    for i in range(0, len(missing), step):
+        block = [kept[j] for j in missing[i:i+step]]
+        embed = get_engine().embed_chunked if CHUNKED else get_engine().embed
+        embs = embed([k[2] for k in block], desc="Opportunities")
+        cache.add([k[0] for k in block], [k[1] for k in block], embs)
+        cache.flush()
+    return cache, copies
+
+# Best-matching contracts per capability, via the blocked batch search
+# (argpartition top-k, no full sort); see semantic_search.py batch for the CSV
 def semantic_search_rricap(opps, cache, capabilities, top_k=1):
-    contract_ids = [r['NoticeId'] for r in opps if r.get('NoticeId') in cache]
-    contract_embs = np.array([cache[cid] for cid in contract_ids])
-    cap_embs = parallel_embed(capabilities, desc="Capabilities")
-    sims = cosine_similarity(cap_embs, contract_embs)
+    from ann_index import normalize, batch_search
+    contract_ids, contract_embs = cache.vectors([r['NoticeId'] for r in opps])
+    cap_embs = normalize(get_engine().embed(capabilities, desc="Capabilities"))
     rricap_map = {}
-    for cap_idx in range(len(capabilities)):
-        for idx in sims[cap_idx].argsort()[::-1][:top_k]:
-            cid = contract_ids[idx]
-            rricap_map[f"CAP:{cid}"] = cache[cid]
+    for _, idx, _ in batch_search(normalize(contract_embs), cap_embs, top_k=top_k):
+        for i in idx:
+            rricap_map[f"CAP:{contract_ids[i]}"] = contract_embs[i]
     return rricap_map
 
 # ---------------------------
 # MAIN
 # ---------------------------
-def main(opps_csv, cache_json, output_json, capabilities_txt):
+def main(opps_csv, cache_dir, output_npy, capabilities_txt):
     print("Loading Cache")
-    cache = load_cache(cache_json)
+    with metrics.stage("load_cache"):
+        cache = EmbeddingCache(cache_dir, cache_key())
     print("Loading Boilerplate Phrases")
-    boilerplate_phrases = load_boilerplate(BOILERPLATE_PATH)
+    boilerplate = load_boilerplate(BOILERPLATE_PATH)
     print("Filtering Data")
-    opps = load_filtered_opps(opps_csv)
+    with metrics.stage("filter"):
+        opps = load_filtered_opps(opps_csv)
     print("Embedding Unembedded Contracts")
-    cache = embed_missing(opps, cache, boilerplate_phrases)
-    save_json(cache, cache_json, "Updated cache")
-    filteredmap = {
-        row['NoticeId']: cache[row['NoticeId']]
-        for row in opps if row['NoticeId'] in cache
-    }
+    with metrics.stage("embed_missing"):
+        cache, copies = embed_missing(opps, cache, boilerplate)
+    filtered_ids, filtered_mat = store_vectors(cache, [row['NoticeId'] for row in opps], copies)
     print("Loading Capabilities")
     capabilities = load_capabilities(capabilities_txt)
     # rricap_map = semantic_search_rricap(opps, cache, capabilities)
-    final_output = {**filteredmap}
-    save_json(final_output, output_json, "Filtered embeddings with CAP")
+    with metrics.stage("save_store"):
+        save_store(output_npy, filtered_ids, filtered_mat)
+    return filtered_ids, filtered_mat
 
 if __name__ == "__main__":
     if len(sys.argv) != 5:
-        print("Usage: python script.py opportunities.csv cache.json filtered_embeddings.json capabilities.txt")
+        print("Usage: python script.py opportunities.csv cache_dir filtered_embeddings.npy capabilities.txt")
         sys.exit(1)
     _, csvf, cachef, outf, capf = sys.argv
     main(csvf, cachef, outf, capf)
@@ -0,0 +1,44 @@
+import os
+import sys
+import csv
+import json
+import urllib.request
+
+# ---------------------------
+# THIN CLIENT FOR search_server.py
+# Sends every sentence in one request and writes a long-format CSV:
+# one row per (query, match). top_k=N keeps only the N best matches per
+# sentence (still at or above the threshold).
+# ---------------------------
+URL = os.environ.get("SEARCH_URL", "http://127.0.0.1:8765")
+
+def query(sentences, threshold, top_k=None, url=URL):
+    body = json.dumps({"queries": sentences, "threshold": threshold, "top_k": top_k})
+    req = urllib.request.Request(f"{url}/query", data=body.encode('utf-8'),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as resp:
+        return json.load(resp)
+
+def save_results(sentences, results, output_csv_path):
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Query", "NoticeId", "CosineSimilarity", "Title"])
+        for sentence, matches in zip(sentences, results):
+            for nid, sim, title in matches:
+                writer.writerow([sentence, nid, sim, title])
+    print(f"Results saved to {output_csv_path}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python search_client.py threshold output.csv [top_k=N] \"sentence\" [\"sentence\" ...]")
+        sys.exit(1)
+
+    threshold, out_csv, sentences = float(sys.argv[1]), sys.argv[2], sys.argv[3:]
+    top_k = None
+    if sentences[0].startswith("top_k="):
+        top_k, sentences = int(sentences[0][len("top_k="):]), sentences[1:]
+    reply = query(sentences, threshold, top_k)
+    found = sum(len(r) for r in reply["results"])
+    print(f"Found {found} matches >= threshold {threshold}"
+          f"{f' (top {top_k} per sentence)' if top_k else ''} in {reply['ms']:.1f} ms")
+    save_results(sentences, reply["results"], out_csv)
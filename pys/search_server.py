@@ -0,0 +1,165 @@
+import sys
+import json
+import time
+import queue
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from semantic_search import SemanticSearch, embed_texts, SEARCH_TIER
+from ann_index import normalize
+
+# ---------------------------
+# RESIDENT SEARCH SERVER
+# Loads the model, unit matrix and titles once and answers over local HTTP.
+# Concurrent requests are micro-batched: whatever arrives within MAX_WAIT
+# of the first request is embedded in one forward pass.
+#
+#   POST /query  {"queries": ["..."], "threshold": 0.88, "top_k": null}
+#             →  {"results": [[[NoticeId, similarity, title], ...], ...], "ms": 31.2}
+#   GET  /stats  requests by outcome (ok, failed, timed_out) and p50/p95
+#                latency in ms over all of them, failures included
+# ---------------------------
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BATCH = 64      # sentences per forward pass
+MAX_WAIT = 0.005    # seconds to wait for more requests to join a batch
+LATENCY_WINDOW = 1000
+REQUEST_TIMEOUT = 30.0  # seconds a request waits for its batch before a 504
+
+class MicroBatcher:
+    def __init__(self, searcher, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.searcher = searcher
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, sentences, threshold, top_k):
+        job = {"sentences": sentences, "threshold": threshold, "top_k": top_k,
+               "done": threading.Event()}
+        self.jobs.put(job)
+        if not job["done"].wait(REQUEST_TIMEOUT):
+            raise TimeoutError(f"no result within {REQUEST_TIMEOUT:g} s")
+        if "error" in job:
+            raise RuntimeError(job["error"])
+        return job["results"]
+
+    def _collect(self):
+        batch = [self.jobs.get()]
+        size = len(batch[0]["sentences"])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(job)
+            size += len(job["sentences"])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                texts = [s for job in batch for s in job["sentences"]]
+                embs = normalize(embed_texts(texts))
+                offset = 0
+                for job in batch:
+                    n = len(job["sentences"])
+                    job["results"] = self.searcher.search_batch(
+                        embs[offset:offset + n], job["threshold"], job["top_k"])
+                    offset += n
+            except Exception as e:
+                for job in batch:
+                    job["error"] = str(e)
+            for job in batch:
+                job["done"].set()
+
+class SearchHandler(BaseHTTPRequestHandler):
+    batcher = None
+    latencies = []
+    outcomes = {"ok": 0, "failed": 0, "timed_out": 0}
+    lock = threading.Lock()
+
+    def _record(self, start, outcome):
+        ms = 1000 * (time.perf_counter() - start)
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.latencies.append(ms)
+            del self.latencies[:-LATENCY_WINDOW]
+        return ms
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self._reply(404, {"error": "unknown path"})
+        with self.lock:
+            lat = np.array(self.latencies)
+            stats = {"requests": sum(self.outcomes.values()), **self.outcomes}
+        if len(lat):
+            stats["p50_ms"] = float(np.percentile(lat, 50))
+            stats["p95_ms"] = float(np.percentile(lat, 95))
+        self._reply(200, stats)
+
+    def do_POST(self):
+        if self.path != "/query":
+            return self._reply(404, {"error": "unknown path"})
+        start = time.perf_counter()
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            queries = req["queries"]
+            if isinstance(queries, str):
+                queries = [queries]
+            threshold = float(req.get("threshold", 0.5))
+            top_k = req.get("top_k")
+            top_k = int(top_k) if top_k else None
+        except (ValueError, KeyError, TypeError) as e:
+            self._record(start, "failed")
+            return self._reply(400, {"error": f"bad request: {e}"})
+
+        try:
+            results = self.batcher.submit(queries, threshold, top_k) if queries else []
+        except TimeoutError as e:
+            self._record(start, "timed_out")
+            return self._reply(504, {"error": str(e)})
+        except RuntimeError as e:
+            self._record(start, "failed")
+            return self._reply(500, {"error": str(e)})
+
+        self._reply(200, {"results": results, "ms": self._record(start, "ok")})
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(cache_path, titles_path, host=HOST, port=PORT, use_ann=False, tier=None):
+    searcher = SemanticSearch(cache_path, titles_path, use_ann=use_ann, tier=tier or SEARCH_TIER)
+    # Warm-up pass so the first real request doesn't pay for lazy init
+    embed_texts(["warm up"])
+    SearchHandler.batcher = MicroBatcher(searcher)
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    print(f"Serving semantic search on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python search_server.py cache.npy titles.csv [port] [ann|f16|pq]")
+        sys.exit(1)
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else PORT
+    index = sys.argv[4] if len(sys.argv) == 5 else None
+    serve(sys.argv[1], sys.argv[2], port=port, use_ann=index == "ann",
+          tier=index if index in ("f16", "pq") else None)
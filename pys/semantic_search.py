@@ -1,74 +1,112 @@
+import os
 import sys
 import csv
-import json
-import numpy as np
-import torch
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import AutoTokenizer, AutoModel
+from contract_reader import iter_batches
+from ann_index import (load_unit_matrix, load_ann, normalize, exact_search, ann_search,
+                       batch_search, ann_batch_search)
+from compressed_index import load_tier, tier_search
+import metrics
+import models
 
 MODEL_NAME = "allenai/specter2_base"
+# Compressed in-RAM tier (f16 or pq, see compressed_index.py); unset = exact
+SEARCH_TIER = os.environ.get("SEARCH_TIER") or None
 
-print("Loading tokenizer and model…")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModel.from_pretrained(MODEL_NAME)
-model.eval()
-
+# The model is loaded on the first query, not at import (see models.py);
+# EMBED_BACKEND=onnx / onnx-int8 runs it through onnxruntime instead
 def embed_text(text):
-    text = text or ""
-    with torch.no_grad():
-        inputs = tokenizer([text], padding=True, truncation=True,
-                           return_tensors="pt", max_length=512)
-        outputs = model(**inputs)
-        return outputs.last_hidden_state[:, 0, :].cpu().numpy()
-
-def load_cache(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return models.engine(MODEL_NAME).embed([text or ""], quiet=True)
+
+# Many sentences in one length-sorted, token-budgeted pass
+def embed_texts(texts):
+    return models.engine(MODEL_NAME).embed(texts, quiet=True)
 
 def load_titles(path):
     lookup = {}
-    with open(path, newline='', encoding='utf-8', errors='ignore') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            nid = (row.get('NoticeId') or '').strip()
-            title = (row.get('Title') or '').strip()
-            if nid:
-                lookup[nid] = title
+    for batch in iter_batches(path, columns=['NoticeId', 'Title']):
+        batch = batch[batch['NoticeId'] != '']
+        lookup.update(zip(batch['NoticeId'], batch['Title']))
     return lookup
 
 class SemanticSearch:
-    def __init__(self, cache_json_path, titles_csv_path):
-        import os 
-        print("Cache path:", os.path.abspath(cache_json_path))
+    # use_ann: answer top_k queries from the approximate index. Threshold-only
+    # queries always take the exact path so no match above it is missed.
+    # tier: score against a compressed in-RAM copy and re-rank the best
+    # candidates from the unit matrix on disk (ann still wins for top_k)
+    def __init__(self, cache_path, titles_csv_path, use_ann=False, tier=SEARCH_TIER):
+        print("Cache path:", os.path.abspath(cache_path))
         print("Loading embeddings cache…")
-        self.cache = load_cache(cache_json_path)
-        print("ids")
-        self.ids = list(self.cache.keys())
-        print("mat")
-        self.mat = np.array([self.cache[k] for k in self.ids])
+        with metrics.stage("load_index"):
+            self.ids, self.unit = load_unit_matrix(cache_path)
+            self.ann = load_ann(cache_path, self.unit) if use_ann else None
+            self.tier = None
+            if tier:
+                self.tier = load_tier(cache_path, tier, self.unit)
+                metrics.gauge("tier_bytes", self.tier.nbytes)
 
         print("Loading titles lookup…")
-        self.title_lookup = load_titles(titles_csv_path)
+        with metrics.stage("load_titles"):
+            self.title_lookup = load_titles(titles_csv_path)
 
     def query(self, sentence, threshold=0.5, top_k=None):
         print("Embedding input sentence…")
-        sent_emb = embed_text(sentence)
+        with metrics.timer("embed_query"):
+            q = normalize(embed_text(sentence)[0])
 
         print("Calculating cosine similarities…")
-        sims = cosine_similarity(sent_emb, self.mat)[0]
-
-        results = []
-        for nid, sim in zip(self.ids, sims):
-            if sim >= threshold:
-                results.append((nid, float(sim), self.title_lookup.get(nid, "")))
-
-        # Sort by similarity descending
-        results.sort(key=lambda x: x[1], reverse=True)
-
-        if top_k:
-            results = results[:top_k]
-
-        return results
+        return self.search(q, threshold, top_k)
+
+    # q_unit: an already-embedded, normalised query vector
+    def search(self, q_unit, threshold=0.5, top_k=None):
+        metrics.count("queries")
+        with metrics.timer("search"):
+            if self.ann is not None and top_k:
+                idx, sims = ann_search(self.ann, q_unit, top_k, threshold)
+            elif self.tier is not None:
+                idx, sims = tier_search(self.tier, self.unit, q_unit, threshold, top_k)
+            else:
+                idx, sims = exact_search(self.unit, q_unit, threshold, top_k)
+
+        return [
+            (self.ids[i], float(sim), self.title_lookup.get(self.ids[i], ""))
+            for i, sim in zip(idx, sims)
+        ]
+
+    # q_units: (n, dim) normalised query vectors; yields (query index, matches)
+    def iter_search_batch(self, q_units, threshold=0.5, top_k=None):
+        metrics.count("queries", len(q_units))
+        if self.ann is not None and top_k:
+            hits = ann_batch_search(self.ann, q_units, top_k, threshold)
+        elif self.tier is not None:
+            # Compressed scoring is per query (one lookup table each)
+            hits = ((i, *tier_search(self.tier, self.unit, q, threshold, top_k))
+                    for i, q in enumerate(q_units))
+        else:
+            hits = batch_search(self.unit, q_units, threshold, top_k)
+        for qi, idx, sims in hits:
+            yield qi, [
+                (self.ids[i], float(sim), self.title_lookup.get(self.ids[i], ""))
+                for i, sim in zip(idx, sims)
+            ]
+
+    def search_batch(self, q_units, threshold=0.5, top_k=None):
+        with metrics.timer("search"):
+            return [matches for _, matches in self.iter_search_batch(q_units, threshold, top_k)]
+
+    def query_batch(self, sentences, output_csv_path, threshold=0.5, top_k=None):
+        # All sentences in one embedding pass; rows are written as each
+        # block of queries finishes, so memory stays bounded
+        with metrics.timer("embed_query"):
+            q = normalize(embed_texts(sentences))
+        found = 0
+        with metrics.timer("search"), open(output_csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Query", "NoticeId", "CosineSimilarity", "Title"])
+            for qi, matches in self.iter_search_batch(q, threshold, top_k):
+                writer.writerows([sentences[qi], nid, sim, title] for nid, sim, title in matches)
+                found += len(matches)
+        print(f"Found {found} matches for {len(sentences)} queries → {output_csv_path}")
+        return found
 
 def save_results(results, output_csv_path):
     with open(output_csv_path, 'w', newline='', encoding='utf-8') as f:
@@ -78,9 +116,21 @@ def save_results(results, output_csv_path):
             writer.writerow([nid, sim, title])
     print(f"Results saved to {output_csv_path}")
 
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
 if __name__ == "__main__":
+    if len(sys.argv) in (7, 8) and sys.argv[1] == "batch":
+        # batch queries.txt cache.npy titles.csv threshold output.csv [top_k]
+        _, _, queries_path, cache_path, titles_path, threshold_str, out_csv = sys.argv[:7]
+        top_k = int(sys.argv[7]) if len(sys.argv) == 8 else None
+        searcher = SemanticSearch(cache_path, titles_path, use_ann=False)
+        searcher.query_batch(load_queries(queries_path), out_csv, float(threshold_str), top_k)
+        sys.exit(0)
     if len(sys.argv) != 6:
-        print("Usage: python script.py \"your sentence here\" cache.json titles.csv threshold output.csv")
+        print("Usage: python script.py \"your sentence here\" cache.npy titles.csv threshold output.csv")
+        print("       python script.py batch queries.txt cache.npy titles.csv threshold output.csv [top_k]")
         sys.exit(1)
 
     _, sentence, cache_path, titles_path, threshold_str, out_csv = sys.argv
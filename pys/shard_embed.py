@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+from embedding_cache import EmbeddingCache
+import metrics
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+SHARD_ROWS = 2_000  # Texts per shard (one lease)
+LEASE_SECONDS = 900  # A shard not heartbeated for this long is handed out again
+POLL_SECONDS = 30  # Idle workers re-check for expired leases this often
+BATCH_SIZE = 16
+
+# ---------------------------
+# SHARDED EMBEDDING JOB
+# The single-process embed_missing, split so several workers (processes or
+# machines sharing the job directory) can work through one corpus:
+#
+#   job_dir/
+#     job.json                  cache key, shard and row counts
+#     queue.sqlite              lease table (shards) and per-worker progress
+#     shards/shard-00001.jsonl  [NoticeId, text hash, cleaned text] per line
+#     out/shard-00001.a1/       EmbeddingCache segments written by attempt 1
+#
+#   plan    clean + filter once, sort what is missing from the cache by
+#           NoticeId and cut it into SHARD_ROWS shards (deterministic)
+#   work    claim a shard (pending, or leased with an expired lease), embed
+#           it in checkpoints, renewing the lease on every checkpoint; exits
+#           once every shard is done
+#   merge   append every finished shard's vectors to the main cache; safe
+#           to rerun. Near-duplicate copies are never embedded or cached;
+#           the next sbert_filter_embed run gives them their
+#           representative's vector when it builds the store.
+#
+# Each claim bumps the shard's attempt number and writes to its own out
+# directory, so a worker that lost its lease (stalled past LEASE_SECONDS)
+# can never finish or overwrite the shard; its checkpoints are still reused
+# by the next attempt. SQLite locking needs a filesystem with working POSIX
+# locks; on NFS keep queue.sqlite local to one box and run the workers there.
+# ---------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending | leased | done
+    attempt INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    done_rows INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    started REAL,
+    last_seen REAL,
+    shard INTEGER,
+    shards INTEGER NOT NULL DEFAULT 0,
+    rows INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0
+);
+"""
+
+def _shard_path(job_dir, shard):
+    return os.path.join(job_dir, "shards", f"shard-{shard:05d}.jsonl")
+
+def _out_dir(job_dir, shard, attempt):
+    return os.path.join(job_dir, "out", f"shard-{shard:05d}.a{attempt}")
+
+def _connect(job_dir):
+    # Autocommit; writes that must be atomic open BEGIN IMMEDIATE themselves
+    db = sqlite3.connect(os.path.join(job_dir, "queue.sqlite"), timeout=60, isolation_level=None)
+    db.execute("PRAGMA busy_timeout = 60000")
+    return db
+
+def load_job(job_dir):
+    path = os.path.join(job_dir, "job.json")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run `python shard_embed.py plan` first")
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_jsonl(path, rows):
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# ---------------------------
+# PLAN
+# ---------------------------
+def plan(opps_csv, cache_dir, job_dir, shard_rows=SHARD_ROWS):
+    from sbert_filter_embed import (load_filtered_opps, load_boilerplate, find_missing,
+                                    cache_key, BOILERPLATE_PATH)
+    if os.path.exists(os.path.join(job_dir, "queue.sqlite")):
+        raise FileExistsError(f"{job_dir} already holds a job; merge it and remove the "
+                              "directory before planning a new one")
+    cache = EmbeddingCache(cache_dir, cache_key())
+    with metrics.stage("filter"):
+        opps = load_filtered_opps(opps_csv)
+    kept, missing, copies = find_missing(opps, cache, load_boilerplate(BOILERPLATE_PATH))
+    rows = sorted((kept[i][0], kept[i][1], kept[i][2]) for i in missing)
+
+    os.makedirs(os.path.join(job_dir, "shards"), exist_ok=True)
+    os.makedirs(os.path.join(job_dir, "out"), exist_ok=True)
+    n_shards = 0
+    for n_shards, lo in enumerate(range(0, len(rows), shard_rows), start=1):
+        _write_jsonl(_shard_path(job_dir, n_shards), rows[lo:lo + shard_rows])
+
+    db = _connect(job_dir)
+    db.executescript(SCHEMA)
+    db.execute("BEGIN IMMEDIATE")
+    db.executemany("INSERT INTO shards (id, rows) VALUES (?, ?)",
+                   [(s, min(shard_rows, len(rows) - (s - 1) * shard_rows)) for s in range(1, n_shards + 1)])
+    db.execute("COMMIT")
+    db.close()
+    with open(os.path.join(job_dir, "job.json"), 'w', encoding='utf-8') as f:
+        json.dump({"cache_key": cache_key(), "cache_dir": os.path.abspath(cache_dir),
+                   "shards": n_shards, "rows": len(rows), "copies": len(copies),
+                   "created": time.time()}, f, indent=2)
+    metrics.gauge("shards", n_shards)
+    print(f"Planned {len(rows)} descriptions in {n_shards} shards of up to {shard_rows} "
+          f"({len(copies)} near-duplicate copies skipped) → {job_dir}")
+
+# ---------------------------
+# WORK
+# ---------------------------
+def claim(db, worker, lease=LEASE_SECONDS):
+    # → (shard, attempt, requeued) or None
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+    row = db.execute("SELECT id, attempt, state FROM shards "
+                     "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                     "ORDER BY id LIMIT 1", (now,)).fetchone()
+    if row is None:
+        db.execute("COMMIT")
+        return None
+    shard, attempt, state = row
+    db.execute("UPDATE shards SET state = 'leased', attempt = ?, worker = ?, lease_until = ?, "
+               "started = ? WHERE id = ?", (attempt + 1, worker, now + lease, now, shard))
+    db.execute("UPDATE workers SET shard = ?, last_seen = ? WHERE name = ?", (shard, now, worker))
+    db.execute("COMMIT")
+    return shard, attempt + 1, state == 'leased'
+
+def heartbeat(db, worker, shard, attempt, done_rows, lease=LEASE_SECONDS):
+    # False once the lease has passed to another attempt
+    now = time.time()
+    cur = db.execute("UPDATE shards SET lease_until = ?, done_rows = ? "
+                     "WHERE id = ? AND attempt = ? AND state = 'leased'",
+                     (now + lease, done_rows, shard, attempt))
+    db.execute("UPDATE workers SET last_seen = ? WHERE name = ?", (now, worker))
+    return cur.rowcount == 1
+
+def finish(db, worker, shard, attempt, rows, seconds):
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+    cur = db.execute("UPDATE shards SET state = 'done', done_rows = rows, finished = ?, lease_until = NULL "
+                     "WHERE id = ? AND attempt = ? AND state = 'leased'", (now, shard, attempt))
+    ok = cur.rowcount == 1
+    if ok:
+        db.execute("UPDATE workers SET shards = shards + 1, rows = rows + ?, seconds = seconds + ?, "
+                   "shard = NULL, last_seen = ? WHERE name = ?", (rows, seconds, now, worker))
+    db.execute("COMMIT")
+    return ok
+
+def _previous_attempts(job_dir, shard, attempt, key):
+    # Checkpoints left by earlier (crashed or expired) attempts of this shard
+    done = {}
+    for a in range(1, attempt):
+        path = _out_dir(job_dir, shard, a)
+        if os.path.isdir(path):
+            for nid, (h, _, _) in EmbeddingCache(path, key).entries.items():
+                done[nid] = h
+    return done
+
+def embed_shard(db, job_dir, key, worker, shard, attempt, batch_size=BATCH_SIZE):
+    # → rows embedded by this attempt, or None if the lease was lost
+    import sbert_filter_embed as sfe
+    rows = _read_jsonl(_shard_path(job_dir, shard))
+    done = _previous_attempts(job_dir, shard, attempt, key)
+    todo = [r for r in rows if done.get(r[0]) != r[1]]
+    if len(todo) < len(rows):
+        print(f"Shard {shard}: {len(rows) - len(todo)} rows reused from earlier attempts")
+    out = EmbeddingCache(_out_dir(job_dir, shard, attempt), key)
+    step = batch_size * sfe.FLUSH_EVERY
+    for i in range(0, len(todo), step):
+        block = todo[i:i + step]
+        engine = sfe.get_engine()
+        embed = engine.embed_chunked if sfe.CHUNKED else engine.embed
+        embs = embed([r[2] for r in block], desc=f"Shard {shard}")
+        out.add([r[0] for r in block], [r[1] for r in block], embs)
+        out.flush()
+        if not heartbeat(db, worker, shard, attempt, len(rows) - len(todo) + i + len(block)):
+            print(f"Shard {shard}: lease lost to another worker, abandoning attempt {attempt}")
+            return None
+    return len(todo)
+
+def work(job_dir, worker=None, threads=None, lease=LEASE_SECONDS):
+    import sbert_filter_embed as sfe
+    job = load_job(job_dir)
+    if sfe.cache_key() != job["cache_key"]:
+        raise ValueError(f"Job was planned for {job['cache_key']!r} but this worker embeds "
+                         f"with {sfe.cache_key()!r}; check MODEL_NAME / CHUNKED")
+    if threads:
+        sfe.EMBED_THREADS = threads
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    db = _connect(job_dir)
+    db.execute("INSERT INTO workers (name, started, last_seen) VALUES (?, ?, ?) "
+               "ON CONFLICT(name) DO UPDATE SET started = excluded.started, last_seen = excluded.last_seen",
+               (worker, time.time(), time.time()))
+    print(f"Worker {worker} on {job_dir}")
+
+    while True:
+        claimed = claim(db, worker, lease)
+        if claimed is None:
+            pending, leased = db.execute(
+                "SELECT SUM(state = 'pending'), SUM(state = 'leased') FROM shards").fetchone()
+            if not pending and not leased:
+                break
+            # Others still hold leases; wait in case one of them expires
+            db.execute("UPDATE workers SET last_seen = ? WHERE name = ?", (time.time(), worker))
+            time.sleep(POLL_SECONDS)
+            continue
+        shard, attempt, requeued = claimed
+        print(f"Shard {shard}: attempt {attempt}" + (" (expired lease re-queued)" if requeued else ""))
+        start = time.perf_counter()
+        with metrics.stage("embed_shard"):
+            embedded = embed_shard(db, job_dir, job["cache_key"], worker, shard, attempt)
+        seconds = time.perf_counter() - start
+        if embedded is None:
+            continue
+        if finish(db, worker, shard, attempt, embedded, seconds):
+            metrics.count("shards_done")
+            metrics.count("rows_embedded", embedded)
+            print(f"Shard {shard}: {embedded} rows in {seconds:.0f}s "
+                  f"({embedded / max(seconds, 1e-9):.1f} texts/sec)")
+        else:
+            print(f"Shard {shard}: lease lost before completion, attempt {attempt} discarded")
+    db.close()
+    print(f"Worker {worker}: no shards left")
+
+# ---------------------------
+# STATUS
+# ---------------------------
+def status(job_dir):
+    job = load_job(job_dir)
+    db = _connect(job_dir)
+    now = time.time()
+    states = dict(db.execute("SELECT state, COUNT(*) FROM shards GROUP BY state").fetchall())
+    done_rows = db.execute("SELECT COALESCE(SUM(done_rows), 0) FROM shards").fetchone()[0]
+    print(f"{job['shards']} shards: {states.get('done', 0)} done, {states.get('leased', 0)} leased, "
+          f"{states.get('pending', 0)} pending; {done_rows} of {job['rows']} rows embedded")
+
+    print(f"{'worker':<28}{'shards':>8}{'rows':>10}{'texts/sec':>11}{'seen':>8}  current")
+    total_rate = 0.0
+    for name, last_seen, shard, shards, rows, seconds in db.execute(
+            "SELECT name, last_seen, shard, shards, rows, seconds FROM workers ORDER BY name").fetchall():
+        rate = rows / seconds if seconds else 0.0
+        if shard is not None and now - last_seen < LEASE_SECONDS:
+            total_rate += rate
+        current = ""
+        lease = None if shard is None else db.execute(
+            "SELECT done_rows, rows, lease_until FROM shards WHERE id = ? AND worker = ? AND state = 'leased'",
+            (shard, name)).fetchone()
+        if lease:
+            done, n, lease_until = lease
+            current = f"shard {shard} {done}/{n}" + (" (lease expired)" if lease_until < now else "")
+        print(f"{name:<28}{shards:>8}{rows:>10}{rate:>11.1f}{now - last_seen:>7.0f}s  {current}")
+    remaining = job["rows"] - done_rows
+    if remaining and total_rate:
+        print(f"~{remaining / total_rate / 3600:.1f} h left at {total_rate:.1f} texts/sec")
+    db.close()
+    return states
+
+# ---------------------------
+# MERGE
+# ---------------------------
+def merge(job_dir, cache_dir=None):
+    job = load_job(job_dir)
+    cache = EmbeddingCache(cache_dir or job["cache_dir"], job["cache_key"])
+    db = _connect(job_dir)
+    shards = db.execute("SELECT id, attempt, state FROM shards ORDER BY id").fetchall()
+    db.close()
+    added = 0
+    for shard, attempt, state in shards:
+        if state != 'done':
+            continue
+        # Earlier attempts may hold rows the finishing attempt skipped
+        for a in range(1, attempt + 1):
+            path = _out_dir(job_dir, shard, a)
+            if not os.path.isdir(path):
+                continue
+            seg = EmbeddingCache(path, job["cache_key"])
+            fresh = [nid for nid, (h, _, _) in seg.entries.items() if not cache.has(nid, h)]
+            if not fresh:
+                continue
+            _, vecs = seg.vectors(fresh)
+            cache.add(fresh, [seg.entries[nid][0] for nid in fresh], vecs)
+            added += len(fresh)
+        cache.flush()
+    unfinished = sum(state != 'done' for _, _, state in shards)
+    if unfinished:
+        print(f"{unfinished} shards are not done yet; merge again once they are")
+    metrics.count("rows_merged", added)
+    print(f"Merged {added} embeddings into {cache.path} ({len(cache)} cached)")
+    return cache
+
+if __name__ == "__main__":
+    usage = [
+        "Usage: python shard_embed.py plan opportunities.csv cache_dir job_dir [shard_rows]",
+        "       python shard_embed.py work job_dir [worker_name] [threads]",
+        "       python shard_embed.py status job_dir",
+        "       python shard_embed.py merge job_dir [cache_dir]",
+    ]
+    action = sys.argv[1] if len(sys.argv) > 1 else None
+    args = sys.argv[2:]
+    if action == "plan" and len(args) in (3, 4):
+        plan(*args[:3], int(args[3]) if len(args) == 4 else SHARD_ROWS)
+    elif action == "work" and 1 <= len(args) <= 3:
+        work(args[0], args[1] if len(args) > 1 and args[1] else None,
+             int(args[2]) if len(args) > 2 else None)
+    elif action == "status" and len(args) == 1:
+        status(args[0])
+    elif action == "merge" and len(args) in (1, 2):
+        merge(*args)
+    else:
+        print("\n".join(usage))
+        sys.exit(1)
@@ -0,0 +1,192 @@
+import sys
+import csv
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from embedding_store import load_store, as_float32
+from contract_reader import iter_batches
+from cluster import cluster_embeddings
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+WINDOW_MONTHS = 12  # Length of each rolling window
+STEP_MONTHS = 6  # Windows start this far apart (overlap when < WINDOW_MONTHS)
+MIN_WINDOW_ROWS = 50  # Windows with fewer contracts are skipped
+LINK_OVERLAP = 0.3  # Shared members / smaller cluster, for overlapping windows
+LINK_SIMILARITY = 0.9  # Centroid cosine, for windows that share no contracts
+WORKERS = 4
+
+# ---------------------------
+# TEMPORAL CLUSTER EVOLUTION
+# Reuses the reduced store the saved UMAP model produced (50d_embeddings.npy),
+# so nothing is embedded or reduced again. Each rolling PostedDate window is
+# clustered on its own (windows run in parallel), then clusters in
+# consecutive windows are linked:
+#
+#   windows share contracts   → overlap of members
+#   windows share none        → cosine of centroids
+#
+# Links give every cluster a track (a theme followed through time) and an
+# event: birth, continue, split, merge, with death rows for tracks that end.
+# ---------------------------
+def month_index(posted_date):
+    # "2024-03-01 ..." → months since year 0; unparseable dates → -1
+    year = pd.to_numeric(posted_date.str[:4], errors='coerce')
+    month = pd.to_numeric(posted_date.str[5:7], errors='coerce')
+    return (year * 12 + month - 1).fillna(-1).astype(np.int64).to_numpy()
+
+def month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def load_months(contract_csv, ids):
+    wanted = {id_.replace('CAP:', '') for id_ in ids}
+    months = {}
+    for batch in iter_batches(contract_csv, columns=['NoticeId', 'PostedDate']):
+        batch = batch[batch['NoticeId'].isin(wanted)]
+        months.update(zip(batch['NoticeId'], month_index(batch['PostedDate'])))
+    # Capability rows (CAP:) and unknown ids have no date and are left out
+    return np.array([months.get(id_, -1) for id_ in ids], dtype=np.int64)
+
+def make_windows(months):
+    dated = months[months >= 0]
+    if not len(dated):
+        return []
+    windows = []
+    start = int(dated.min())
+    last = int(dated.max())
+    while True:
+        end = start + WINDOW_MONTHS
+        rows = np.nonzero((months >= start) & (months < end))[0]
+        if len(rows) >= MIN_WINDOW_ROWS:
+            windows.append((start, end, rows))
+        if end > last:
+            return windows
+        start += STEP_MONTHS
+
+# ---------------------------
+# WORKERS
+# Each worker memory-maps the store once; tasks only carry row indices.
+# ---------------------------
+_store = {}
+
+def _init_worker(store_path):
+    _store['data'] = load_store(store_path)[1]
+
+def _cluster_window(rows):
+    data = as_float32(_store['data'][rows])
+    # WORKERS windows already run at once; all-core core distances in each
+    # would oversubscribe the CPUs
+    labels = cluster_embeddings(data, core_dist_n_jobs=1).labels_
+    clusters = {}
+    for label in sorted(set(labels) - {-1}):
+        members = rows[labels == label]
+        centroid = data[labels == label].mean(axis=0)
+        clusters[int(label)] = (members, centroid / max(np.linalg.norm(centroid), 1e-12))
+    return clusters
+
+# ---------------------------
+# LINKING
+# ---------------------------
+def link_windows(prev, curr):
+    # prev/curr: {label: (members, unit centroid)} → [(prev_label, curr_label, score)]
+    links = []
+    shared = bool(prev) and bool(curr) and np.intersect1d(
+        np.concatenate([m for m, _ in prev.values()]),
+        np.concatenate([m for m, _ in curr.values()]),
+    ).size > 0
+    for a, (ma, ca) in prev.items():
+        for b, (mb, cb) in curr.items():
+            if shared:
+                score = np.intersect1d(ma, mb, assume_unique=True).size / min(len(ma), len(mb))
+                ok = score >= LINK_OVERLAP
+            else:
+                score = float(ca @ cb)
+                ok = score >= LINK_SIMILARITY
+            if ok:
+                links.append((a, b, float(score)))
+    return links
+
+def track_clusters(windows, results):
+    rows = []
+    tracks = {}  # (window, label) → track id
+    next_track = 0
+    prev = {}
+    for w, ((start, end, window_rows), clusters) in enumerate(zip(windows, results)):
+        links = link_windows(prev, clusters) if w else []
+        parents, children = {}, {}
+        for a, b, score in links:
+            parents.setdefault(b, []).append((score, a))
+            children.setdefault(a, []).append((score, b))
+
+        for a in prev:
+            if a not in children:
+                rows.append(_row(windows[w - 1], w - 1, tracks[(w - 1, a)], a, 0, 0, "death", []))
+
+        for b, (members, _) in clusters.items():
+            ps = sorted(parents.get(b, []), reverse=True)
+            if not ps:
+                event = "birth"
+            elif len(ps) > 1:
+                event = "merge"
+            elif len(children[ps[0][1]]) > 1:
+                event = "split"
+            else:
+                event = "continue"
+
+            # Continue the strongest parent's track if this is also that
+            # parent's strongest child; otherwise start a new track
+            track = None
+            if ps:
+                best = ps[0][1]
+                if max(children[best])[1] == b:
+                    track = tracks[(w - 1, best)]
+            if track is None:
+                track, next_track = next_track, next_track + 1
+            tracks[(w, b)] = track
+            rows.append(_row((start, end, window_rows), w, track, b, len(members),
+                             len(members) / len(window_rows), event,
+                             [tracks[(w - 1, a)] for _, a in ps]))
+        prev = clusters
+    return rows
+
+def _row(window, w, track, label, size, share, event, from_tracks):
+    start, end, _ = window
+    return [w, month_label(start), month_label(end - 1), track, label, size,
+            round(share, 4), event, " ".join(str(t) for t in from_tracks)]
+
+def save_table(rows, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Window", "Start", "End", "Track", "Cluster", "Size",
+                         "Share", "Event", "FromTracks"])
+        writer.writerows(rows)
+    print(f"Cluster evolution saved to {output_csv}")
+
+def main():
+    if len(sys.argv) != 4:
+        print("Usage: python temporal.py reduced.npy opportunities.csv output.csv")
+        sys.exit(1)
+    store_path, contract_csv, output_csv = sys.argv[1:]
+
+    ids, _ = load_store(store_path)
+    months = load_months(contract_csv, ids)
+    print(f"{int((months >= 0).sum())} of {len(ids)} contracts have a PostedDate")
+    windows = make_windows(months)
+    print(f"Clustering {len(windows)} windows of {WINDOW_MONTHS} months (step {STEP_MONTHS})...")
+
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker,
+                             initargs=(store_path,)) as executor:
+        results = list(executor.map(_cluster_window, [rows for _, _, rows in windows]))
+    for (start, end, rows), clusters in zip(windows, results):
+        print(f"  {month_label(start)} → {month_label(end - 1)}: "
+              f"{len(rows)} contracts, {len(clusters)} clusters")
+
+    rows = track_clusters(windows, results)
+    print(f"{len({r[3] for r in rows})} tracks, "
+          + ", ".join(f"{sum(r[7] == e for r in rows)} {e}"
+                      for e in ("birth", "continue", "split", "merge", "death")))
+    save_table(rows, output_csv)
+
+if __name__ == "__main__":
+    main()
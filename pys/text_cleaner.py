@@ -0,0 +1,211 @@
+import re
+import sys
+import csv
+import time
+import heapq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# ---------------------------
+# BOILERPLATE STRIPPING
+# The original cleaner ran text.replace(phrase, '') once per phrase, in
+# order. BoilerplateStripper gives byte-identical output for the same
+# phrase order, but only touches phrases that actually occur:
+#
+#   1. one regex scan (a character trie compiled into a single pattern,
+#      longest match first) finds every phrase present in the text
+#   2. present phrases are replaced in their original order
+#   3. a removal can join text into a new occurrence; only the window
+#      around each join point is rescanned for those
+# ---------------------------
+HTML_RE = re.compile(r'<[^>]+>')
+URL_RE = re.compile(r'http\S+|www\S+')
+EMAIL_RE = re.compile(r'\S+@\S+')
+PUNCT_RE = re.compile(r'[^\w\s]')
+SPACE_RE = re.compile(r'\s+')
+
+def load_phrases(path):
+    # File order, de-duplicated; this order defines the replacement order
+    with open(path, newline='', encoding='utf-8') as f:
+        phrases = (row[0].strip().lower() for row in csv.reader(f) if row)
+        return list(dict.fromkeys(p for p in phrases if p))
+
+def _build_trie(phrases):
+    trie = {}
+    for p in phrases:
+        node = trie
+        for ch in p:
+            node = node.setdefault(ch, {})
+        node[''] = True
+    return trie
+
+def _trie_pattern(node):
+    alts = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch != '']
+    if not alts:
+        return ''
+    body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+    # Greedy optional, so the longer phrase wins when a shorter one ends here
+    return '(?:' + body + ')?' if '' in node else body
+
+class BoilerplateStripper:
+    def __init__(self, phrases):
+        self.phrases = list(dict.fromkeys(p for p in phrases if p))
+        self.rank = {p: i for i, p in enumerate(self.phrases)}
+        self.max_len = max((len(p) for p in self.phrases), default=0)
+        self.pattern = None
+        if self.phrases:
+            self.pattern = re.compile('(?=(' + _trie_pattern(_build_trie(self.phrases)) + '))')
+        self._prefix_ranks = {}
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _ranks_at(self, longest):
+        # Every phrase starting where `longest` matched is a prefix of it
+        ranks = self._prefix_ranks.get(longest)
+        if ranks is None:
+            ranks = [(self.rank[longest[:n]], n) for n in range(1, len(longest) + 1)
+                     if longest[:n] in self.rank]
+            self._prefix_ranks[longest] = ranks
+        return ranks
+
+    def _present(self, text, pos=0, endpos=None, spanning=None):
+        endpos = len(text) if endpos is None else endpos
+        for m in self.pattern.finditer(text, pos, endpos):
+            start = m.start()
+            if spanning is not None and start >= spanning:
+                break
+            for r, n in self._ranks_at(m.group(1)):
+                if spanning is None or start < spanning < start + n:
+                    yield r
+
+    def strip(self, text):
+        if self.pattern is None:
+            return text
+        heap = list(set(self._present(text)))
+        heapq.heapify(heap)
+        pending = set(heap)
+        while heap:
+            r = heapq.heappop(heap)
+            pending.discard(r)
+            phrase = self.phrases[r]
+            width = len(phrase)
+
+            # Same left-to-right, non-overlapping occurrences str.replace uses
+            hits = []
+            at = text.find(phrase)
+            while at != -1:
+                hits.append(at)
+                at = text.find(phrase, at + width)
+            if not hits:
+                continue
+            text = text.replace(phrase, '')
+
+            joins = sorted({at - i * width for i, at in enumerate(hits)})
+            for j in joins:
+                lo = max(0, j - self.max_len + 1)
+                hi = min(len(text), j + self.max_len - 1)
+                for q in self._present(text, lo, hi, spanning=j):
+                    if q > r and q not in pending:
+                        pending.add(q)
+                        heapq.heappush(heap, q)
+        return text
+
+# ---------------------------
+# CLEANERS
+# ---------------------------
+def clean_text(title, description, stripper, sep_token):
+    text = f"{title} {sep_token} {description}".lower()
+    text = stripper.strip(text)
+    text = HTML_RE.sub('', text)  # Remove HTML
+    text = URL_RE.sub('', text)  # Remove URLs
+    text = EMAIL_RE.sub('', text)  # Remove emails
+    text = PUNCT_RE.sub('', text)  # Remove punctuation
+    text = SPACE_RE.sub(' ', text)  # Collapse whitespace
+    cleaned = text.strip()
+    return cleaned, len(cleaned)
+
+def reference_clean(title, description, phrases, sep_token):
+    # The pre-stripper cleaner, kept as the golden reference
+    text = f"{title} {sep_token} {description}".lower()
+    for phrase in phrases:
+        text = text.replace(phrase, '')
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'http\S+|www\S+', '', text)
+    text = re.sub(r'\S+@\S+', '', text)
+    text = re.sub(r'[^\w\s]', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    cleaned = text.strip()
+    return cleaned, len(cleaned)
+
+# ---------------------------
+# PROCESS POOL
+# ---------------------------
+_worker = {}
+
+def _init_worker(phrases, sep_token):
+    _worker['stripper'] = BoilerplateStripper(phrases)
+    _worker['sep'] = sep_token
+
+def _clean_chunk(pairs):
+    return [clean_text(t, d, _worker['stripper'], _worker['sep']) for t, d in pairs]
+
+def _chunks(pairs, chunk):
+    buf = []
+    for pair in pairs:
+        buf.append(pair)
+        if len(buf) == chunk:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+def clean_rows(pairs, phrases, sep_token, workers=4, chunk=500):
+    # pairs: iterable of (title, description); returns [(cleaned, count)] in order.
+    # Chunks are submitted as the input streams in, at most 2 per worker in
+    # flight (executor.map would read the whole iterable up front)
+    out = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(phrases, sep_token)) as executor:
+        for buf in _chunks(pairs, chunk):
+            if len(pending) >= 2 * workers:
+                out.extend(pending.popleft().result())
+            pending.append(executor.submit(_clean_chunk, buf))
+        while pending:
+            out.extend(pending.popleft().result())
+    return out
+
+# ---------------------------
+# GOLDEN CHECK
+# ---------------------------
+def verify(opps_csv, phrases_csv, n=2000, sep_token="[SEP]"):
+    from contract_reader import iter_rows
+
+    phrases = load_phrases(phrases_csv)
+    stripper = BoilerplateStripper(phrases)
+    rows = []
+    for row in iter_rows(opps_csv, columns=['Title', 'Description']):
+        rows.append((row['Title'], row['Description']))
+        if len(rows) >= n:
+            break
+
+    start = time.perf_counter()
+    golden = [reference_clean(t, d, phrases, sep_token) for t, d in rows]
+    ref_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = [clean_text(t, d, stripper, sep_token) for t, d in rows]
+    fast_time = time.perf_counter() - start
+
+    mismatches = sum(g != f for g, f in zip(golden, fast))
+    print(f"{len(rows)} rows, {len(phrases)} phrases, {mismatches} mismatches")
+    print(f"reference: {ref_time:.2f}s, stripper: {fast_time:.2f}s "
+          f"({ref_time / max(fast_time, 1e-9):.1f}x)")
+    return mismatches
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5) or sys.argv[1] != "verify":
+        print("Usage: python text_cleaner.py verify opportunities.csv boilerplate_phrases.csv [n]")
+        sys.exit(1)
+    bad = verify(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) == 5 else 2000)
+    sys.exit(1 if bad else 0)
@@ -6,3 +6,12 @@ export CONTEXT_ROOT="$PROJECT_ROOT"
 export VENV_PYTHON="$CONTEXT_ROOT/.venv/bin/python"
 export INTR="$CONTEXT_ROOT/intermediary"
 export PYS="$CONTEXT_ROOT/pys"
+
+# Uncomment to write per-script metrics (.json and Prometheus .prom) here;
+# METRICS_PROFILE=1 also dumps a cProfile file per stage
+#export METRICS_DIR="$CONTEXT_ROOT/metrics"
+#export METRICS_PROFILE=1
+
+# Cached HDBSCAN trees for cluster sweeps and refits (see cluster.py);
+# never pruned, unset to disable
+export HDBSCAN_CACHE="$INTR/model/hdbscan_tree"
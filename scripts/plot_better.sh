@@ -2,45 +2,170 @@
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 source "$SCRIPT_DIR/env.sh"
 
-# Takes in 1 arguement for csv to pull from
-# Runs entire pipeline
+# Takes in 1 arguement for csv to pull from, optionally full|scalable
+# Runs entire pipeline in one process; stages whose inputs are unchanged
+# are skipped (see intermediary/pipeline.json for timings)
 plot_from_scratch() {
 	if [ ! -d ""$INTR"" ]; then 
 		mkdir -p "$INTR"
 	fi
 
-	"$VENV_PYTHON" "$PYS/sbert_filter_embed.py" \
+	"$VENV_PYTHON" "$PYS/pipeline.py" \
 	"$1" \
-	"$CONTEXT_ROOT/cache.json" \
-	"$INTR/filtered_embeddings.json" \
-	"$CONTEXT_ROOT/capabilities.txt" 
+	${2:+"$2"}
+}
+
+# Takes in embedding store to plot and the csv it was derived from
+plot_json() {
+	"$VENV_PYTHON" "$PYS/plotting.py" \
+	"$1" \
+	"$INTR/cluster_embeddings.json" \
+	"$2" \
+	"$CONTEXT_ROOT/plot.html" \
+	"$INTR/model/umap_2d.pkl"
+}
+
+# Takes in a legacy id -> vector json and the .npy store to write
+# One-time conversion of old cache.json / *_embeddings.json files
+convert_json_store() {
+	"$VENV_PYTHON" "$PYS/embedding_store.py" \
+	"$1" \
+	"$2"
+}
+
+# Takes in the cache directory and a legacy cache.npy store
+# One-time import of a pre-segment cache into the append-only cache
+import_cache_store() {
+	"$VENV_PYTHON" "$PYS/embedding_cache.py" \
+	import \
+	"$1" \
+	"$2"
+}
+
+# Takes in the SAM.gov csv and the directory to write
+# One-time conversion to a Parquet dataset partitioned by PostedDate year;
+# every stage that takes the csv also accepts this directory
+convert_csv_parquet() {
+	"$VENV_PYTHON" "$PYS/contract_reader.py" \
+	to_parquet \
+	"$1" \
+	"$2"
+}
+
+# Takes in the SAM.gov csv and boilerplate_phrases.csv
+# Checks the fast cleaner against the reference cleaner on a sample
+verify_cleaner() {
+	"$VENV_PYTHON" "$PYS/text_cleaner.py" \
+	verify \
+	"$1" \
+	"$2"
+}
 
-	"$VENV_PYTHON" "pys/umap_reduce.py" \
-	"$INTR/filtered_embeddings.json" \
-	768 \
-	"$INTR/50d_embeddings.json" \
+# Takes in assign (label only new contracts) or refit (full re-cluster that
+# keeps previous cluster ids where members overlap)
+# Nightly updates run assign; refit on a slower schedule
+cluster_update() {
+	"$VENV_PYTHON" "$PYS/cluster.py" \
+	"$1" \
+	"$INTR/50d_embeddings.npy" \
 	50 \
-	"$INTR/model/umap.pkl" 
-	
+	"$INTR/cluster_embeddings.json" \
+	"$INTR/model/hdbscan.pkl"
+}
+
+# Takes in the csv the embeddings were derived from
+# Clusters rolling PostedDate windows of the reduced store and tracks them
+cluster_evolution() {
+	"$VENV_PYTHON" "$PYS/temporal.py" \
+	"$INTR/50d_embeddings.npy" \
+	"$1" \
+	"$CONTEXT_ROOT/cluster_evolution.csv"
+}
+
+# Takes in the hierarchy csv from contracttodep.py
+# Builds the agency index aligned with the reduced store
+agency_index() {
+	"$VENV_PYTHON" "$PYS/agency_index.py" \
+	build \
+	"$INTR/50d_embeddings.npy" \
+	"$1"
+}
+
+# Takes in a cluster id, optionally the level (office|subtier|department)
+# and the first PostedDate year to count
+agency_top() {
+	"$VENV_PYTHON" "$PYS/agency_index.py" \
+	top \
+	"$INTR/50d_embeddings.npy" \
+	"$INTR/cluster_embeddings.json" \
+	"$1" \
+	${2:-office} \
+	${3:+"$3"}
+}
+
+# Optionally takes comma-separated min_cluster_size and min_samples values
+# Sweeps HDBSCAN settings on the reduced store (one tree per min_samples)
+cluster_sweep() {
 	"$VENV_PYTHON" "$PYS/cluster.py" \
-	"$INTR/50d_embeddings.json" \
+	sweep \
+	"$INTR/50d_embeddings.npy" \
 	50 \
-	"$INTR/cluster_embeddings.json" 
-	
-	plot_json "$INTR/50d_embeddings.json" "$1"
-	#"$VENV_PYTHON" "$PYS/plotting.py" \
-	#"$INTR/50d_embeddings.json" \
-	#"$INTR/cluster_embeddings.json" \
-	#"$1" 
-	#"$CONTEXT_ROOT/plot.html" 
+	"$CONTEXT_ROOT/cluster_sweep.csv" \
+	${1:+"$1"} \
+	${2:+"$2"}
 }
 
-# Takes in json to plot and the csv it was derived from
-plot_json() {
-	"$VENV_PYTHON" "$PYS/plotting.py" \
+# Takes in the csv and optionally a Jaccard threshold (default 0.85)
+# Writes the near-duplicate families embedding would collapse
+near_duplicates() {
+	"$VENV_PYTHON" "$PYS/near_dup.py" \
 	"$1" \
+	"$CONTEXT_ROOT/near_duplicates.csv" \
+	${2:+"$2"}
+}
+
+# Takes in the csv the embeddings were derived from
+# Keywords and representative notices per cluster; reruns only redo
+# changed texts and clusters
+cluster_keywords() {
+	"$VENV_PYTHON" "$PYS/cluster_keywords.py" \
+	"$INTR/50d_embeddings.npy" \
 	"$INTR/cluster_embeddings.json" \
-	"$2" \
-	"$CONTEXT_ROOT/plot.html" 
+	"$1" \
+	"$INTR/cluster_keywords.csv" \
+	"$INTR/keywords"
+}
+
+# Takes in the csv to embed
+# Plans a sharded embedding job over everything missing from the cache;
+# start embed_worker on any number of boxes sharing $INTR/embed_job
+embed_plan() {
+	"$VENV_PYTHON" "$PYS/shard_embed.py" \
+	plan \
+	"$1" \
+	"$CONTEXT_ROOT/cache" \
+	"$INTR/embed_job"
+}
+
+# Optionally takes a worker name and a thread count
+# Claims and embeds shards until none are left; safe to kill and restart
+embed_worker() {
+	"$VENV_PYTHON" "$PYS/shard_embed.py" \
+	work \
+	"$INTR/embed_job" \
+	"${1:-}" \
+	${2:+"$2"}
 }
 
+# Per-worker progress and throughput, then merge once every shard is done
+embed_status() {
+	"$VENV_PYTHON" "$PYS/shard_embed.py" \
+	status \
+	"$INTR/embed_job"
+}
+
+embed_merge() {
+	"$VENV_PYTHON" "$PYS/shard_embed.py" \
+	merge \
+	"$INTR/embed_job"
+}
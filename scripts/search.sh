@@ -11,3 +11,40 @@ searchsem() {
 	0.88 \
 	top.csv
 }
+
+# Takes in the embeddings store and optional k
+# Builds the search indexes and reports ANN recall@k against exact search
+buildann() {
+	"$VENV_PYTHON" "$PYS/ann_index.py" \
+	recall \
+	"$1" \
+	${2:-10}
+}
+
+# Takes in the embeddings store and optional k
+# Builds the float16 and PQ search tiers and reports memory, latency and recall@k
+buildtier() {
+	"$VENV_PYTHON" "$PYS/compressed_index.py" \
+	report \
+	"$1" \
+	${2:-10}
+}
+
+# Takes in the embeddings store and an optional tier (ann, f16 or pq)
+# Starts the resident search server (model and cache stay loaded)
+searchserve() {
+	"$VENV_PYTHON" "$PYS/search_server.py" \
+	"$1" \
+	All_Contract_Opportunities_1998_2030.csv \
+	${2:+8765 "$2"}
+}
+
+# Takes in one or more sentences and queries a running searchserve
+# TOP_K=N keeps the best N matches per sentence
+searchfast() {
+	"$VENV_PYTHON" "$PYS/search_client.py" \
+	0.88 \
+	top.csv \
+	${TOP_K:+top_k="$TOP_K"} \
+	"$@"
+}